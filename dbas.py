@@ -24,15 +24,33 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import argparse
+import array
 import base64
+import binascii
+import datetime
+import errno
+import fcntl
+import hashlib
 import json
+import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import platform
+import plistlib
+import pwd
+import re
+import select
 import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import traceback
+from xml.parsers.expat import ExpatError
 
 # Py3k compatible
 try:
@@ -40,12 +58,36 @@ try:
 except ImportError:
     import ConfigParser as configparser
 
+# Used to read the ACLs without spawning anything, if available
+try:
+    import ctypes
+    LIBC = ctypes.CDLL(None, use_errno=True)
+except (ImportError, OSError):
+    LIBC = None
+
 
 #######################
 # Commonly used paths #
 #######################
 
 DBAS_DB_PATH = 'Dbas'
+DBAS_STATE_PATH = '.dbas'
+STATE_CACHE_FILE = 'state.json'
+SNAPSHOTS_PATH = 'snapshots'
+TRASH_PATH = 'trash'
+LOCK_FILE = 'lock'
+LAST_RUN_FILE = 'last_run.json'
+
+# Summary of each host, in the Dbas folder
+HOSTS_PATH = '.dbas-hosts'
+
+# What the last backups left in the Dbas folder, for the restores to know
+# when Dropbox is done syncing it
+MANIFEST_FILE = '.dbas-manifest.json'
+
+# Object store and index of each application using it, in the Dbas folder
+OBJECTS_PATH = '.objects'
+INDEX_PATH = '.index'
 PREFERENCES = 'Library/Preferences/'
 APP_SUPPORT = 'Library/Application Support/'
 
@@ -56,6 +98,14 @@ APP_SUPPORT = 'Library/Application Support/'
 # Applications supported
 # Format:
 # Application Name: List of files (relative path from the user's home)
+# or
+# Application Name: {'files': List of files,
+#                    'processes': Names of the processes of the application,
+#                                 it is left alone while they run,
+#                    'storage': STORAGE_OBJECTS to keep its files in the
+#                               object store instead of linking them,
+#                    'mode': APP_MODE_COPY to sync copies of its files instead
+#                            of linking them}
 
 SUPPORTED_APPS = {
     'ABBY FineReader for ScanSnap': [PREFERENCES + 'com.abbyy.FineReaderForScanSnap.plist'],
@@ -368,13 +418,17 @@ SUPPORTED_APPS = {
               PREFERENCES + 'com.stata.stata12.plist',
               PREFERENCES + 'com.stata.stata13.plist'],
 
-    'Sublime Text 2': [APP_SUPPORT + 'Sublime Text 2/Installed Packages',
-                       APP_SUPPORT + 'Sublime Text 2/Packages',
-                       APP_SUPPORT + 'Sublime Text 2/Pristine Packages',
-                       APP_SUPPORT + 'Sublime Text 2/Settings'],
+    'Sublime Text 2': {
+        'files': [APP_SUPPORT + 'Sublime Text 2/Installed Packages',
+                  APP_SUPPORT + 'Sublime Text 2/Packages',
+                  APP_SUPPORT + 'Sublime Text 2/Pristine Packages',
+                  APP_SUPPORT + 'Sublime Text 2/Settings'],
+        'processes': ['Sublime Text 2', 'sublime_text']},
 
-    'Sublime Text 3': [APP_SUPPORT + 'Sublime Text 3/Installed Packages',
-                       APP_SUPPORT + 'Sublime Text 3/Packages'],
+    'Sublime Text 3': {
+        'files': [APP_SUPPORT + 'Sublime Text 3/Installed Packages',
+                  APP_SUPPORT + 'Sublime Text 3/Packages'],
+        'processes': ['Sublime Text', 'sublime_text']},
 
     'Subversion': ['.subversion'],
 
@@ -476,36 +530,399 @@ RESTORE_MODE = 'restore'
 # Mode used to remove Dbas and reset and config file
 UNINSTALL_MODE = 'uninstall'
 
+# Mode used to report the state of each application, without changing it
+STATUS_MODE = 'status'
+
+# Mode used to put back the files of an application as they were before
+# their last replacement
+ROLLBACK_MODE = 'rollback'
+CONFLICTS_MODE = 'conflicts'
+DRIFT_MODE = 'drift'
+RELINK_MODE = 'relink'
+
+# Statuses reported by the status mode, the most urgent first
+STATUS_BROKEN = 'broken link'
+STATUS_CONFLICT = 'conflicting'
+STATUS_UNMANAGED = 'unmanaged local copy'
+STATUS_BACKUP_ONLY = 'backup-only'
+STATUS_LINKED = 'linked'
+STATUS_PRIORITY = [STATUS_BROKEN, STATUS_CONFLICT, STATUS_UNMANAGED,
+                   STATUS_BACKUP_ONLY, STATUS_LINKED]
+# An application having no file on a host
+STATUS_MISSING = 'missing'
+
+# What happened to a file
+ACTION_BACKED_UP = 'backed up'
+ACTION_RESTORED = 'restored'
+ACTION_REPLACED = 'replaced'
+ACTION_KEPT = 'kept'
+ACTION_UNINSTALLED = 'uninstalled'
+ACTION_ROLLED_BACK = 'rolled back'
+ACTION_LINKED = 'linked to identical backup'
+ACTION_DROPPED = 'dropped identical copies'
+ACTION_KEPT_NEWEST = 'kept newest copy'
+ACTION_MERGED = 'merged copies'
+ACTION_UNRESOLVED = 'left unresolved'
+ACTION_SKIPPED_LARGE = 'skipped, too large'
+ACTION_RELINKED = 'relinked'
+ACTION_COPIED_TO_BACKUP = 'copied to backup'
+ACTION_COPIED_TO_HOME = 'copied to home'
+ACTION_DELETED = 'deleted'
+
+# How conflicted copies left by Dropbox are resolved
+CONFLICT_POLICY_IDENTICAL = 'identical'
+CONFLICT_POLICY_NEWEST = 'newest'
+CONFLICT_POLICY_PLIST_MERGE = 'plist-merge'
+CONFLICT_POLICIES = [CONFLICT_POLICY_IDENTICAL, CONFLICT_POLICY_NEWEST,
+                     CONFLICT_POLICY_PLIST_MERGE]
+
+# e.g. "Preferences (laptop's conflicted copy 2013-10-01 (1)).plist"
+CONFLICTED_COPY_PATTERN = re.compile(
+    r"^(?P<stem>.+?) \((?P<host>.+)'s conflicted copy"
+    r" (?P<date>\d{4}-\d{2}-\d{2})(?: \(\d+\))?\)(?P<extension>\.[^.]*)?$")
+
+# How the files of an application are kept in the Dbas folder
+STORAGE_LINKS = 'links'
+STORAGE_OBJECTS = 'objects'
+
+# How the files of an application are kept in the home
+APP_MODE_LINK = 'link'
+APP_MODE_COPY = 'copy'
+
+# Unreferenced objects are only removed once this old, other hosts may
+# reference them in an index not synced yet
+OBJECTS_GC_GRACE_DAYS = 7
+
+# What sync() does to a file or folder
+SYNC_DELETE = 'delete'
+SYNC_MKDIR = 'mkdir'
+SYNC_COPY = 'copy'
+
+# I/O errors worth trying again, a few times, waiting longer each time
+TRANSIENT_ERRNOS = (errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.ETIMEDOUT,
+                    errno.ESTALE, errno.ETXTBSY)
+RETRY_COUNT = 3
+RETRY_DELAY_SECONDS = 0.5
+
+# Snapshots kept by application, by default
+SNAPSHOTS_MAX_COUNT = 5
+SNAPSHOTS_MAX_AGE_DAYS = 30
+# Snapshots of the application profiles created without a name
+SNAPSHOTS_UNNAMED_APP = '_unnamed'
+
+# Size and age of the deleted files kept in the trash, by default
+TRASH_MAX_SIZE_MB = 1024
+TRASH_MAX_AGE_DAYS = 7
+
+# What is done with the files above the size limit when backing up
+LARGE_FILE_POLICY_COPY = 'copy'
+LARGE_FILE_POLICY_SKIP = 'skip'
+LARGE_FILE_POLICY_DEFER = 'defer'
+LARGE_FILE_POLICIES = [LARGE_FILE_POLICY_COPY, LARGE_FILE_POLICY_SKIP,
+                       LARGE_FILE_POLICY_DEFER]
+
+# Large files are copied chunk by chunk, by default
+LARGE_FILE_SIZE_MB = 64
+LARGE_FILE_CHUNK_SIZE_KB = 1024
+
+# Actions leaving a link to the backup in the home
+LINK_ACTIONS = [ACTION_BACKED_UP, ACTION_RESTORED, ACTION_REPLACED,
+                ACTION_LINKED]
+
+# Metrics written in the node_exporter textfile, with their help
+METRICS_HELP = {
+    'dbas_run_duration_seconds': "Duration of the last run, by mode",
+    'dbas_run_timestamp_seconds': "When the last run ended, by mode",
+    'dbas_app_duration_seconds': "Time spent on each application",
+    'dbas_files_copied': "Files copied, by application",
+    'dbas_bytes_copied': "Bytes copied, by application",
+    'dbas_links_created': "Links to the backup created, by application",
+    'dbas_conflicts': "Files found in the way, by application",
+    'dbas_failures': "Runs, homes or applications that failed, by mode",
+}
+
+# Log level of the per application summaries, the only lines left when quiet
+SUMMARY_LEVEL = 25
+logging.addLevelName(SUMMARY_LEVEL, 'SUMMARY')
+
+# Number of log lines kept in memory before being written at once
+LOG_BUFFER_SIZE = 200
+# Largest write to a pipe that is never mixed with the writes of other
+# processes, 512 bytes at least on POSIX
+LOG_ATOMIC_WRITE_SIZE = getattr(select, 'PIPE_BUF', 512)
+
+# Everything Dbas does is logged there, silently unless a handler is set up
+LOGGER = logging.getLogger('dbas')
+LOGGER.addHandler(logging.NullHandler())
+
 # Support platforms
 PLATFORM_DARWIN = 'Darwin'
 PLATFORM_LINUX = 'Linux'
 
+# Reading the inode flags on GNU/Linux, from <linux/fs.h>
+FS_IOC_GETFLAGS = 0x80006601 | (struct.calcsize('l') << 16)
+FS_IMMUTABLE_FL = 0x00000010
+
+# Extended ACLs on OS X, from <sys/acl.h>
+ACL_TYPE_EXTENDED = 0x00000100
+
+# Binary property lists, see CFBinaryPList.c
+BINARY_PLIST_HEADER = 'bplist00'
+BINARY_PLIST_EPOCH = datetime.datetime(2001, 1, 1)
+# Raised when reading a file that is not a valid property list
+PLIST_ERRORS = (ValueError, IndexError, struct.error, SyntaxError,
+                ExpatError)
+
+# Number of paths given at once to chmod, setfacl, chflags or chattr
+PATHS_BY_CALL = 256
+
+# Idle I/O priority on OS X, from <sys/resource.h>
+IOPOL_TYPE_DISK = 0
+IOPOL_SCOPE_THREAD = 1
+IOPOL_DEFAULT = 0
+IOPOL_THROTTLE = 3
+
+# Cloning a file on GNU/Linux, from <linux/fs.h>
+FICLONE = 0x40049409
+
+# What a storage backend is probed for, to choose the fast paths
+BACKEND_CAPABILITIES = ('hardlink', 'reflink')
+
+# Watching a folder on GNU/Linux, from <sys/inotify.h>
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_ACTIVITY = (0x00000002 | 0x00000004 | 0x00000008 | 0x00000040
+               | 0x00000080 | 0x00000100 | 0x00000200)
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Dropbox is done syncing the Dbas folder when nothing changed in it for
+# that long, or when it holds what the manifest lists, by default
+SETTLE_QUIET_SECONDS = 10.0
+SETTLE_TIMEOUT_SECONDS = 600.0
+# How often the Dbas folder is looked at when it can't be watched
+SETTLE_POLL_SECONDS = 1
+
+# Progress reports, and when they are repeated
+PROGRESS_TTY = 'tty'
+PROGRESS_JSON = 'json'
+PROGRESS_FORMATS = (PROGRESS_TTY, PROGRESS_JSON)
+PROGRESS_INTERVAL_SECONDS = 1
+
 
 ###########
 # Classes #
 ###########
 
 
+class DbasError(Exception):
+    """Raised when Dbas can't go on"""
+
+
+class LargeFileError(DbasError):
+    """Raised by a Copier refusing large files when it comes across one"""
+
+
+class BufferedStreamHandler(logging.Handler):
+    """
+    Logging handler writing to a stream by batches of lines.
+
+    Lines are kept in memory and written when the buffer is full, when a
+    warning comes in or when flushed, by writes of whole lines no larger
+    than PIPE_BUF: the output of parallel workers sharing a pipe is not mixed
+    within a line, unless that line alone is larger than PIPE_BUF.
+    """
+
+    def __init__(self, stream, capacity=LOG_BUFFER_SIZE):
+        """
+        Args:
+            stream (file): Where to write the lines
+            capacity (int): Number of lines to buffer
+        """
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.capacity = capacity
+        self.lines = []
+        # Called before writing lines, e.g. to clear a progress line
+        self.before_write = None
+
+    def emit(self, record):
+        """Buffer the formatted record, write the buffer if needed"""
+        try:
+            self.lines.append(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+            return
+
+        if (len(self.lines) >= self.capacity
+                or record.levelno >= logging.WARNING):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered lines"""
+        self.acquire()
+        try:
+            lines = self.lines
+            self.lines = []
+            if lines and self.before_write is not None:
+                self.before_write()
+            data = ''
+            for line in lines:
+                if data and len(data) + len(line) > LOG_ATOMIC_WRITE_SIZE:
+                    self.stream.write(data)
+                    self.stream.flush()
+                    data = ''
+                data += line
+            if data:
+                self.stream.write(data)
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class TextFormatter(logging.Formatter):
+    """Format records as plain lines, like Dbas always printed them"""
+
+    def __init__(self, with_home=False):
+        """
+        Args:
+            with_home (bool): Prefix each line with the home it is about
+        """
+        logging.Formatter.__init__(self)
+        self.with_home = with_home
+
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, 'fields', {})
+        if self.with_home and 'home' in fields:
+            message = "{}: {}".format(fields['home'], message)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON objects, one by line"""
+
+    def format(self, record):
+        entry = {'time': record.created,
+                 'level': record.levelname,
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, sort_keys=True)
+
+
+class FileResult(object):
+    """What happened to a file of an application"""
+
+    def __init__(self, filename, action):
+        """
+        Args:
+            filename (str): Relative path of the file from the home
+            action (str): One of the ACTION_* constants
+        """
+        self.filename = filename
+        self.action = action
+
+    def __repr__(self):
+        return "FileResult({!r}, {!r})".format(self.filename, self.action)
+
+
+class AppResult(object):
+    """What happened to the files of an application"""
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): Name of the application
+        """
+        self.name = name
+        self.files = []
+        # Why the application was not handled at all, if it was not
+        self.skipped = None
+        # What went wrong, if the application failed
+        self.error = None
+
+    def add(self, filename, action):
+        """
+        Record what happened to a file
+
+        Args:
+            filename (str): Relative path of the file from the home
+            action (str): One of the ACTION_* constants
+        """
+        self.files.append(FileResult(filename, action))
+
+    def as_dict(self):
+        """
+        Returns:
+            (dict): JSON serializable form of the result, see from_dict()
+        """
+        return {'name': self.name, 'skipped': self.skipped,
+                'error': self.error,
+                'files': [[file_result.filename, file_result.action]
+                          for file_result in self.files]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Args:
+            data (dict): Result returned by as_dict()
+
+        Returns:
+            (AppResult)
+        """
+        result = cls(data['name'])
+        result.skipped = data['skipped']
+        result.error = data.get('error')
+        for filename, action in data['files']:
+            result.add(filename, action)
+        return result
+
+    def counts(self):
+        """
+        Returns:
+            (dict): Number of files by action
+        """
+        counts = {}
+        for file_result in self.files:
+            counts[file_result.action] = counts.get(file_result.action, 0) + 1
+        return counts
+
+    def __repr__(self):
+        return "AppResult({!r}, {!r})".format(self.name, self.files)
+
+
 class ApplicationProfile(object):
     """Instantiate this class with application specific data"""
 
-    def __init__(self, dbas, files):
+    def __init__(self, dbas, files, name=None, processes=None):
         """
         Create an ApplicationProfile instance
 
         Args:
             dbas (Dbas)
             files (list)
+            name (str): Name of the application, used in the results
+            processes (list): Names of the processes of the application
         """
         assert isinstance(dbas, Dbas)
         assert isinstance(files, list)
 
         self.dbas = dbas
         self.files = files
-
-    def backup(self):
+        self.name = name
+        self.processes = processes or []
+        # Files put off until the end of the run by the large file policy
+        self.deferred = []
+        # Deferred files the user already agreed to replace
+        self.confirmed = set()
+
+    def backup(self, filenames=None):
         """
-        Backup the application config files
+        Backup the application config files.
+        Depending on the large file policy, the files or folders containing
+        large files are skipped or deferred, see self.deferred.
 
         Algorithm:
             if exists home/file
@@ -519,56 +936,131 @@ class ApplicationProfile(object):
                 else
                   mv home/file dbas/file
                   link dbas/file home/file
-        """
 
-        # For each file used by the application
-        for filename in self.files:
-            # Get the full path of each file
-            filepath = os.path.join(os.environ['HOME'], filename)
-            dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
-
-            # If the file exists and is not already a link pointing to Dbas
-            if ((os.path.isfile(filepath) or os.path.isdir(filepath))
-                and not (os.path.islink(filepath)
-                         and (os.path.isfile(dbas_filepath)
-                              or os.path.isdir(dbas_filepath))
-                         and os.path.samefile(filepath, dbas_filepath))):
+        Args:
+            filenames (list): Files to back up, every file of the
+                              application by default. The large file policy
+                              only applies to the default.
 
-                print "Backing up {}...".format(filename)
+        Returns:
+            (AppResult): What happened to each file
+        """
+        result = AppResult(self.name)
 
-                # Check if we already have a backup
-                if os.path.exists(dbas_filepath):
+        check_large_files = (filenames is None
+                             and self.dbas.large_file_policy
+                             != LARGE_FILE_POLICY_COPY)
+        if filenames is None:
+            filenames = self.files
 
-                    # Name it right
-                    if os.path.isfile(dbas_filepath):
-                        file_type = 'file'
-                    elif os.path.isdir(dbas_filepath):
-                        file_type = 'folder'
-                    elif os.path.islink(dbas_filepath):
-                        file_type = 'link'
+        self.dbas.copier.refuse_large = check_large_files
+        try:
+            # For each file used by the application
+            for filename in filenames:
+                # Get the full path of each file
+                filepath = os.path.join(self.dbas.home, filename)
+                dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
+
+                # If the file exists and is not already a link pointing to Dbas
+                if ((os.path.isfile(filepath) or os.path.isdir(filepath))
+                    and not (os.path.islink(filepath)
+                             and (os.path.isfile(dbas_filepath)
+                                  or os.path.isdir(dbas_filepath))
+                             and os.path.samefile(filepath, dbas_filepath))):
+
+                    # A large file is put off before reading it, the folders
+                    # holding one are put off while copying them
+                    if (check_large_files and os.path.isfile(filepath)
+                            and self.dbas.copier.is_large(os.stat(filepath))):
+                        self._put_off_large_file(filename, result)
+                        continue
+
+                    self.dbas.log("Backing up {}...".format(filename),
+                                  app=self.name, file=filename,
+                                  mode=BACKUP_MODE)
+
+                    # Check if we already have a backup
+                    if same_content(filepath, dbas_filepath):
+                        # Keep the backup as is, Dropbox has nothing to upload
+                        delete(filepath, self.dbas.trash)
+                        link(dbas_filepath, filepath, self.dbas.throttle,
+                             self.dbas.attributes)
+                        self.dbas.state.add_link(filename, filepath,
+                                                 dbas_filepath)
+                        result.add(filename, ACTION_LINKED)
+
+                    elif os.path.exists(dbas_filepath):
+
+                        # Ask the user if he really want to replace it,
+                        # once even if it is deferred
+                        if filename in self.confirmed:
+                            self.confirmed.remove(filename)
+                        elif not self.dbas.resolve_conflict(
+                                BACKUP_MODE, filename, dbas_filepath):
+                            result.add(filename, ACTION_KEPT)
+                            continue
+
+                        # Only transfer what changed, so Dropbox does not
+                        # upload the whole thing again. Keep the backup we
+                        # are about to replace first.
+                        try:
+                            sync(filepath, dbas_filepath, self.dbas.checksum,
+                                 self.dbas.trash, self.dbas.copier,
+                                 lambda: self.dbas.snapshots.take(
+                                     self.name, filename, dbas_filepath))
+                        except LargeFileError:
+                            # Found before changing anything, the backup is
+                            # left as it was
+                            if (self.dbas.large_file_policy
+                                    == LARGE_FILE_POLICY_DEFER):
+                                self.confirmed.add(filename)
+                            self._put_off_large_file(filename, result)
+                            continue
+                        # Delete the file in the home
+                        delete(filepath, self.dbas.trash)
+                        # Link the backuped file to its original place
+                        link(dbas_filepath, filepath, self.dbas.throttle,
+                             self.dbas.attributes)
+                        self.dbas.state.add_link(filename, filepath,
+                                                 dbas_filepath)
+                        result.add(filename, ACTION_REPLACED)
                     else:
-                        raise ValueError("Unsupported file: {}"
-                                         .format(dbas_filepath))
-
-                    # Ask the user if he really want to replace it
-                    if confirm("A {} named {} already exists in the backup."
-                               "\nAre you sure that your want to replace it ?"
-                               .format(file_type, dbas_filepath)):
-                        # Delete the file in Dbas
-                        delete(dbas_filepath)
                         # Copy the file
-                        copy(filepath, dbas_filepath)
+                        try:
+                            copy(filepath, dbas_filepath, self.dbas.copier)
+                        except LargeFileError:
+                            # Don't leave a partial copy behind
+                            delete(dbas_filepath)
+                            self._put_off_large_file(filename, result)
+                            continue
                         # Delete the file in the home
-                        delete(filepath)
+                        delete(filepath, self.dbas.trash)
                         # Link the backuped file to its original place
-                        link(dbas_filepath, filepath)
-                else:
-                    # Copy the file
-                    copy(filepath, dbas_filepath)
-                    # Delete the file in the home
-                    delete(filepath)
-                    # Link the backuped file to its original place
-                    link(dbas_filepath, filepath)
+                        link(dbas_filepath, filepath, self.dbas.throttle,
+                             self.dbas.attributes)
+                        self.dbas.state.add_link(filename, filepath,
+                                                 dbas_filepath)
+                        result.add(filename, ACTION_BACKED_UP)
+        finally:
+            self.dbas.copier.refuse_large = False
+
+        return result
+
+    def _put_off_large_file(self, filename, result):
+        """
+        Defer or skip a file or folder holding a large file, depending on
+        the large file policy
+
+        Args:
+            filename (str): Relative path of the file from the home
+            result (AppResult): Where the skipped files are added
+        """
+        if self.dbas.large_file_policy == LARGE_FILE_POLICY_DEFER:
+            self.deferred.append(filename)
+        else:
+            self.dbas.log("Skipping {}, too large".format(filename),
+                          app=self.name, file=filename, mode=BACKUP_MODE)
+            result.add(filename, ACTION_SKIPPED_LARGE)
 
     def restore(self):
         """
@@ -583,13 +1075,17 @@ class ApplicationProfile(object):
                   link dbas/file home/file
               else
                 link dbas/file home/file
+
+        Returns:
+            (AppResult): What happened to each file
         """
+        result = AppResult(self.name)
 
         # For each file used by the application
         for filename in self.files:
             # Get the full path of each file
             dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
-            home_filepath = os.path.join(os.environ['HOME'], filename)
+            home_filepath = os.path.join(self.dbas.home, filename)
 
             # If the file exists and is not already pointing to the dbas file
             # and the folder makes sense on the current platform (Don't sync
@@ -599,30 +1095,45 @@ class ApplicationProfile(object):
                 and not (os.path.islink(home_filepath)
                          and os.path.samefile(dbas_filepath,
                                               home_filepath))
-                and can_file_be_synced_on_current_platform(filename)):
+                and can_file_be_synced_on_current_platform(filename,
+                                                           self.dbas.home)):
 
-                print "Restoring {}...".format(filename)
+                self.dbas.log("Restoring {}...".format(filename),
+                              app=self.name, file=filename,
+                              mode=RESTORE_MODE)
 
                 # Check if there is already a file in the home folder
-                if os.path.exists(home_filepath):
-                    # Name it right
-                    if os.path.isfile(home_filepath):
-                        file_type = 'file'
-                    elif os.path.isdir(home_filepath):
-                        file_type = 'folder'
-                    elif os.path.islink(home_filepath):
-                        file_type = 'link'
+                if same_content(home_filepath, dbas_filepath):
+                    # Nothing would be lost, no need to ask
+                    delete(home_filepath, self.dbas.trash)
+                    link(dbas_filepath, home_filepath, self.dbas.throttle,
+                         self.dbas.attributes)
+                    self.dbas.state.add_link(filename, home_filepath,
+                                             dbas_filepath)
+                    result.add(filename, ACTION_LINKED)
+
+                elif os.path.exists(home_filepath):
+                    if self.dbas.resolve_conflict(RESTORE_MODE, filename,
+                                                  home_filepath):
+                        # Keep the file we are about to replace
+                        self.dbas.snapshots.take(self.name, filename,
+                                                 home_filepath)
+                        delete(home_filepath, self.dbas.trash)
+                        link(dbas_filepath, home_filepath, self.dbas.throttle,
+                             self.dbas.attributes)
+                        self.dbas.state.add_link(filename, home_filepath,
+                                                 dbas_filepath)
+                        result.add(filename, ACTION_REPLACED)
                     else:
-                        raise ValueError("Unsupported file: {}"
-                                         .format(dbas_filepath))
-
-                    if confirm("You already have a {} named {} in your home."
-                               "\nDo you want to replace it with your backup ?"
-                               .format(file_type, filename)):
-                        delete(home_filepath)
-                        link(dbas_filepath, home_filepath)
+                        result.add(filename, ACTION_KEPT)
                 else:
-                    link(dbas_filepath, home_filepath)
+                    link(dbas_filepath, home_filepath, self.dbas.throttle,
+                         self.dbas.attributes)
+                    self.dbas.state.add_link(filename, home_filepath,
+                                             dbas_filepath)
+                    result.add(filename, ACTION_RESTORED)
+
+        return result
 
     def uninstall(self):
         """
@@ -637,12 +1148,17 @@ class ApplicationProfile(object):
                     copy dbas/file home/file
             delete the dbas folder
             print how to delete dbas
+
+        Returns:
+            (AppResult): What happened to each file
         """
+        result = AppResult(self.name)
+
         # For each file used by the application
         for filename in self.files:
             # Get the full path of each file
             dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
-            home_filepath = os.path.join(os.environ['HOME'], filename)
+            home_filepath = os.path.join(self.dbas.home, filename)
 
             # If the dbas file exists
             if (os.path.isfile(dbas_filepath)
@@ -652,244 +1168,3801 @@ class ApplicationProfile(object):
                 if os.path.exists(home_filepath):
                     # If there is, delete it as we are gonna copy the Dropbox
                     # one there
-                    delete(home_filepath)
+                    delete(home_filepath, self.dbas.trash)
 
                     # Copy the Dropbox file to the home folder
-                    copy(dbas_filepath, home_filepath)
-
+                    copy(dbas_filepath, home_filepath, self.dbas.copier)
+                    result.add(filename, ACTION_UNINSTALLED)
 
-class Dbas(object):
-    """Main Dbas class"""
-
-    def __init__(self):
-        """Dbas Constructor"""
-        try:
-            self.dropbox_folder = get_dropbox_folder_location()
-        except IOError:
-            error(("Unable to find the Dropbox folder."
-                   " If Dropbox is not installed and running, go for it on"
-                   " <http://www.dropbox.com/>"))
-
-        self.dbas_folder = os.path.join(self.dropbox_folder, DBAS_DB_PATH)
-        self.temp_folder = tempfile.mkdtemp(prefix="dbas_tmp_")
-
-    def _check_for_usable_environment(self):
-        """Check if the current env is usable and has everything's required"""
+            # Dbas does not own this file anymore
+            self.dbas.state.remove(filename)
 
-        # Do we have a home folder ?
-        if not os.path.isdir(self.dropbox_folder):
-            error(("Unable to find the Dropbox folder."
-                   " If Dropbox is not installed and running, go for it on"
-                   " <http://www.dropbox.com/>"))
+        return result
 
-        # Is Sublime Text running ?
-        #if is_process_running('Sublime Text'):
-        #    error(("Sublime Text is running. It is known to cause problems"
-        #           " when Sublime Text is running while I backup or restore"
-        #           " its configuration files. Please close Sublime Text and"
-        #           " run me again."))
+    def status(self):
+        """
+        Report the state of each application config file, without changing
+        anything and without asking anything.
 
-    def check_for_usable_backup_env(self):
-        """Check if the current env can be used to back up files"""
-        self._check_for_usable_environment()
-        self.create_dbas_home()
+        Only one lstat() is done per side of each file, the state cache
+        tells apart the links Dbas made from the ones it did not.
 
-    def check_for_usable_restore_env(self):
-        """Check if the current env can be used to restore files"""
-        self._check_for_usable_environment()
+        Returns:
+            (dict) Status of each file present on either side, by filename
+        """
+        statuses = {}
 
-        if not os.path.isdir(self.dbas_folder):
-            error("Unable to find the Dbas folder: {}\n"
-                  "You might want to backup some files or get your Dropbox"
-                  " folder synced first."
-                  .format(self.dbas_folder))
+        for filename in self.files:
+            if not can_file_be_synced_on_current_platform(filename,
+                                                          self.dbas.home):
+                continue
 
-    def clean_temp_folder(self):
-        """Delete the temp folder and files created while running"""
-        shutil.rmtree(self.temp_folder)
+            dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
+            home_filepath = os.path.join(self.dbas.home, filename)
+
+            home_stat = get_stat(home_filepath, follow_links=False)
+            dbas_stat = get_stat(dbas_filepath)
+
+            if home_stat is None:
+                if dbas_stat is not None:
+                    statuses[filename] = STATUS_BACKUP_ONLY
+
+            elif stat.S_ISLNK(home_stat.st_mode):
+                link_stat = get_stat(home_filepath)
+                if link_stat is None:
+                    statuses[filename] = STATUS_BROKEN
+                elif (dbas_stat is not None
+                      and (link_stat.st_dev, link_stat.st_ino)
+                      == (dbas_stat.st_dev, dbas_stat.st_ino)):
+                    statuses[filename] = STATUS_LINKED
+                elif self.dbas.state.is_linked(filename, home_filepath):
+                    # Our link now leads somewhere else
+                    statuses[filename] = STATUS_BROKEN
+                elif dbas_stat is not None:
+                    statuses[filename] = STATUS_CONFLICT
+                else:
+                    statuses[filename] = STATUS_UNMANAGED
 
-    def create_dbas_home(self):
-        """If the Dbas home folder does not exist, create it"""
-        if not os.path.isdir(self.dbas_folder):
-            if confirm("Dbas needs a folder to store your configuration "
-                       " files\nDo you want to create it now ? <{}>"
-                       .format(self.dbas_folder)):
-                os.mkdir(self.dbas_folder)
+            # A real file or folder
+            elif dbas_stat is not None:
+                statuses[filename] = STATUS_CONFLICT
             else:
-                error("Dbas can't do anything without a home =(")
+                statuses[filename] = STATUS_UNMANAGED
 
-
-####################
-# Useful functions #
-####################
+        return statuses
 
 
-def confirm(question):
+class CopyModeProfile(ApplicationProfile):
+    """
+    Application whose files are copied between the home and the Dbas folder
+    instead of being linked, for the applications replacing their files
+    without following the links.
+
+    Backups and restores sync both sides, file by file. The state cache
+    remembers the size and modification time both sides had when last in
+    sync, so only the files that changed are read and copied: the changed
+    side wins, the newest one if both changed. Files deleted on a side are
+    deleted on the other one, unless changed there since: the change wins
+    and is copied back.
     """
-    Ask the user if he really want something to happen
 
-    Args:
-        question(str): What can happen
+    def backup(self, filenames=None):
+        """
+        Sync the files of the application, both ways
 
-    Returns:
-        (boolean): Confirmed or not
-    """
-    while True:
-        answer = raw_input(question + ' <Yes|No>')
-        if answer == 'Yes':
-            confirmed = True
-            break
-        if answer == 'No':
-            confirmed = False
-            break
+        Args:
+            filenames (list): Files to sync, every file of the application
+                              by default
 
-    return confirmed
+        Returns:
+            (AppResult): What happened to each file
+        """
+        result = AppResult(self.name)
 
+        for filename in filenames or self.files:
+            home_filepath = os.path.join(self.dbas.home, filename)
+            dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
 
-def delete(filepath):
-    """
-    Delete the given file, directory or link.
-    Should support undelete later on.
+            if not can_file_be_synced_on_current_platform(filename,
+                                                          self.dbas.home):
+                continue
 
-    Args:
-        filepath (str): Absolute full path to a file. e.g. /path/to/file
-    """
-    # Some files have ACLs, let's remove them recursively
-    remove_acl(filepath)
+            # Linked before being copied, copy it back first
+            if (os.path.islink(home_filepath)
+                    and os.path.exists(dbas_filepath)
+                    and os.path.samefile(home_filepath, dbas_filepath)):
+                delete(home_filepath, self.dbas.trash)
 
-    # Some files have immutable attributes, let's remove them recursively
-    remove_immutable_attribute(filepath)
+            home_files = list_files(home_filepath)
+            dbas_files = list_files(dbas_filepath)
+            for path in sorted(set(home_files).union(dbas_files)):
+                action = self._sync_file(
+                    os.path.join(filename, path) if path else filename,
+                    home_files.get(path), dbas_files.get(path))
+                if action is not None:
+                    result.add(os.path.join(filename, path) if path
+                               else filename, action)
 
-    # Finally remove the files and folders
-    if os.path.isfile(filepath) or os.path.islink(filepath):
-        os.remove(filepath)
-    elif os.path.isdir(filepath):
-        shutil.rmtree(filepath)
+        return result
 
+    restore = backup
 
-def copy(src, dst):
-    """
-    Copy a file or a folder (recursively) from src to dst.
-    For simplicity sake, both src and dst must be absolute path and must
-    include the filename of the file or folder.
-    Also do not include any trailing slash.
+    def _sync_file(self, filename, home_stat, dbas_stat):
+        """
+        Sync a single file, see backup()
 
-    e.g. copy('/path/to/src_file', '/path/to/dst_file')
-    or copy('/path/to/src_folder', '/path/to/dst_folder')
+        Args:
+            filename (str): Relative path of the file from the home
+            home_stat (posix.stat_result): Stat of the home file, or None
+            dbas_stat (posix.stat_result): Stat of the Dbas file, or None
 
-    But not: copy('/path/to/src_file', 'path/to/')
-    or copy('/path/to/src_folder/', '/path/to/dst_folder')
+        Returns:
+            (str): What was done, ACTION_*, None if nothing
+        """
+        home_filepath = os.path.join(self.dbas.home, filename)
+        dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
+        record = self.dbas.state.get_synced(filename)
+        if not isinstance(record, dict):
+            record = None
+
+        home_changed = (home_stat is not None
+                        and (record is None
+                             or record['home'] != stat_signature(home_stat)))
+        dbas_changed = (dbas_stat is not None
+                        and (record is None
+                             or record['dbas'] != stat_signature(dbas_stat)))
+
+        if home_stat is None and dbas_stat is None:
+            self.dbas.state.remove(filename)
+            return None
+
+        if home_stat is None or dbas_stat is None:
+            if record is not None and (home_changed or dbas_changed):
+                # Changed on a side, deleted on the other one: the change
+                # is copied back
+                self.dbas.conflict_count += 1
+            elif record is not None:
+                # Deleted on the other side since the last sync
+                existing = home_filepath if home_stat else dbas_filepath
+                delete(existing, self.dbas.trash)
+                self.dbas.state.remove(filename)
+                return ACTION_DELETED
+            if home_stat is None:
+                return self._copy(filename, dbas_filepath, home_filepath)
+            return self._copy(filename, home_filepath, dbas_filepath)
+
+        if not home_changed and not dbas_changed:
+            return None
+
+        home_digest = file_digest(home_filepath)
+        dbas_digest = file_digest(dbas_filepath)
+        if home_digest == dbas_digest:
+            # Touched but not changed
+            self.dbas.state.set_synced(filename, {
+                'digest': home_digest,
+                'home': stat_signature(home_stat),
+                'dbas': stat_signature(dbas_stat)})
+            return None
+
+        home_is_new = record is None or record['digest'] != home_digest
+        dbas_is_new = record is None or record['digest'] != dbas_digest
+        if home_is_new and dbas_is_new:
+            # Changed on both sides, the newest wins but the other one is
+            # kept in a snapshot
+            self.dbas.conflict_count += 1
+            home_is_new = home_stat.st_mtime >= dbas_stat.st_mtime
+
+        if home_is_new:
+            self.dbas.snapshots.take(self.name, filename, dbas_filepath)
+            return self._copy(filename, home_filepath, dbas_filepath)
+        self.dbas.snapshots.take(self.name, filename, home_filepath)
+        return self._copy(filename, dbas_filepath, home_filepath)
+
+    def _copy(self, filename, src, dst):
+        """
+        Copy a file over the other side, at once, and remember both sides are
+        in sync
 
-    Args:
-        src (str): Source file or folder
-        dst (str): Destination file or folder
-    """
-    assert isinstance(src, str) or isinstance(src, unicode)
-    assert os.path.exists(src)
-    assert isinstance(dst, str) or isinstance(src, unicode)
+        Args:
+            filename (str): Relative path of the file from the home
+            src (str): File copied
+            dst (str): Where it's copied
 
-    # Create the path to the dst file if it does not exists
-    abs_path = os.path.dirname(os.path.abspath(dst))
-    if not os.path.isdir(abs_path):
-        os.makedirs(abs_path)
+        Returns:
+            (str): ACTION_COPIED_TO_BACKUP or ACTION_COPIED_TO_HOME
+        """
+        self.dbas.log("Copying {}...".format(src), logging.DEBUG,
+                      app=self.name, file=filename)
+
+        abs_path = os.path.dirname(os.path.abspath(dst))
+        if not os.path.isdir(abs_path):
+            os.makedirs(abs_path)
+
+        src_stat = os.stat(src)
+        temp_path = os.path.join(abs_path,
+                                 '.' + os.path.basename(dst) + '.dbas')
+        self.dbas.copier.copy_file(src, src_stat, temp_path, dst)
+        os.rename(temp_path, dst)
+
+        home_filepath = os.path.join(self.dbas.home, filename)
+        dbas_filepath = os.path.join(self.dbas.dbas_folder, filename)
+        self.dbas.state.set_synced(filename, {
+            'digest': file_digest(dst),
+            'home': stat_signature(os.stat(home_filepath)),
+            'dbas': stat_signature(os.stat(dbas_filepath))})
+
+        if dst == dbas_filepath:
+            return ACTION_COPIED_TO_BACKUP
+        return ACTION_COPIED_TO_HOME
 
-    # We need to copy a single file
-    if os.path.isfile(src):
-        # Copy the src file to dst
-        shutil.copy(src, dst)
+    def uninstall(self):
+        """
+        The files in the home are real ones already, Dbas only forgets them
 
-    # We need to copy a whole folder
-    elif os.path.isdir(src):
-        shutil.copytree(src, dst)
+        Returns:
+            (AppResult): Nothing to report
+        """
+        for filename in self.files:
+            for path in self.dbas.state.get_synced_under(filename):
+                self.dbas.state.remove(path)
 
-    # What the heck is this ?
-    else:
-        raise ValueError("Unsupported file: {}".format(src))
+        return AppResult(self.name)
 
-    # Set the good mode to the file or folder recursively
-    chmod(dst)
+    def status(self):
+        """
+        Report the state of each application config file, without changing
+        anything and without asking anything. Files in sync on both sides
+        are reported as STATUS_LINKED.
 
+        Returns:
+            (dict) Status of each file present on either side, by filename
+        """
+        statuses = {}
 
-def link(target, link):
+        for filename in self.files:
+            if not can_file_be_synced_on_current_platform(filename,
+                                                          self.dbas.home):
+                continue
+
+            home_files = list_files(os.path.join(self.dbas.home, filename))
+            dbas_files = list_files(os.path.join(self.dbas.dbas_folder,
+                                                 filename))
+            if not home_files and not dbas_files:
+                continue
+            if not dbas_files:
+                statuses[filename] = STATUS_UNMANAGED
+            elif not home_files:
+                statuses[filename] = STATUS_BACKUP_ONLY
+            else:
+                statuses[filename] = STATUS_LINKED
+                for path in set(home_files).union(dbas_files):
+                    record = self.dbas.state.get_synced(
+                        os.path.join(filename, path) if path else filename)
+                    if (not isinstance(record, dict)
+                            or path not in home_files
+                            or path not in dbas_files
+                            or record['home']
+                            != stat_signature(home_files[path])
+                            or record['dbas']
+                            != stat_signature(dbas_files[path])):
+                        statuses[filename] = STATUS_CONFLICT
+                        break
+
+        return statuses
+
+
+class ObjectStoreProfile(ApplicationProfile):
     """
-    Create a link to a target file or a folder.
-    For simplicity sake, both target and link must be absolute path and must
-    include the filename of the file or folder.
-    Also do not include any trailing slash.
+    Application whose files are kept in the object store of the Dbas folder
+    instead of being moved there and linked. Each content is stored once,
+    whatever the application, file or version it comes from, and the files
+    are copied back in the home from the index of the application.
 
-    e.g. link('/path/to/file', '/path/to/link')
+    The home keeps real files: the state cache remembers the content both
+    sides had when last in sync, to tell which side changed since.
+    """
 
-    But not: link('/path/to/file', 'path/to/')
-    or link('/path/to/folder/', '/path/to/link')
+    def backup(self, filenames=None):
+        """
+        Store the files of the application and update its index
 
-    Args:
-        target (str): file or folder the link will point to
-        link (str): Link to create
-    """
-    assert isinstance(target, str) or isinstance(target, unicode)
-    assert os.path.exists(target)
-    assert isinstance(link, str) or isinstance(target, unicode)
+        Args:
+            filenames (list): Files to back up, every file of the
+                              application by default
 
-    # Create the path to the link if it does not exists
-    abs_path = os.path.dirname(os.path.abspath(link))
-    if not os.path.isdir(abs_path):
-        os.makedirs(abs_path)
+        Returns:
+            (AppResult): What happened to each file
+        """
+        result = AppResult(self.name)
+        store = self.dbas.objects
+        index = store.read_index(self.name)
+
+        for filename in filenames or self.files:
+            filepath = os.path.join(self.dbas.home, filename)
+            indexed = index.get(filename)
+
+            node = store.scan(filepath, indexed)
+            if node is None or (indexed is not None
+                                and node_digest(node) == node_digest(indexed)):
+                continue
+
+            self.dbas.log("Backing up {}...".format(filename),
+                          app=self.name, file=filename, mode=BACKUP_MODE)
+
+            if indexed is None:
+                action = ACTION_BACKED_UP
+            elif (node_digest(indexed) == self.dbas.state.get_synced(filename)
+                  or self.dbas.resolve_conflict(
+                      BACKUP_MODE, filename,
+                      os.path.join(store.index_folder, self.name))):
+                # Only the home changed, or replacing the backup is fine
+                action = ACTION_REPLACED
+            else:
+                result.add(filename, ACTION_KEPT)
+                continue
 
-    # Make sure the file or folder recursively has the good mode
-    chmod(target)
+            index[filename] = store.scan(filepath, node, store=True)
+            self.dbas.state.set_synced(filename, node_digest(node))
+            result.add(filename, action)
 
-    # Create the link to target
-    os.symlink(target, link)
+        store.write_index(self.name, index)
 
+        return result
 
-def chmod(target):
-    """
-    Recursively set the chmod for files to 0600 and 0700 for folders.
-    It's ok unless we need something more specific.
+    def restore(self):
+        """
+        Copy the files of the application from the object store
 
-    Args:
-        target (str): Root file or folder
-    """
-    assert isinstance(target, str) or isinstance(target, unicode)
-    assert os.path.exists(target)
+        Returns:
+            (AppResult): What happened to each file
+        """
+        result = AppResult(self.name)
+        store = self.dbas.objects
+        index = store.read_index(self.name)
 
-    file_mode = stat.S_IRUSR | stat.S_IWUSR
-    folder_mode = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+        for filename in self.files:
+            indexed = index.get(filename)
+            home_filepath = os.path.join(self.dbas.home, filename)
+
+            if (indexed is None
+                    or not can_file_be_synced_on_current_platform(
+                        filename, self.dbas.home)):
+                continue
+
+            node = store.scan(home_filepath, indexed)
+            if node is not None and node_digest(node) == node_digest(indexed):
+                # Already there
+                self.dbas.state.set_synced(filename, node_digest(indexed))
+                continue
+
+            self.dbas.log("Restoring {}...".format(filename), app=self.name,
+                          file=filename, mode=RESTORE_MODE)
+
+            if node is None:
+                action = ACTION_RESTORED
+            elif (node_digest(node) == self.dbas.state.get_synced(filename)
+                  or self.dbas.resolve_conflict(RESTORE_MODE, filename,
+                                                home_filepath)):
+                # Only the backup changed, or replacing the file is fine
+                self.dbas.snapshots.take(self.name, filename, home_filepath)
+                delete(home_filepath, self.dbas.trash)
+                action = ACTION_REPLACED
+            else:
+                result.add(filename, ACTION_KEPT)
+                continue
 
-    # Remove the immutable attribute recursively if there is one
-    remove_immutable_attribute(target)
+            store.materialise(indexed, home_filepath)
+            self.dbas.state.set_synced(filename, node_digest(indexed))
+            result.add(filename, action)
 
-    if os.path.isfile(target):
-        os.chmod(target, file_mode)
+        return result
 
-    elif os.path.isdir(target):
-        # chmod the root item
-        os.chmod(target, folder_mode)
+    def uninstall(self):
+        """
+        The files in the home are real ones already, Dbas only forgets them
 
-        # chmod recursively in the folder it it's one
-        for root, dirs, files in os.walk(target):
-            for cur_dir in dirs:
-                os.chmod(os.path.join(root, cur_dir), folder_mode)
-            for cur_file in files:
-                os.chmod(os.path.join(root, cur_file), file_mode)
+        Returns:
+            (AppResult): Nothing to report
+        """
+        for filename in self.files:
+            self.dbas.state.remove(filename)
 
-    else:
-        raise ValueError("Unsupported file type: {}".format(target))
+        return AppResult(self.name)
 
+    def status(self):
+        """
+        Report the state of each application config file, without changing
+        anything and without asking anything. Files in sync with their
+        index are reported as STATUS_LINKED.
 
-def error(message):
-    """
-    Throw an error with the given message and immediately quit.
+        Returns:
+            (dict) Status of each file present on either side, by filename
+        """
+        statuses = {}
+        index = self.dbas.objects.read_index(self.name)
 
-    Args:
-        message(str): The message to display.
-    """
-    sys.exit("Error: {}".format(message))
+        for filename in self.files:
+            if not can_file_be_synced_on_current_platform(filename,
+                                                          self.dbas.home):
+                continue
+
+            indexed = index.get(filename)
+            node = self.dbas.objects.scan(
+                os.path.join(self.dbas.home, filename), indexed)
+
+            if node is None:
+                if indexed is not None:
+                    statuses[filename] = STATUS_BACKUP_ONLY
+            elif indexed is None:
+                statuses[filename] = STATUS_UNMANAGED
+            elif node_digest(node) == node_digest(indexed):
+                statuses[filename] = STATUS_LINKED
+            else:
+                statuses[filename] = STATUS_CONFLICT
 
+        return statuses
 
-def parse_cmdline_args():
-    """
-    Setup the engine that's gonna parse the command line arguments
+
+class ObjectStore(object):
+    """
+    Content addressed store, in the Dbas folder: each file content is kept
+    once, named after its SHA-1. The index of each application describes
+    its files and folders as trees of nodes:
+    - a file: {'digest': SHA-1, 'mode': mode, 'size': size, 'mtime': mtime}
+    - a folder: {'mode': mode, 'entries': {name: node}}
+    """
+
+    def __init__(self, folder, index_folder, copier=None, trash=None,
+                 backend=None):
+        """
+        Args:
+            folder (str): Folder holding the objects
+            index_folder (str): Folder holding the index of each application
+            copier (Copier): Copies the new objects
+            trash (Trash): Where the collected objects go
+            backend (StorageBackend): Storage of both folders
+        """
+        self.folder = folder
+        self.index_folder = index_folder
+        self.copier = copier or Copier()
+        self.trash = trash
+        self.backend = backend or DirectoryBackend(index_folder)
+        # An index was written during this run
+        self.changed = False
+
+    def object_path(self, digest):
+        """
+        Args:
+            digest (str): SHA-1 of a content
+
+        Returns:
+            (str): Path to the object holding it
+        """
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def read_index(self, app_name):
+        """
+        Args:
+            app_name (str): Application name
+
+        Returns:
+            (dict): Node by filename, empty if the application has no index
+        """
+        try:
+            with open(os.path.join(self.index_folder, app_name + '.json'),
+                      'r') as f:
+                return json.load(f).get('files', {})
+        except (IOError, ValueError):
+            return {}
+
+    def write_index(self, app_name, index):
+        """
+        Write the index of an application, only if it changed
+
+        Args:
+            app_name (str): Application name
+            index (dict): Node by filename
+        """
+        if self.read_index(app_name) == index:
+            return
+
+        if not os.path.isdir(self.index_folder):
+            os.makedirs(self.index_folder)
+        path = os.path.join(self.index_folder, app_name + '.json')
+        self.backend.atomic_write(path, json.dumps(
+            {'version': VERSION, 'files': index}, indent=1, sort_keys=True))
+        self.changed = True
+
+    def scan(self, path, previous=None, store=False):
+        """
+        Describe a file or folder as a node, storing its content if asked.
+        Files having the size and modification time they had in the
+        previous node are not read again.
+
+        Args:
+            path (str): Path to a file or a folder
+            previous (dict): Node of the same path, from the index
+            store (bool): Add the missing contents to the store
+
+        Returns:
+            (dict): The node, None if path does not exist
+        """
+        path_stat = get_stat(path)
+        if path_stat is None:
+            return None
+        previous = previous or {}
+
+        if stat.S_ISDIR(path_stat.st_mode):
+            entries = {}
+            previous_entries = previous.get('entries', {})
+            for name in os.listdir(path):
+                node = self.scan(os.path.join(path, name),
+                                 previous_entries.get(name), store)
+                if node is not None:
+                    entries[name] = node
+            return {'mode': stat.S_IMODE(path_stat.st_mode),
+                    'entries': entries}
+
+        indexed = (previous.get('digest')
+                   and previous.get('size') == path_stat.st_size
+                   and previous.get('mtime') == int(path_stat.st_mtime))
+        if indexed:
+            digest = previous['digest']
+        else:
+            digest = file_digest(path)
+
+        if store:
+            object_path = self.object_path(digest)
+            if not os.path.exists(object_path):
+                if not os.path.isdir(os.path.dirname(object_path)):
+                    os.makedirs(os.path.dirname(object_path))
+                # Dropbox never syncs a half written object, nor one
+                # shared with a file out of the store
+                temp_path = os.path.join(os.path.dirname(object_path),
+                                         '.' + digest[2:] + '.dbas')
+                self.copier.copy_file(path, path_stat, temp_path,
+                                      object_path, hardlink=False)
+                os.chmod(temp_path, stat.S_IRUSR | stat.S_IWUSR)
+                # gc() tells the objects not indexed yet by their mtime,
+                # not the one of the file they were copied from
+                os.utime(temp_path, None)
+                os.rename(temp_path, object_path)
+            elif not indexed:
+                # Reused by a new index, maybe not synced to the other
+                # hosts yet: gc() must give it the grace period again
+                os.utime(object_path, None)
+
+        return {'digest': digest, 'mode': stat.S_IMODE(path_stat.st_mode),
+                'size': path_stat.st_size, 'mtime': int(path_stat.st_mtime)}
+
+    def materialise(self, node, path):
+        """
+        Create a file or a folder from its node, at once
+
+        Args:
+            node (dict): Node of the file or folder
+            path (str): Where to create it, must not exist
+        """
+        abs_path = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(abs_path):
+            os.makedirs(abs_path)
+
+        temp_path = os.path.join(abs_path,
+                                 '.' + os.path.basename(path) + '.dbas')
+        self._materialise(node, temp_path)
+        os.rename(temp_path, path)
+
+    def _materialise(self, node, path):
+        """
+        Create a file or a folder from its node, recursively. See
+        materialise().
+
+        Args:
+            node (dict): Node of the file or folder
+            path (str): Where to create it, must not exist
+        """
+        if 'entries' in node:
+            os.mkdir(path, node['mode'] | stat.S_IRWXU)
+            for name, entry in node['entries'].iteritems():
+                self._materialise(entry, os.path.join(path, name))
+        else:
+            # Never link an object, an application would change it in place
+            shutil.copyfile(self.object_path(node['digest']), path)
+            os.chmod(path, node['mode'] | stat.S_IRUSR | stat.S_IWUSR)
+            # Not read again by the next scan()
+            os.utime(path, (node['mtime'], node['mtime']))
+
+    def gc(self, max_age_days=OBJECTS_GC_GRACE_DAYS):
+        """
+        Remove the objects no index references anymore
+
+        Args:
+            max_age_days (int): Unreferenced objects younger than this are
+                                kept, their index may not be synced yet
+
+        Returns:
+            (int): Number of objects removed
+        """
+        referenced = set()
+
+        def add_digests(node):
+            if 'entries' in node:
+                for entry in node['entries'].itervalues():
+                    add_digests(entry)
+            else:
+                referenced.add(node['digest'])
+
+        try:
+            names = os.listdir(self.index_folder)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith('.json') and not name.startswith('.'):
+                for node in self.read_index(name[:-len('.json')]).itervalues():
+                    add_digests(node)
+
+        removed = 0
+        oldest = time.time() - max_age_days * 24 * 60 * 60
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                digest = os.path.basename(dirpath) + name
+                object_path = os.path.join(dirpath, name)
+                if (digest not in referenced
+                        and os.lstat(object_path).st_mtime < oldest):
+                    delete(object_path, self.trash)
+                    removed += 1
+
+        return removed
+
+
+class ProcessTable(object):
+    """Names of the running processes, read all at once"""
+
+    def __init__(self):
+        self.names = get_running_process_names()
+
+    def is_running(self, process_name):
+        """
+        Check if a process with the given name is running
+
+        Args:
+            process_name (str): Process name, e.g. "Sublime Text"
+
+        Returns:
+            (bool): True if the process is running
+        """
+        # GNU/Linux truncates the names to 15 characters in /proc/*/comm
+        return (process_name in self.names
+                or process_name[:15] in self.names)
+
+
+class Metrics(object):
+    """Metrics of a run, written as a node_exporter textfile"""
+
+    def __init__(self):
+        # Value by sorted labels, by metric name
+        self.values = {}
+
+    def add(self, name, value=1, **labels):
+        """
+        Add to a metric
+
+        Args:
+            name (str): Metric name, from METRICS_HELP
+            value (int or float)
+            labels: Labels of the metric, e.g. app='Git'
+        """
+        series = self.values.setdefault(name, {})
+        key = tuple(sorted(labels.iteritems()))
+        series[key] = series.get(key, 0) + value
+
+    def render(self):
+        """
+        Returns:
+            (str): The metrics, in the Prometheus text format
+        """
+        lines = []
+        for name in sorted(self.values):
+            lines.append("# HELP {} {}".format(name, METRICS_HELP[name]))
+            lines.append("# TYPE {} gauge".format(name))
+            for labels, value in sorted(self.values[name].iteritems()):
+                label_text = ','.join(
+                    u'{}="{}"'.format(label, unicode(label_value)
+                                     .replace('\\', '\\\\')
+                                     .replace('"', '\\"')
+                                     .replace('\n', '\\n'))
+                    for label, label_value in labels)
+                lines.append(u"{}{{{}}} {}".format(name, label_text,
+                                                  repr(value)))
+
+        return u'\n'.join(lines) + u'\n'
+
+    def write(self, path):
+        """
+        Write the textfile at once, node_exporter never reads it half written
+
+        Args:
+            path (str): Path to the textfile
+        """
+        temp_path = os.path.join(os.path.dirname(path),
+                                 '.' + os.path.basename(path) + '.dbas')
+        with open(temp_path, 'w') as f:
+            f.write(self.render().encode('utf-8'))
+        os.rename(temp_path, path)
+
+
+class TokenBucket(object):
+    """
+    Rate limiter: tokens come back at a constant rate, up to a second worth
+    of them, and taking more than there are waits for them.
+    """
+
+    def __init__(self, rate):
+        """
+        Args:
+            rate (float): Tokens by second
+        """
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, count):
+        """
+        Take tokens, waiting until there are enough of them
+
+        Args:
+            count (float): Number of tokens, can be more than a second worth
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Go in debt, the next ones wait for it to be paid
+            self.tokens -= count
+            wait = -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Throttle(object):
+    """Limits of the bytes copied and of the file operations, by second"""
+
+    def __init__(self):
+        # TokenBucket of each limit, None when unlimited
+        self.bytes = None
+        self.operations = None
+
+    def set_limits(self, bytes_per_second=None, operations_per_second=None):
+        """
+        Args:
+            bytes_per_second (int): Bytes copied by second, unlimited if
+                                    None or 0
+            operations_per_second (int): Files created, deleted or changed by
+                                         second, unlimited if None or 0
+        """
+        self.bytes = (TokenBucket(bytes_per_second) if bytes_per_second
+                      else None)
+        self.operations = (TokenBucket(operations_per_second)
+                           if operations_per_second else None)
+
+    def transfer(self, size):
+        """
+        Wait until size bytes can be copied
+
+        Args:
+            size (int): Number of bytes
+        """
+        if self.bytes is not None:
+            self.bytes.consume(size)
+
+    def operate(self, count=1):
+        """
+        Wait until count file operations can be done
+
+        Args:
+            count (int): Number of operations
+        """
+        if self.operations is not None:
+            self.operations.consume(count)
+
+
+# Used by the functions given no throttle, never limited
+UNLIMITED = Throttle()
+
+
+class StorageBackend(object):
+    """
+    Where the Dbas folder is kept. What the folder supports is probed once,
+    when first needed, so the fast paths can be chosen for it.
+    """
+
+    # Something else syncs the folder, wait for it before restoring
+    syncs = False
+    missing_message = "Unable to find the storage folder"
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): Folder holding the Dbas folder
+        """
+        self.folder = folder
+        self._capabilities = None
+
+    @property
+    def dbas_folder(self):
+        """
+        Returns:
+            (str): Folder holding the backups
+        """
+        return self.folder
+
+    @property
+    def capabilities(self):
+        """
+        Returns:
+            (dict): True for each of BACKEND_CAPABILITIES supported
+        """
+        if self._capabilities is None:
+            self._capabilities = self.probe()
+        return self._capabilities
+
+    def probe(self):
+        """
+        Try each capability on a file in the Dbas folder
+
+        Returns:
+            (dict): True for each of BACKEND_CAPABILITIES supported
+        """
+        capabilities = dict.fromkeys(BACKEND_CAPABILITIES, False)
+        try:
+            probe_folder = tempfile.mkdtemp(prefix='.dbas-probe-',
+                                            dir=self.dbas_folder)
+        except EnvironmentError:
+            return capabilities
+
+        try:
+            path = os.path.join(probe_folder, 'file')
+            with open(path, 'w') as f:
+                f.write('dbas')
+            try:
+                os.link(path, os.path.join(probe_folder, 'hardlink'))
+                capabilities['hardlink'] = True
+            except OSError:
+                pass
+            capabilities['reflink'] = reflink(
+                path, os.path.join(probe_folder, 'reflink'))
+        except EnvironmentError:
+            pass
+        finally:
+            shutil.rmtree(probe_folder, ignore_errors=True)
+
+        return capabilities
+
+    def get_free_space(self):
+        """
+        Returns:
+            (int): Number of bytes still available in the folder
+        """
+        folder_stat = os.statvfs(self.folder)
+        return folder_stat.f_bavail * folder_stat.f_frsize
+
+    def atomic_write(self, path, data):
+        """
+        Write a file of the folder so it is never seen half written: in a
+        temporary file renamed once complete
+
+        Args:
+            path (str): File to write
+            data (str): Its content
+        """
+        temp_path = os.path.join(os.path.dirname(path),
+                                 '.' + os.path.basename(path) + '.dbas')
+        with open(temp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+
+
+class DirectoryBackend(StorageBackend):
+    """
+    A plain folder, e.g. an NFS mount or a tmpfs, holding the backups
+    """
+
+
+class DropboxBackend(StorageBackend):
+    """
+    The Dropbox folder of a home, holding the backups in its Dbas folder
+    """
+
+    syncs = True
+    missing_message = ("Unable to find the Dropbox folder."
+                       " If Dropbox is not installed and running, go for"
+                       " it on <http://www.dropbox.com/>")
+
+    def __init__(self, home, folder=None):
+        """
+        Args:
+            home (str): Home of the Dropbox user
+            folder (str): Dropbox folder, found from the Dropbox config of
+                          the home by default
+
+        Raises:
+            IOError: If the Dropbox folder can't be found
+        """
+        super(DropboxBackend, self).__init__(
+            folder or get_dropbox_folder_location(home))
+
+    @property
+    def dbas_folder(self):
+        """
+        Returns:
+            (str): Folder holding the backups
+        """
+        return os.path.join(self.folder, DBAS_DB_PATH)
+
+    def probe(self):
+        """
+        Dropbox needs a local filesystem supporting hardlinks. Nothing is
+        tried, a probe would be synced to every host.
+
+        Returns:
+            (dict): True for each of BACKEND_CAPABILITIES supported
+        """
+        return {'hardlink': True, 'reflink': False}
+
+
+class Copier(object):
+    """
+    Copy files, recreating the hardlinks between them: a file having several
+    links is only copied once by destination tree, its other links are
+    hardlinked to that copy. reset() starts another tree.
+    Large files are copied chunk by chunk, with a bounded buffer, into a
+    temporary file renamed once complete.
+    """
+
+    def __init__(self, large_file_size=None,
+                 chunk_size=LARGE_FILE_CHUNK_SIZE_KB * 1024,
+                 progress_callback=None, throttle=None):
+        """
+        Args:
+            large_file_size (int): Size in bytes from which a file is large,
+                                   no file is by default
+            chunk_size (int): Number of bytes copied at once for large files
+            progress_callback (callable): Called with the source path, the
+                                          number of bytes copied and the
+                                          total after each file copied, and
+                                          each chunk of a large file
+            throttle (Throttle): Limits of the copies, unlimited by default
+        """
+        self.large_file_size = large_file_size
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.throttle = throttle or UNLIMITED
+
+        # Attributes of the files looked at, see find_attributes()
+        self.attributes = {}
+
+        # Raise LargeFileError instead of copying a large file, so a folder
+        # holding one is found while copying it instead of by walking it
+        # first
+        self.refuse_large = False
+
+        # Copy of each file having several links, by (st_dev, st_ino)
+        self.copies = {}
+
+        # StorageBackend of the destination, when copying to it, for its
+        # fast paths
+        self.backend = None
+
+        # What was copied, hardlinks excluded
+        self.files_copied = 0
+        self.bytes_copied = 0
+
+    def is_large(self, path_stat):
+        """
+        Args:
+            path_stat (posix.stat_result): Stat of a file
+
+        Returns:
+            (bool): True if it is a large file
+        """
+        return (self.large_file_size is not None
+                and stat.S_ISREG(path_stat.st_mode)
+                and path_stat.st_size >= self.large_file_size)
+
+    def reset(self):
+        """Forget the copies made, the next ones go to another tree"""
+        self.copies = {}
+
+    def copy_file(self, src, src_stat, dst, final_dst=None, hardlink=True):
+        """
+        Copy a single file, or hardlink it to the copy already made of it
+
+        Args:
+            src (str): Source file
+            src_stat (posix.stat_result): Stat of src, links followed
+            dst (str): Destination file, must not exist
+            final_dst (str): Where dst ends up, if it is renamed afterwards
+            hardlink (bool): Recreate the hardlinks of src, False to always
+                             make a copy of its own
+
+        Returns:
+            (bool): True if dst was hardlinked instead of copied
+        """
+        if self.refuse_large and self.is_large(src_stat):
+            raise LargeFileError("Large file: {}".format(src))
+
+        can_hardlink = hardlink and (self.backend is None
+                                     or self.backend.capabilities['hardlink'])
+        if src_stat.st_nlink > 1 and can_hardlink:
+            key = (src_stat.st_dev, src_stat.st_ino)
+            previous = self.copies.get(key)
+            if previous is not None:
+                try:
+                    os.link(previous, dst)
+                    return True
+                except OSError:
+                    # Gone, or on another filesystem: copy it again
+                    pass
+            self.copies[key] = final_dst or dst
+
+        self.throttle.operate()
+        if (self.backend is not None and self.backend.capabilities['reflink']
+                and reflink(src, dst)):
+            # Sharing the blocks, nothing is transferred
+            shutil.copystat(src, dst)
+            if self.progress_callback is not None:
+                self.progress_callback(src, src_stat.st_size,
+                                       src_stat.st_size)
+        elif (self.is_large(src_stat)
+                or (self.throttle.bytes is not None
+                    and src_stat.st_size > self.chunk_size)):
+            if (self.backend is not None
+                    and self.backend.get_free_space() < src_stat.st_size):
+                # Don't leave a half written file on a full folder
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), dst)
+            retry(self.copy_large_file, src, src_stat, dst,
+                  final_dst is not None)
+        else:
+            self.throttle.transfer(src_stat.st_size)
+            # Keep its mtime for the next sync()
+            retry(shutil.copy2, src, dst)
+            if self.progress_callback is not None:
+                self.progress_callback(src, src_stat.st_size,
+                                       src_stat.st_size)
+        self.files_copied += 1
+        self.bytes_copied += src_stat.st_size
+        return False
+
+    def copy_large_file(self, src, src_stat, dst, temporary=False):
+        """
+        Copy a file chunk by chunk, telling the progress_callback
+
+        Args:
+            src (str): Source file
+            src_stat (posix.stat_result): Stat of src, links followed
+            dst (str): Destination file
+            temporary (bool): dst is already a temporary file, renamed by
+                              the caller
+        """
+        if temporary:
+            temp_path = dst
+        else:
+            # Dropbox never syncs a half written file
+            temp_path = os.path.join(os.path.dirname(dst),
+                                     '.' + os.path.basename(dst) + '.dbas')
+
+        copied = 0
+        try:
+            with open(src, 'rb') as src_file:
+                with open(temp_path, 'wb') as dst_file:
+                    for chunk in iter(lambda: src_file.read(self.chunk_size),
+                                      b''):
+                        self.throttle.transfer(len(chunk))
+                        dst_file.write(chunk)
+                        copied += len(chunk)
+                        if self.progress_callback is not None:
+                            self.progress_callback(src, copied,
+                                                   src_stat.st_size)
+
+            # Keep its mtime for the next sync()
+            shutil.copystat(src, temp_path)
+            if not temporary:
+                os.rename(temp_path, dst)
+        except BaseException:
+            # Don't leave a half written file behind
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+class Progress(object):
+    """
+    Progress of a run: the files and bytes copied out of the totals found by
+    a scan before the run, by application and overall, with the throughput
+    and the time left. It is reported on a line rewritten in place on a
+    terminal, as plain lines otherwise, or as JSON events, one by line.
+    What is already in sync is left out of the totals, it isn't copied.
+    """
+
+    def __init__(self, stream=None, json_events=False,
+                 interval=PROGRESS_INTERVAL_SECONDS):
+        """
+        Args:
+            stream (file): Where to report, stderr by default
+            json_events (bool): Report JSON events instead of a line
+            interval (float): Seconds between two reports
+        """
+        self.stream = stream or sys.stderr
+        self.json_events = json_events
+        self.interval = interval
+        # Only a terminal can rewrite a line in place
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+
+        # [files, bytes] of each application, and done so far
+        self.totals = {}
+        self.done = {}
+        # Application being run
+        self.app = None
+        # Bytes really copied, for the throughput
+        self.bytes_copied = 0
+        self.start = None
+        self.last_report = None
+
+        # Bytes already counted of the file being copied
+        self.path = None
+        self.path_copied = 0
+        # Length of the last line, to blank what is left of it
+        self.line_length = 0
+
+    def add_app(self, app_name, files, size):
+        """
+        Args:
+            app_name (str): Application name
+            files (int): Number of files to go through
+            size (int): Number of bytes to go through
+        """
+        self.totals[app_name] = [files, size]
+        self.done[app_name] = [0, 0]
+
+    def start_app(self, app_name):
+        """
+        Args:
+            app_name (str): Application about to be run
+        """
+        if self.start is None:
+            self.start = time.time()
+        self.totals.setdefault(app_name, [0, 0])
+        self.done.setdefault(app_name, [0, 0])
+        self.app = app_name
+        self.report(force=True)
+
+    def update(self, path, copied, total):
+        """
+        Count what was copied, a Copier progress_callback
+
+        Args:
+            path (str): File being copied
+            copied (int): Number of bytes of it copied so far
+            total (int): Size of the file
+        """
+        if self.app is None:
+            return
+
+        if path != self.path:
+            self.path_copied = 0
+        done = self.done[self.app]
+        done[1] += copied - self.path_copied
+        self.bytes_copied += copied - self.path_copied
+        self.path = path
+        self.path_copied = copied
+        if copied >= total:
+            done[0] += 1
+            self.path = None
+        self.report()
+
+    def finish_app(self, app_name):
+        """
+        Args:
+            app_name (str): Application just run
+        """
+        # What didn't change was not copied, it's done all the same
+        done = self.done[app_name]
+        total = self.totals[app_name]
+        done[0] = max(done[0], total[0])
+        done[1] = max(done[1], total[1])
+        self.app = None
+        self.report(force=True)
+
+    def get_state(self, event='progress'):
+        """
+        Args:
+            event (str): Name of the event
+
+        Returns:
+            (dict): Progress of the current application and of the run
+        """
+        state = {'event': event, 'app': self.app}
+        if self.app is not None:
+            files, size = self.totals[self.app]
+            files_done, size_done = self.done[self.app]
+            state.update({'app_files_done': min(files_done, files),
+                          'app_files_total': files,
+                          'app_bytes_done': min(size_done, size),
+                          'app_bytes_total': size})
+
+        # Done beyond the scan doesn't make the run any shorter
+        files = size = files_done = size_done = 0
+        for app_name, total in self.totals.iteritems():
+            done = self.done[app_name]
+            files += total[0]
+            size += total[1]
+            files_done += min(done[0], total[0])
+            size_done += min(done[1], total[1])
+
+        elapsed = time.time() - self.start if self.start is not None else 0
+        rate = self.bytes_copied / elapsed if elapsed > 0 else 0
+        state.update({'files_done': files_done, 'files_total': files,
+                      'bytes_done': size_done, 'bytes_total': size,
+                      'elapsed_seconds': round(elapsed, 1),
+                      'bytes_per_second': int(rate),
+                      'eta_seconds': (int((size - size_done) / rate)
+                                      if rate else None)})
+        return state
+
+    def report(self, force=False, event='progress'):
+        """
+        Report the progress, at most once by interval unless forced
+
+        Args:
+            force (bool): Report even if the last report is recent
+            event (str): Name of the event
+        """
+        now = time.time()
+        if (not force and self.last_report is not None
+                and now - self.last_report < self.interval):
+            return
+        self.last_report = now
+
+        state = self.get_state(event)
+        if self.json_events:
+            self.stream.write(json.dumps(state, sort_keys=True) + '\n')
+        elif self.tty:
+            line = format_progress(state)
+            self.stream.write('\r' + line.ljust(self.line_length))
+            self.line_length = len(line)
+        else:
+            self.stream.write(format_progress(state) + '\n')
+        self.stream.flush()
+
+    def clear(self):
+        """Blank the line rewritten in place, so something else is logged"""
+        if self.line_length:
+            self.stream.write('\r' + ' ' * self.line_length + '\r')
+            self.stream.flush()
+            self.line_length = 0
+
+    def close(self):
+        """Report the end of the run"""
+        self.report(force=True, event='done')
+        if self.line_length:
+            self.stream.write('\n')
+            self.stream.flush()
+            self.line_length = 0
+
+
+class RunLock(object):
+    """
+    Lock of the runs on a home, so concurrent runs don't race on the same
+    paths. The mode of the run holding it is written in the lock file, and
+    the results of the last run are kept next to it, for the runs that
+    waited for it.
+    """
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): Folder holding the lock, out of Dropbox
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, LOCK_FILE)
+        self.last_run_path = os.path.join(folder, LAST_RUN_FILE)
+        self.file = None
+
+    def acquire(self, mode, blocking=True):
+        """
+        Args:
+            mode (str): Mode of the run taking the lock
+            blocking (bool): Wait for the lock to be released
+
+        Returns:
+            (bool): True if the lock was acquired
+        """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX
+                        | (0 if blocking else fcntl.LOCK_NB))
+        except IOError as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(mode)
+        lock_file.flush()
+        self.file = lock_file
+        return True
+
+    def get_holder(self):
+        """
+        Returns:
+            (str): Mode of the run holding or last holding the lock
+        """
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def release(self):
+        """Let the next run go"""
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def get_last_run(self):
+        """
+        Returns:
+            (dict): The mode, the applications, when it ended and the results
+                    of the last run, None if unknown
+        """
+        try:
+            with open(self.last_run_path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def set_last_run(self, mode, apps, results):
+        """
+        Record the last run, atomically
+
+        Args:
+            mode (str): Mode of the run
+            apps (list): Application names
+            results (list): AppResult of each application
+        """
+        temp_path = self.last_run_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'mode': mode, 'apps': sorted(apps),
+                       'ended': time.time(),
+                       'results': [result.as_dict() for result in results]},
+                      f)
+        os.rename(temp_path, self.last_run_path)
+
+
+class FolderWatcher(object):
+    """
+    Tell when something changes in a folder, recursively: with inotify on
+    GNU/Linux, by looking at every file regularly otherwise.
+    """
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): Folder to watch
+        """
+        self.folder = folder
+        self.fd = None
+        # Watched folder, by watch descriptor
+        self.watches = {}
+        self.snapshot = None
+
+        if (platform.system() == PLATFORM_LINUX and LIBC is not None
+                and hasattr(LIBC, 'inotify_init1')):
+            fd = LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                for root, dirs, files in os.walk(folder):
+                    self._watch(root)
+
+        if self.fd is None:
+            self.snapshot = self._take_snapshot()
+
+    def _watch(self, folder):
+        """
+        Args:
+            folder (str): Folder to add to the inotify watches
+        """
+        wd = LIBC.inotify_add_watch(self.fd, folder.encode('utf-8')
+                                    if isinstance(folder, unicode)
+                                    else folder, IN_ACTIVITY)
+        if wd >= 0:
+            self.watches[wd] = folder
+
+    def _take_snapshot(self):
+        """
+        Returns:
+            (set): (path, size, mtime) of everything in the folder
+        """
+        snapshot = set()
+        for root, dirs, files in os.walk(self.folder):
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                path_stat = get_stat(path, follow_links=False)
+                if path_stat is not None:
+                    snapshot.add((path, path_stat.st_size,
+                                  path_stat.st_mtime))
+        return snapshot
+
+    def wait(self, timeout):
+        """
+        Wait for something to change in the folder
+
+        Args:
+            timeout (float): Seconds to wait at most
+
+        Returns:
+            (bool): True if something changed
+        """
+        if self.fd is None:
+            time.sleep(min(timeout, SETTLE_POLL_SECONDS))
+            snapshot = self._take_snapshot()
+            changed = snapshot != self.snapshot
+            self.snapshot = snapshot
+            return changed
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+
+        # Watch the new folders too, created or moved in, with what they
+        # already hold
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO)
+                    and wd in self.watches):
+                new_folder = os.path.join(self.watches[wd], name)
+                for root, dirs, files in os.walk(new_folder):
+                    self._watch(root)
+
+        return True
+
+    def close(self):
+        """Stop watching"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class StateCache(object):
+    """
+    Local record of the links Dbas created on this host.
+
+    It is stored in the home folder, out of Dropbox, as it only makes sense
+    for the current host.
+    """
+
+    def __init__(self, path):
+        """
+        Load the state cache, an unreadable cache is an empty one
+
+        Args:
+            path (str): Path to the JSON file holding the cache
+        """
+        self.path = path
+        self.load()
+
+    def load(self):
+        """
+        Read the cache again, e.g. once holding the run lock: another run may
+        have saved it since, and saving a stale copy would lose its records
+        """
+        self.links = {}
+        self.synced = {}
+        self.changed = False
+
+        try:
+            with open(self.path, 'r') as f:
+                cache = json.load(f)
+            self.links = cache.get('links', {})
+            self.synced = cache.get('synced', {})
+        except (IOError, ValueError):
+            pass
+
+    def add_link(self, filename, link_path, target):
+        """
+        Remember that Dbas linked link_path to target
+
+        Args:
+            filename (str): Relative path of the file from the home
+            link_path (str): Full path to the link in the home
+            target (str): Full path to the file the link points to
+        """
+        self.links[filename] = {'link': link_path, 'target': target}
+        self.changed = True
+
+    def remove(self, filename):
+        """
+        Forget anything about the given file
+
+        Args:
+            filename (str): Relative path of the file from the home
+        """
+        if self.links.pop(filename, None) is not None:
+            self.changed = True
+        if self.synced.pop(filename, None) is not None:
+            self.changed = True
+
+    def set_synced(self, filename, digest):
+        """
+        Remember the content of a file copied to or from the backup, as it
+        was when both sides were last in sync
+
+        Args:
+            filename (str): Relative path of the file from the home
+            digest (str or dict): Digest of its content, with the stat of
+                                  both sides if needed
+        """
+        if self.synced.get(filename) != digest:
+            self.synced[filename] = digest
+            self.changed = True
+
+    def get_synced(self, filename):
+        """
+        Args:
+            filename (str): Relative path of the file from the home
+
+        Returns:
+            (str or dict): Digest of its content when last in sync, None if
+                           unknown
+        """
+        return self.synced.get(filename)
+
+    def get_synced_under(self, filename):
+        """
+        Args:
+            filename (str): Relative path of a file or folder from the home
+
+        Returns:
+            (list): The files in sync known in it, or the file itself
+        """
+        return [path for path in self.synced
+                if path == filename or path.startswith(filename + os.sep)]
+
+    def is_linked(self, filename, link_path):
+        """
+        Check if Dbas created the given link
+
+        Args:
+            filename (str): Relative path of the file from the home
+            link_path (str): Full path to the link in the home
+
+        Returns:
+            (bool): True if the link was created by Dbas
+        """
+        record = self.links.get(filename)
+        return record is not None and record['link'] == link_path
+
+    def save(self):
+        """Write the cache back to disk if it changed, atomically"""
+        if not self.changed:
+            return
+
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': VERSION, 'links': self.links,
+                       'synced': self.synced}, f, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+        self.changed = False
+
+
+class SnapshotStore(object):
+    """
+    Versioned snapshots of the files Dbas is about to replace.
+
+    Snapshots are kept in the home folder, out of Dropbox, and are made of
+    hardlinks like "cp -al" would: they only cost metadata, as long as the
+    replaced files are not modified in place. Each run makes at most one
+    snapshot by application:
+
+        snapshots/<application>/<run>/manifest.json
+        snapshots/<application>/<run>/files/<filename>
+    """
+
+    def __init__(self, folder, max_count=SNAPSHOTS_MAX_COUNT,
+                 max_age_days=SNAPSHOTS_MAX_AGE_DAYS, trash=None):
+        """
+        Args:
+            folder (str): Folder holding the snapshots
+            max_count (int): Snapshots kept by application
+            max_age_days (int): Snapshots older than this are evicted
+            trash (Trash): Where the files replaced by a rollback go
+        """
+        self.folder = folder
+        self.trash = trash
+        self.max_count = max_count
+        self.max_age_days = max_age_days
+        self.run = time.strftime('%Y%m%dT%H%M%S') + '-{}'.format(os.getpid())
+
+    def _app_folder(self, app_name):
+        if not app_name:
+            app_name = SNAPSHOTS_UNNAMED_APP
+        return os.path.join(self.folder, app_name.replace(os.sep, '_'))
+
+    def _read_manifest(self, snapshot_folder):
+        with open(os.path.join(snapshot_folder, 'manifest.json'), 'r') as f:
+            return json.load(f)
+
+    def take(self, app_name, filename, path):
+        """
+        Snapshot a file or folder before it gets replaced
+
+        Args:
+            app_name (str): Application the file belongs to
+            filename (str): Relative path of the file from the home
+            path (str): Full path to the file or folder to snapshot
+        """
+        snapshot_folder = os.path.join(self._app_folder(app_name), self.run)
+        manifest_path = os.path.join(snapshot_folder, 'manifest.json')
+
+        if os.path.isfile(manifest_path):
+            manifest = self._read_manifest(snapshot_folder)
+        else:
+            manifest = {}
+
+        clone(path, os.path.join(snapshot_folder, 'files', filename))
+
+        manifest[filename] = path
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+        self.evict(app_name)
+
+    def get_snapshots(self, app_name):
+        """
+        Args:
+            app_name (str): Application name
+
+        Returns:
+            (list): Snapshot folders of the application, the oldest first
+        """
+        app_folder = self._app_folder(app_name)
+        if not os.path.isdir(app_folder):
+            return []
+
+        return [os.path.join(app_folder, run)
+                for run in sorted(os.listdir(app_folder))]
+
+    def evict(self, app_name):
+        """
+        Remove the snapshots of an application that are too old or too many.
+        The snapshot of the current run is always kept.
+
+        Args:
+            app_name (str): Application name
+        """
+        snapshots = self.get_snapshots(app_name)
+        oldest_allowed = time.time() - self.max_age_days * 24 * 3600
+
+        for index, snapshot_folder in enumerate(snapshots):
+            if os.path.basename(snapshot_folder) == self.run:
+                continue
+            if (index < len(snapshots) - self.max_count
+                    or os.path.getmtime(snapshot_folder) < oldest_allowed):
+                # Removed for real, at the pace of the trash if any
+                delete(snapshot_folder, throttle=(
+                    self.trash.throttle if self.trash is not None else None))
+
+    def rollback(self, app_name):
+        """
+        Put back the files of the latest snapshot of an application where
+        they were taken from
+
+        Args:
+            app_name (str): Application name
+
+        Returns:
+            (list): Relative paths from the home of the files put back
+        """
+        snapshots = self.get_snapshots(app_name)
+        if not snapshots:
+            raise DbasError("No snapshot of {} to roll back to"
+                            .format(app_name))
+
+        manifest = self._read_manifest(snapshots[-1])
+        for filename, path in sorted(manifest.iteritems()):
+            if os.path.lexists(path):
+                delete(path, self.trash)
+            # Copy the files back, the snapshot must not change if they do
+            clone(os.path.join(snapshots[-1], 'files', filename), path,
+                  hardlink=False)
+
+        return sorted(manifest)
+
+
+class Trash(object):
+    """
+    Trash of the files deleted by Dbas.
+
+    Deleting a file only renames it in the folder of the current run, which
+    is instant, and keeps it undeletable: the original path of each file is
+    recorded in the manifest of the run. The runs that are too old or beyond
+    the size limit are purged in a background thread, the current one being
+    left for the next runs.
+    """
+
+    def __init__(self, folder, max_size_mb=TRASH_MAX_SIZE_MB,
+                 max_age_days=TRASH_MAX_AGE_DAYS, throttle=None):
+        """
+        Args:
+            folder (str): Folder holding the trash
+            max_size_mb (int): Size of the runs kept
+            max_age_days (int): Runs older than this are purged
+            throttle (Throttle): Limits of the deletions, unlimited by
+                                 default
+        """
+        self.folder = folder
+        self.throttle = throttle or UNLIMITED
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_age_days = max_age_days
+        self.run = time.strftime('%Y%m%dT%H%M%S') + '-{}'.format(os.getpid())
+        self.run_folder = os.path.join(folder, self.run)
+        self.count = 0
+        self.purge_thread = None
+
+    def put(self, path):
+        """
+        Move a file, folder or link to the trash
+
+        Args:
+            path (str): Path to the file to delete
+
+        Returns:
+            (bool): False if it can't be renamed in the trash as they are on
+                    different filesystems
+        """
+        if not os.path.isdir(self.run_folder):
+            os.makedirs(self.run_folder)
+
+        self.count += 1
+        trashed_name = '{}-{}'.format(self.count, os.path.basename(path))
+        trashed_path = os.path.join(self.run_folder, trashed_name)
+
+        try:
+            retry(os.rename, path, trashed_path)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return False
+            if e.errno not in (errno.EPERM, errno.EACCES):
+                raise
+            # Immutable files can't be renamed
+            remove_immutable_attribute(path)
+            os.rename(path, trashed_path)
+
+        with open(os.path.join(self.run_folder, 'manifest'), 'a') as f:
+            f.write("{}\t{}\n".format(trashed_name, path))
+
+        return True
+
+    def purge(self):
+        """
+        Delete the previous runs that are too old or too big, the oldest
+        first
+        """
+        if not os.path.isdir(self.folder):
+            return
+
+        oldest_allowed = time.time() - self.max_age_days * 24 * 3600
+        kept_size = 0
+
+        # Keep the most recent runs
+        for run in sorted(os.listdir(self.folder), reverse=True):
+            if run == self.run:
+                continue
+            run_folder = os.path.join(self.folder, run)
+            kept_size += get_size(run_folder)
+            if (kept_size > self.max_size
+                    or os.path.getmtime(run_folder) < oldest_allowed):
+                delete(run_folder, throttle=self.throttle)
+
+    def purge_in_background(self):
+        """Purge the previous runs in a thread, if not already doing it"""
+        if self.purge_thread is None:
+            self.purge_thread = threading.Thread(target=self.purge,
+                                                 name='dbas-trash-purge')
+            self.purge_thread.start()
+
+    def wait(self):
+        """Wait for the background purge to be done"""
+        if self.purge_thread is not None:
+            self.purge_thread.join()
+
+
+class Dbas(object):
+    """
+    Main Dbas class.
+
+    It can be embedded: every mode returns structured results, problems are
+    raised as DbasError and questions go through the given callbacks, so
+    several homes can be handled by a single process.
+    """
+
+    def __init__(self, home=None, dropbox_folder=None, config_path=None,
+                 confirm_callback=None, conflict_callback=None,
+                 checksum=False, progress_callback=None,
+                 max_kbytes_per_second=None, max_operations_per_second=None,
+                 idle_io=None, wait_for_lock=True, settle=False,
+                 progress=None, backend=None):
+        """
+        Dbas Constructor
+
+        Args:
+            home (str): Home folder to manage, $HOME by default
+            dropbox_folder (str): Dropbox folder to use, found from the
+                                  Dropbox config of the home by default
+            config_path (str): Path to the config file, ~/.dbas.cfg by
+                               default
+            confirm_callback (callable): Called with a question, returns
+                                         True if confirmed. Asks the user by
+                                         default.
+            conflict_callback (callable): Called with the mode, the filename
+                                          and the full path of the file in
+                                          the way, returns True if the file
+                                          can be replaced. Uses
+                                          confirm_callback by default.
+            checksum (bool): When replacing a backup, compare the content of
+                             the files of the same size instead of their
+                             modification time
+            progress_callback (callable): Called with the path, the number
+                                          of bytes copied and the total
+                                          after each file copied, and while
+                                          copying a large file
+            max_kbytes_per_second (int): Limit of the kilobytes copied by
+                                         second, for the whole process
+            max_operations_per_second (int): Limit of the files created,
+                                             deleted or changed by second
+            idle_io (bool): Only do I/O when nothing else needs the disk
+            wait_for_lock (bool): When a run of the same mode is already
+                                  going on the home, wait for it and reuse
+                                  its results instead of raising DbasError
+            settle (bool): Wait for Dropbox to be done syncing the Dbas
+                           folder before restoring
+            progress (Progress): Where to report the progress of the runs,
+                                 the applications are scanned first when
+                                 given
+            backend (StorageBackend): Where to keep the backups, the folder
+                                      of [Storage] in the config, or else
+                                      the Dropbox folder, by default
+        """
+        self.home = home or os.environ['HOME']
+        self.config_path = (config_path
+                            or os.path.join(self.home, '.dbas.cfg'))
+        self.confirm = confirm_callback or confirm
+        self.conflict_callback = conflict_callback
+        self.checksum = checksum
+        self.wait_for_lock = wait_for_lock
+        self.settle = settle
+        self.progress = progress
+        self.progress_callback = progress_callback
+
+        storage_folder = get_config_value(self, 'Storage', 'directory', '')
+        if backend is not None:
+            self.backend = backend
+        elif storage_folder and not dropbox_folder:
+            self.backend = DirectoryBackend(
+                os.path.expanduser(storage_folder))
+        else:
+            try:
+                self.backend = DropboxBackend(self.home, dropbox_folder)
+            except IOError:
+                raise DbasError(DropboxBackend.missing_message)
+
+        self.dropbox_folder = self.backend.folder
+        self.dbas_folder = self.backend.dbas_folder
+        self._temp_folder = None
+
+        # Don't get in the way of the user, each instance has its own limits
+        if max_kbytes_per_second is None:
+            max_kbytes_per_second = get_config_value(
+                self, 'Throttling', 'max_kbytes_per_second', 0)
+        if max_operations_per_second is None:
+            max_operations_per_second = get_config_value(
+                self, 'Throttling', 'max_operations_per_second', 0)
+        self.throttle = Throttle()
+        self.throttle.set_limits(max_kbytes_per_second * 1024,
+                                 max_operations_per_second)
+        if idle_io is None:
+            idle_io = get_config_value(self, 'Throttling', 'idle_io', False)
+        # Only the thread doing a run has its I/O priority lowered, and only
+        # during the run
+        self.idle_io = idle_io
+
+        self.state = StateCache(os.path.join(self.home, DBAS_STATE_PATH,
+                                             STATE_CACHE_FILE))
+        self.trash = Trash(
+            os.path.join(self.home, DBAS_STATE_PATH, TRASH_PATH),
+            get_config_value(self, 'Trash', 'max_size_mb', TRASH_MAX_SIZE_MB),
+            get_config_value(self, 'Trash', 'max_age_days',
+                             TRASH_MAX_AGE_DAYS),
+            self.throttle)
+        self.snapshots = SnapshotStore(
+            os.path.join(self.home, DBAS_STATE_PATH, SNAPSHOTS_PATH),
+            get_config_value(self, 'Snapshots', 'max_count',
+                             SNAPSHOTS_MAX_COUNT),
+            get_config_value(self, 'Snapshots', 'max_age_days',
+                             SNAPSHOTS_MAX_AGE_DAYS),
+            self.trash)
+
+        # Each instance has its own list of applications, custom ones
+        # included
+        self.apps = {}
+        for app_name, definition in SUPPORTED_APPS.iteritems():
+            if isinstance(definition, dict):
+                self.apps[app_name] = dict(definition)
+            else:
+                self.apps[app_name] = list(definition)
+        update_supported_apps(self)
+
+        # Running processes, read when first needed
+        self.processes = None
+
+        # What the run did, and how many files were in the way
+        self.metrics = Metrics()
+        self.conflict_count = 0
+
+        # Copy, skip or defer large files when backing up
+        self.large_file_policy = get_config_value(self, 'Large Files',
+                                                  'policy',
+                                                  LARGE_FILE_POLICY_COPY)
+        if self.large_file_policy not in LARGE_FILE_POLICIES:
+            raise DbasError("Unknown large file policy: {}"
+                            .format(self.large_file_policy))
+        # Hardlinks are kept across every copy of the run
+        self.copier = Copier(
+            get_config_value(self, 'Large Files', 'size_mb',
+                             LARGE_FILE_SIZE_MB) * 1024 * 1024,
+            get_config_value(self, 'Large Files', 'chunk_size_kb',
+                             LARGE_FILE_CHUNK_SIZE_KB) * 1024,
+            self._copy_progress, self.throttle)
+
+        # Attributes of the files looked at during a run, see
+        # find_attributes()
+        self.attributes = self.copier.attributes
+
+        # Content addressed storage, for the applications using it
+        self.objects = ObjectStore(
+            os.path.join(self.dbas_folder, OBJECTS_PATH),
+            os.path.join(self.dbas_folder, INDEX_PATH), self.copier,
+            self.trash, self.backend)
+        self.object_store_apps = get_object_store_apps(self)
+
+    def _copy_progress(self, path, copied, total):
+        """
+        Report what the copier did
+
+        Args:
+            path (str): File being copied
+            copied (int): Number of bytes of it copied so far
+            total (int): Size of the file
+        """
+        if self.progress is not None:
+            self.progress.update(path, copied, total)
+        if self.progress_callback is not None:
+            self.progress_callback(path, copied, total)
+
+    def _check_for_usable_environment(self):
+        """Check if the current env is usable and has everything's required"""
+
+        # Do we have a home folder ?
+        if not os.path.isdir(self.dropbox_folder):
+            raise DbasError(self.backend.missing_message)
+
+        # Running applications, like Sublime Text, are known to cause
+        # problems: they are left alone, see _run_apps()
+
+    def check_for_usable_backup_env(self):
+        """Check if the current env can be used to back up files"""
+        self._check_for_usable_environment()
+        self.create_dbas_home()
+
+    def check_for_usable_restore_env(self):
+        """Check if the current env can be used to restore files"""
+        self._check_for_usable_environment()
+
+        if not os.path.isdir(self.dbas_folder):
+            raise DbasError("Unable to find the Dbas folder: {}\n"
+                            "You might want to backup some files or get your"
+                            " Dropbox folder synced first."
+                            .format(self.dbas_folder))
+
+    @property
+    def temp_folder(self):
+        """Folder for the temporary files of the run, created when needed"""
+        if self._temp_folder is None:
+            self._temp_folder = tempfile.mkdtemp(prefix="dbas_tmp_")
+        return self._temp_folder
+
+    def clean_temp_folder(self):
+        """Delete the temp folder and files created while running"""
+        if self._temp_folder is not None:
+            shutil.rmtree(self._temp_folder)
+            self._temp_folder = None
+
+    def close(self):
+        """Wait for the background work and clean up after the run"""
+        self.trash.wait()
+        self.clean_temp_folder()
+
+    def create_dbas_home(self):
+        """If the Dbas home folder does not exist, create it"""
+        if not os.path.isdir(self.dbas_folder):
+            if self.confirm("Dbas needs a folder to store your configuration "
+                            " files\nDo you want to create it now ? <{}>"
+                            .format(self.dbas_folder)):
+                os.mkdir(self.dbas_folder)
+            else:
+                raise DbasError("Dbas can't do anything without a home =(")
+
+    def log(self, message, level=logging.INFO, **fields):
+        """
+        Tell the user what is being done, through the dbas logger
+
+        Args:
+            message (str)
+            level (int): Logging level
+            fields: Structured data about the message, e.g. app='Git'
+        """
+        fields['home'] = self.home
+        LOGGER.log(level, message, extra={'fields': fields})
+
+    def _run_exclusively(self, mode, apps, run=None):
+        """
+        Run the given mode on each application, holding the run lock of the
+        home. Waiting for a run of the same mode on the same applications
+        reuses its results instead of doing it all again.
+
+        Args:
+            mode (str): One of the modes changing files
+            apps (iterable): Application names
+            run (callable): Does the run and returns the AppResult of each
+                            application, _run_apps() by default
+
+        Returns:
+            (list): AppResult of each application
+        """
+        apps = list(apps)
+        lock = RunLock(os.path.join(self.home, DBAS_STATE_PATH))
+        started = time.time()
+
+        if not lock.acquire(mode, blocking=False):
+            holder = lock.get_holder()
+            if holder == mode and not self.wait_for_lock:
+                raise DbasError("A {} of this home is already running"
+                                .format(mode))
+            self.log("Waiting for the {} already running..."
+                     .format(holder or 'run'), mode=mode, holder=holder)
+            lock.acquire(mode)
+
+        try:
+            # Attributes may have changed since the last run, and the state
+            # was saved by the runs this one waited for
+            self.attributes.clear()
+            self.state.load()
+            last_run = lock.get_last_run()
+            if (last_run is not None
+                    and last_run.get('mode') == mode
+                    and last_run.get('apps') == sorted(apps)
+                    and last_run.get('ended', 0) >= started):
+                self.log("Reusing the results of the {} that just ended"
+                         .format(mode), mode=mode)
+                return [AppResult.from_dict(data)
+                        for data in last_run['results']]
+
+            if self.idle_io and not set_io_priority(idle=True):
+                self.log("Unable to lower the I/O priority", logging.WARNING)
+            try:
+                if run is None:
+                    results = self._run_apps(mode, apps)
+                else:
+                    results = run()
+            finally:
+                if self.idle_io:
+                    set_io_priority(idle=False)
+            lock.set_last_run(mode, apps, results)
+            return results
+        finally:
+            lock.release()
+
+    def _run_apps(self, mode, apps):
+        """
+        Run the given mode on each application, logging a summary for each
+        one.
+
+        Args:
+            mode (str): BACKUP_MODE, RESTORE_MODE or UNINSTALL_MODE
+            apps (iterable): Application names
+
+        Returns:
+            (list): AppResult of each application
+        """
+        # Make room in the trash while we work
+        self.trash.purge_in_background()
+
+        # The fast paths of the storage, when copying to it
+        self.copier.backend = self.backend if mode == BACKUP_MODE else None
+
+        # Applications may have started since the last run
+        self.processes = None
+
+        results = []
+        deferred = []
+        apps = list(apps)
+        profiles = dict((app_name, self.get_app_profile(app_name))
+                        for app_name in apps)
+        if self.progress is not None:
+            # Totals to measure the progress against
+            folder = self.home if mode == BACKUP_MODE else self.dbas_folder
+            for app_name in apps:
+                files = size = 0
+                # What is in sync won't be copied, nor make the run longer
+                statuses = profiles[app_name].status()
+                for filename in profiles[app_name].files:
+                    if statuses.get(filename) == STATUS_LINKED:
+                        continue
+                    summary = get_tree_summary(os.path.join(folder,
+                                                            filename))
+                    files += summary[0]
+                    size += summary[1]
+                self.progress.add_app(app_name, files, size)
+
+        for app_name in apps:
+            profile = profiles[app_name]
+            if self.is_app_running(profile):
+                # Give it until the end of the run to quit
+                deferred.append(profile)
+            else:
+                results.append(self._run_app(mode, profile))
+
+        if deferred:
+            # Look again at what is running
+            self.processes = None
+            for profile in deferred:
+                if self.is_app_running(profile):
+                    self.log("{} is running, leaving it alone"
+                             .format(profile.name), logging.WARNING,
+                             app=profile.name, mode=mode)
+                    result = AppResult(profile.name)
+                    result.skipped = 'running'
+                    results.append(result)
+                else:
+                    results.append(self._run_app(mode, profile))
+
+        # Then the large files put off until now
+        for result in results:
+            profile = profiles[result.name]
+            if profile.deferred:
+                deferred_result = self._run_app(mode, profile,
+                                                profile.deferred)
+                result.files.extend(deferred_result.files)
+                result.error = result.error or deferred_result.error
+
+        self.state.save()
+        self.publish_host_summary(results)
+        if mode == BACKUP_MODE:
+            self.write_manifest(results)
+
+        # Objects may not be referenced anymore
+        if self.objects.changed:
+            self.objects.gc(get_config_value(self, 'Object Store',
+                                             'gc_grace_days',
+                                             OBJECTS_GC_GRACE_DAYS))
+            self.objects.changed = False
+
+        return results
+
+    def write_manifest(self, results):
+        """
+        Update the manifest of the Dbas folder with the files of the
+        applications just backed up: the number of files and bytes of each
+        entry. It's only written when it changed.
+
+        Args:
+            results (list): AppResult of each application backed up
+        """
+        path = os.path.join(self.dbas_folder, MANIFEST_FILE)
+        manifest = read_manifest(path)
+        entries = dict(manifest)
+        for result in results:
+            for filename in get_app_files(self.apps[result.name]):
+                dbas_filepath = os.path.join(self.dbas_folder, filename)
+                if os.path.exists(dbas_filepath):
+                    entries[filename] = get_tree_summary(dbas_filepath)
+                else:
+                    entries.pop(filename, None)
+
+        if entries == manifest:
+            return
+
+        self.backend.atomic_write(path, json.dumps(
+            {'version': VERSION, 'entries': entries}, indent=1,
+            sort_keys=True))
+
+    def is_manifest_complete(self, filenames=None):
+        """
+        Args:
+            filenames (iterable): Entries to look at, every entry of the
+                                  manifest by default
+
+        Returns:
+            (bool): True if the Dbas folder holds what its manifest lists
+                    for these entries, False if it does not or there is no
+                    manifest
+        """
+        manifest = read_manifest(os.path.join(self.dbas_folder,
+                                              MANIFEST_FILE))
+        if filenames is None:
+            entries = manifest
+        else:
+            entries = dict((filename, manifest[filename])
+                           for filename in filenames if filename in manifest)
+        return bool(manifest) and all(
+            get_tree_summary(os.path.join(self.dbas_folder, filename))
+            == summary
+            for filename, summary in entries.iteritems())
+
+    def get_files_to_restore(self, apps):
+        """
+        Args:
+            apps (iterable): Application names
+
+        Returns:
+            (list): Files of the applications not linked nor in sync yet,
+                    the ones a restore changes
+        """
+        filenames = []
+        for app_name in apps:
+            profile = self.get_app_profile(app_name)
+            statuses = profile.status()
+            filenames.extend(filename for filename in profile.files
+                             if statuses.get(filename) != STATUS_LINKED)
+        return filenames
+
+    def wait_for_dropbox(self, quiet_seconds=SETTLE_QUIET_SECONDS,
+                         timeout_seconds=SETTLE_TIMEOUT_SECONDS,
+                         filenames=None):
+        """
+        Wait until Dropbox is done syncing the Dbas folder: until it holds
+        what its manifest lists, or nothing changed in it for quiet_seconds.
+        The files already linked keep changing, the applications write to
+        them, only the ones about to be restored are compared.
+
+        Args:
+            quiet_seconds (float)
+            timeout_seconds (float): Give up waiting past this delay
+            filenames (iterable): Entries of the manifest to wait for, all
+                                  of them by default
+
+        Returns:
+            (bool): True if Dropbox looks done, False if it still syncs
+        """
+        start = last_change = time.time()
+        watcher = FolderWatcher(self.dbas_folder)
+        try:
+            while not self.is_manifest_complete(filenames):
+                now = time.time()
+                if now - last_change >= quiet_seconds:
+                    # Nothing changed for a while
+                    return True
+                if now - start >= timeout_seconds:
+                    self.log("Dropbox is still syncing {}, going on anyway"
+                             .format(self.dbas_folder), logging.WARNING)
+                    return False
+                self.log("Waiting for Dropbox to sync {}..."
+                         .format(self.dbas_folder), logging.DEBUG)
+                if watcher.wait(min(last_change + quiet_seconds,
+                                    start + timeout_seconds) - now):
+                    last_change = time.time()
+            return True
+        finally:
+            watcher.close()
+
+    def publish_host_summary(self, results):
+        """
+        Update the summary of this host in the Dbas folder with the status
+        of the applications just handled. It's only written when it
+        changed, so Dropbox has nothing to upload otherwise.
+
+        Args:
+            results (list): AppResult of each application handled
+        """
+        hosts_folder = os.path.join(self.dbas_folder, HOSTS_PATH)
+        path = os.path.join(hosts_folder, platform.node() + '.json')
+
+        summary = read_host_summary(path) or {}
+        apps = dict(summary.get('apps', {}))
+        for result in results:
+            if result.skipped:
+                continue
+            app_status = get_app_status(
+                self.get_app_profile(result.name).status())
+            if app_status is None:
+                apps.pop(result.name, None)
+            else:
+                apps[result.name] = app_status
+
+        if summary.get('apps') == apps:
+            return
+
+        try:
+            if not os.path.isdir(hosts_folder):
+                os.makedirs(hosts_folder)
+            self.backend.atomic_write(path, json.dumps(
+                {'host': platform.node(), 'version': VERSION,
+                 'updated': int(time.time()), 'apps': apps},
+                indent=1, sort_keys=True))
+        except EnvironmentError as e:
+            self.log("Unable to publish the summary of this host: {}"
+                     .format(e), logging.WARNING, path=path)
+
+    def drift(self):
+        """
+        Compare the summaries published by every host, see
+        publish_host_summary()
+
+        Returns:
+            (dict): Status of the application on each host, by host name,
+                    by name of the applications that differ
+        """
+        self.check_for_usable_restore_env()
+
+        hosts_folder = os.path.join(self.dbas_folder, HOSTS_PATH)
+        try:
+            names = os.listdir(hosts_folder)
+        except OSError:
+            names = []
+
+        summaries = {}
+        for name in names:
+            if name.endswith('.json') and not name.startswith('.'):
+                summary = read_host_summary(os.path.join(hosts_folder, name))
+                if summary is not None:
+                    summaries[summary.get('host', name[:-len('.json')])] = \
+                        summary.get('apps', {})
+
+        drift = {}
+        app_names = set()
+        for apps in summaries.itervalues():
+            app_names.update(apps)
+        for app_name in app_names:
+            statuses = dict((host, apps.get(app_name, STATUS_MISSING))
+                            for host, apps in summaries.iteritems())
+            if len(set(statuses.itervalues())) > 1:
+                drift[app_name] = statuses
+
+        return drift
+
+    def resolve_conflict(self, mode, filename, filepath):
+        """
+        Decide if a file in the way of a backup or a restore can be replaced
+
+        Args:
+            mode (str): BACKUP_MODE or RESTORE_MODE
+            filename (str): Relative path of the file from the home
+            filepath (str): Full path to the file in the way
+
+        Returns:
+            (bool): True if the file can be replaced
+        """
+        self.conflict_count += 1
+
+        if self.conflict_callback is not None:
+            return self.conflict_callback(mode, filename, filepath)
+
+        # Name it right
+        file_type = get_file_type(filepath)
+
+        if mode == BACKUP_MODE:
+            # Ask the user if he really want to replace it
+            question = ("A {} named {} already exists in the backup."
+                        "\nAre you sure that your want to replace it ?"
+                        .format(file_type, filepath))
+        else:
+            question = ("You already have a {} named {} in your home."
+                        "\nDo you want to replace it with your backup ?"
+                        .format(file_type, filename))
+
+        return self.confirm(question)
+
+    def get_app_profile(self, app_name):
+        """
+        Args:
+            app_name (str): Name of a supported application
+
+        Returns:
+            (ApplicationProfile)
+        """
+        definition = self.apps[app_name]
+        if (get_app_storage(definition) == STORAGE_OBJECTS
+                or app_name.lower() in self.object_store_apps):
+            profile_class = ObjectStoreProfile
+        elif get_app_mode(definition) == APP_MODE_COPY:
+            profile_class = CopyModeProfile
+        else:
+            profile_class = ApplicationProfile
+
+        return profile_class(self, get_app_files(definition), app_name,
+                             get_app_processes(definition))
+
+    def is_app_running(self, profile):
+        """
+        Check if any process of an application is running.
+        All the running processes are read once by run, when first needed.
+
+        Args:
+            profile (ApplicationProfile)
+
+        Returns:
+            (bool): True if the application is running
+        """
+        if not profile.processes:
+            return False
+
+        if self.processes is None:
+            self.processes = ProcessTable()
+
+        return any(self.processes.is_running(process_name)
+                   for process_name in profile.processes)
+
+    def _run_app(self, mode, profile, *args):
+        """
+        Run the given mode on an application, logging a summary and
+        measuring what it did.
+        A failure is recorded in the result, so the other applications go
+        on. Transient I/O errors are retried by the file operations
+        themselves, see retry().
+
+        Args:
+            mode (str): BACKUP_MODE, RESTORE_MODE or UNINSTALL_MODE
+            profile (ApplicationProfile)
+            args: Given to the mode method of the profile
+
+        Returns:
+            (AppResult)
+        """
+        start = time.time()
+        files_copied = self.copier.files_copied
+        bytes_copied = self.copier.bytes_copied
+        conflict_count = self.conflict_count
+        # Hardlinks are only recreated within the files of the application
+        self.copier.reset()
+
+        if self.progress is not None:
+            self.progress.start_app(profile.name)
+        try:
+            result = getattr(profile, mode)(*args)
+        except Exception as e:
+            result = self._app_failed(mode, profile.name, e)
+        if self.progress is not None:
+            self.progress.finish_app(profile.name)
+        self._log_summary(mode, result)
+
+        labels = {'mode': mode, 'app': profile.name}
+        self.metrics.add('dbas_app_duration_seconds', time.time() - start,
+                         **labels)
+        self.metrics.add('dbas_files_copied',
+                         self.copier.files_copied - files_copied, **labels)
+        self.metrics.add('dbas_bytes_copied',
+                         self.copier.bytes_copied - bytes_copied, **labels)
+        self.metrics.add('dbas_links_created',
+                         sum(1 for file_result in result.files
+                             if file_result.action in LINK_ACTIONS),
+                         **labels)
+        self.metrics.add('dbas_conflicts',
+                         self.conflict_count - conflict_count, **labels)
+
+        return result
+
+    def _app_failed(self, mode, app_name, exception):
+        """
+        Record the failure of an application
+
+        Args:
+            mode (str)
+            app_name (str): Application name
+            exception (Exception): What went wrong
+
+        Returns:
+            (AppResult): Result of the application, with the error
+        """
+        result = AppResult(app_name)
+        result.error = "{}: {}".format(type(exception).__name__, exception)
+        self.log("{} failed: {}".format(app_name, result.error),
+                 logging.ERROR, app=app_name, mode=mode, error=result.error)
+        self.log(traceback.format_exc(), logging.DEBUG, app=app_name,
+                 mode=mode)
+        self.metrics.add('dbas_failures', 1, mode=mode, app=app_name)
+
+        return result
+
+    def _log_summary(self, mode, result):
+        """
+        Log what happened to the files of an application, if anything
+
+        Args:
+            mode (str)
+            result (AppResult)
+        """
+        if result.files:
+            counts = result.counts()
+            summary = ', '.join("{} {}".format(action, count)
+                                for action, count
+                                in sorted(counts.iteritems()))
+            self.log("{}: {}".format(result.name, summary), SUMMARY_LEVEL,
+                     app=result.name, mode=mode, counts=counts)
+
+    def backup(self, apps=None):
+        """
+        Backup the given applications
+
+        Args:
+            apps (iterable): Application names, the ones allowed and not
+                             ignored in the config by default
+
+        Returns:
+            (list): AppResult of each application
+        """
+        # Check the env where the command is being run
+        self.check_for_usable_backup_env()
+
+        if apps is None:
+            apps = get_apps_to_backup(self)
+
+        return self._run_exclusively(BACKUP_MODE, apps)
+
+    def restore(self, apps=None):
+        """
+        Restore the given applications
+
+        Args:
+            apps (iterable): Application names, all of them by default
+
+        Returns:
+            (list): AppResult of each application
+        """
+        # Check the env where the command is being run
+        self.check_for_usable_restore_env()
+
+        if apps is None:
+            # Restore 'Dbas' first to get the configs in place
+            apps = ['Dbas'] + sorted(app_name for app_name in self.apps
+                                     if app_name != 'Dbas')
+
+        # Don't link half synced files
+        if self.settle and self.backend.syncs:
+            self.wait_for_dropbox(
+                get_config_value(self, 'Settle', 'quiet_seconds',
+                                 SETTLE_QUIET_SECONDS),
+                get_config_value(self, 'Settle', 'timeout_seconds',
+                                 SETTLE_TIMEOUT_SECONDS),
+                self.get_files_to_restore(apps))
+
+        return self._run_exclusively(RESTORE_MODE, apps)
+
+    def uninstall(self, apps=None):
+        """
+        Put the files of the given applications back in the home
+
+        Args:
+            apps (iterable): Application names, all of them by default
+
+        Returns:
+            (list): AppResult of each application
+        """
+        # Check the env where the command is being run
+        self.check_for_usable_restore_env()
+
+        if apps is None:
+            apps = self.apps
+
+        return self._run_exclusively(UNINSTALL_MODE, apps)
+
+    def rollback(self, app_name):
+        """
+        Put the files of an application back as they were before their last
+        replacement by a backup or a restore
+
+        Args:
+            app_name (str): Application name
+
+        Returns:
+            (AppResult): The files put back
+        """
+        return self._run_exclusively(ROLLBACK_MODE, [app_name],
+                                     lambda: [self._rollback(app_name)])[0]
+
+    def _rollback(self, app_name):
+        """
+        See rollback()
+
+        Args:
+            app_name (str): Application name
+
+        Returns:
+            (AppResult): The files put back
+        """
+        result = AppResult(app_name)
+        for filename in self.snapshots.rollback(app_name):
+            # A file put back in the home is not a link of ours anymore
+            if self.state.is_linked(filename,
+                                    os.path.join(self.home, filename)):
+                self.state.remove(filename)
+            result.add(filename, ACTION_ROLLED_BACK)
+        self.state.save()
+
+        return result
+
+    def relink(self, jobs=None):
+        """
+        Point the links Dbas owns to the current Dbas folder, after the
+        Dropbox folder moved. The links are found in the state cache and in
+        a single scan of the files of every application, then rewritten in
+        parallel. Nothing else is touched.
+
+        Args:
+            jobs (int): Number of links rewritten at once, one by CPU by
+                        default
+
+        Returns:
+            (list): AppResult of each application having links rewritten,
+                    with the error of the ones that could not be
+        """
+        self.check_for_usable_restore_env()
+
+        # Restores create the same links
+        return self._run_exclusively(RELINK_MODE, self.apps,
+                                     lambda: self._relink(jobs))
+
+    def _relink(self, jobs):
+        """
+        See relink()
+
+        Args:
+            jobs (int): Number of links rewritten at once
+
+        Returns:
+            (list): AppResult of each application having links rewritten
+        """
+        # Application of each managed file
+        owners = {}
+        for app_name, definition in self.apps.iteritems():
+            for filename in get_app_files(definition):
+                owners[filename] = app_name
+
+        # Path of each link to rewrite, by filename
+        links = {}
+        for filename, record in self.state.links.iteritems():
+            links[filename] = record['link']
+        for filename in owners:
+            link_path = os.path.join(self.home, filename)
+            if filename not in links and os.path.islink(link_path):
+                # Dropbox folders end with the Dbas folder
+                if os.readlink(link_path).endswith(
+                        os.sep + os.path.join(DBAS_DB_PATH, filename)):
+                    links[filename] = link_path
+
+        tasks = []
+        for filename, link_path in links.iteritems():
+            target = os.path.join(self.dbas_folder, filename)
+            try:
+                current = os.readlink(link_path)
+            except OSError:
+                # Not a link anymore, not ours to change
+                continue
+            if current != target and os.path.exists(target):
+                tasks.append((filename, link_path, target))
+
+        def rewrite(task):
+            try:
+                relink(task[2], task[1])
+            except Exception as e:
+                # The other links are rewritten all the same
+                return e
+
+        pool = multiprocessing.pool.ThreadPool(
+            max(1, min(jobs or multiprocessing.cpu_count(), len(tasks))))
+        try:
+            errors = pool.map(rewrite, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        results = {}
+        for (filename, link_path, target), e in sorted(zip(tasks, errors)):
+            app_name = owners.get(filename, filename)
+            result = results.setdefault(app_name, AppResult(app_name))
+            if e is None:
+                self.state.add_link(filename, link_path, target)
+                result.add(filename, ACTION_RELINKED)
+            else:
+                result.error = "{}: {}".format(type(e).__name__, e)
+                self.log("Unable to relink {}: {}".format(filename, e),
+                         logging.ERROR, app=app_name, file=filename,
+                         mode=RELINK_MODE, error=result.error)
+        self.state.save()
+
+        for app_name in sorted(results):
+            self._log_summary(RELINK_MODE, results[app_name])
+
+        return [results[app_name] for app_name in sorted(results)]
+
+    def conflicts(self, policy=None, apps=None):
+        """
+        Find the conflicted copies Dropbox left next to the managed files, in
+        a single walk of the Dbas folder, and resolve them.
+
+        Args:
+            policy (str): One of CONFLICT_POLICIES, conflicted copies are
+                          only reported by default
+            apps (iterable): Application names, all the known ones by default
+
+        Returns:
+            (list): AppResult of each application having conflicted copies,
+                    by managed path
+        """
+        # Check the env where the command is being run
+        self.check_for_usable_restore_env()
+
+        if apps is None:
+            apps = self.apps.iterkeys()
+        apps = list(apps)
+
+        if policy is None:
+            # Only reported, nothing is changed
+            return self._conflicts(policy, apps)
+        return self._run_exclusively(CONFLICTS_MODE, apps,
+                                     lambda: self._conflicts(policy, apps))
+
+    def _conflicts(self, policy, apps):
+        """
+        See conflicts()
+
+        Args:
+            policy (str): One of CONFLICT_POLICIES, or None
+            apps (list): Application names
+
+        Returns:
+            (list): AppResult of each application having conflicted copies
+        """
+        # Application of each managed file
+        owners = {}
+        for app_name in apps:
+            for filename in get_app_files(self.apps[app_name]):
+                owners[filename] = app_name
+
+        results = {}
+        for filename, copies in sorted(
+                find_conflicted_copies(self.dbas_folder).iteritems()):
+            # The managed file itself or the managed folder containing it
+            managed = filename
+            while managed and managed not in owners:
+                managed = os.path.dirname(managed)
+            if not managed:
+                continue
+            app_name = owners[managed]
+
+            action = resolve_conflicted_copies(
+                os.path.join(self.dbas_folder, filename),
+                [os.path.join(self.dbas_folder, name) for name in copies],
+                policy, self.trash)
+            self.log("{}: {} conflicted copies {}"
+                     .format(filename, len(copies), action),
+                     app=app_name, file=filename, copies=copies,
+                     action=action, mode=CONFLICTS_MODE)
+            results.setdefault(app_name, AppResult(app_name)).add(filename,
+                                                                  action)
+
+        for app_name in sorted(results):
+            self._log_summary(CONFLICTS_MODE, results[app_name])
+
+        return [results[app_name] for app_name in sorted(results)]
+
+    def status(self, apps=None):
+        """
+        Report the state of the given applications, without changing them
+
+        Args:
+            apps (iterable): Application names, the ones allowed and not
+                             ignored in the config by default
+
+        Returns:
+            (dict): Status of each file present on either side, by filename,
+                    by application name
+        """
+        # Check the env where the command is being run
+        self._check_for_usable_environment()
+
+        if apps is None:
+            apps = get_apps_to_backup(self)
+
+        return dict((app_name, self.get_app_profile(app_name).status())
+                    for app_name in apps)
+
+
+####################
+# Useful functions #
+####################
+
+
+def confirm(question):
+    """
+    Ask the user if he really want something to happen
+
+    Args:
+        question(str): What can happen
+
+    Returns:
+        (boolean): Confirmed or not
+    """
+    # Don't ask before having told everything
+    flush_logging()
+
+    while True:
+        answer = raw_input(question + ' <Yes|No>')
+        if answer == 'Yes':
+            confirmed = True
+            break
+        if answer == 'No':
+            confirmed = False
+            break
+
+    return confirmed
+
+
+def delete(filepath, trash=None, throttle=None):
+    """
+    Delete the given file, directory or link.
+    Given a trash, the file is only moved in there and can be undeleted until
+    the trash is purged. It's deleted for real if it can't be moved in the
+    trash.
+
+    Args:
+        filepath (str): Absolute full path to a file. e.g. /path/to/file
+        trash (Trash): Where to move the file
+        throttle (Throttle): Limits of the deletion, the ones of the trash
+                             by default
+    """
+    if throttle is None:
+        throttle = trash.throttle if trash is not None else UNLIMITED
+    throttle.operate()
+    if trash is not None and trash.put(filepath):
+        return
+
+    # Some files have ACLs, let's remove them recursively. Both attributes
+    # are read by the same walk, the second one only lstat()s
+    attributes = {}
+    remove_acl(filepath, attributes)
+
+    # Some files have immutable attributes, let's remove them recursively
+    remove_immutable_attribute(filepath, attributes)
+
+    # Finally remove the files and folders
+    if os.path.isfile(filepath) or os.path.islink(filepath):
+        retry(os.remove, filepath)
+    elif os.path.isdir(filepath):
+        if throttle.operations is None:
+            retry(shutil.rmtree, filepath)
+        else:
+            # One removal at a time
+            for root, dirs, files in os.walk(filepath, topdown=False):
+                for name in files:
+                    throttle.operate()
+                    os.remove(os.path.join(root, name))
+                for name in dirs:
+                    throttle.operate()
+                    path = os.path.join(root, name)
+                    if os.path.islink(path):
+                        os.remove(path)
+                    else:
+                        os.rmdir(path)
+            os.rmdir(filepath)
+
+
+def copy(src, dst, copier=None):
+    """
+    Copy a file or a folder (recursively) from src to dst.
+    Files linked several times are copied once, their links are recreated as
+    hardlinks to that copy.
+    For simplicity sake, both src and dst must be absolute path and must
+    include the filename of the file or folder.
+    Also do not include any trailing slash.
+
+    e.g. copy('/path/to/src_file', '/path/to/dst_file')
+    or copy('/path/to/src_folder', '/path/to/dst_folder')
+
+    But not: copy('/path/to/src_file', 'path/to/')
+    or copy('/path/to/src_folder/', '/path/to/dst_folder')
+
+    Args:
+        src (str): Source file or folder
+        dst (str): Destination file or folder
+        copier (Copier): Keeps the hardlinks across copies, only within this
+                         one by default
+    """
+    assert isinstance(src, str) or isinstance(src, unicode)
+    assert os.path.exists(src)
+    assert isinstance(dst, str) or isinstance(src, unicode)
+
+    if copier is None:
+        copier = Copier()
+
+    # Create the path to the dst file if it does not exists
+    abs_path = os.path.dirname(os.path.abspath(dst))
+    if not os.path.isdir(abs_path):
+        os.makedirs(abs_path)
+
+    _copy_entry(src, os.stat(src), dst, copier)
+
+    # Set the good mode to the file or folder recursively
+    chmod(dst, copier.throttle, copier.attributes)
+
+
+def _copy_entry(src, src_stat, dst, copier):
+    """
+    Copy a single file or folder, recursively. See copy().
+
+    Args:
+        src (str): Source file or folder
+        src_stat (posix.stat_result): Stat of src, links followed
+        dst (str): Destination file or folder, must not exist
+        copier (Copier)
+    """
+    # We need to copy a single file
+    if stat.S_ISREG(src_stat.st_mode):
+        copier.copy_file(src, src_stat, dst)
+
+    # We need to copy a whole folder
+    elif stat.S_ISDIR(src_stat.st_mode):
+        os.mkdir(dst, stat.S_IMODE(src_stat.st_mode) | stat.S_IRWXU)
+        for name in os.listdir(src):
+            src_path = os.path.join(src, name)
+            # Like copytree(), follow the links and ignore the broken ones
+            child_stat = get_stat(src_path)
+            if child_stat is not None:
+                _copy_entry(src_path, child_stat, os.path.join(dst, name),
+                            copier)
+
+    # What the heck is this ?
+    else:
+        raise ValueError("Unsupported file: {}".format(src))
+
+
+def clone(src, dst, hardlink=True):
+    """
+    Copy a file, folder or link from src to dst, like "cp -al" would:
+    files are hardlinked, only folders and links are created.
+    Files are copied instead if they can't be hardlinked, e.g. when src and
+    dst are not on the same filesystem.
+    The folders containing dst are created if needed.
+
+    Args:
+        src (str): Source file, folder or link
+        dst (str): Destination, must not exist
+        hardlink (bool): Copy files instead of hardlinking them
+    """
+    abs_path = os.path.dirname(os.path.abspath(dst))
+    if not os.path.isdir(abs_path):
+        os.makedirs(abs_path)
+
+    src_stat = os.lstat(src)
+
+    if stat.S_ISLNK(src_stat.st_mode):
+        os.symlink(os.readlink(src), dst)
+
+    elif stat.S_ISDIR(src_stat.st_mode):
+        os.mkdir(dst, stat.S_IMODE(src_stat.st_mode) | stat.S_IRWXU)
+        for name in os.listdir(src):
+            clone(os.path.join(src, name), os.path.join(dst, name), hardlink)
+
+    else:
+        if hardlink:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+
+
+def sync(src, dst, checksum=False, trash=None, copier=None,
+         before_change=None):
+    """
+    Make dst a copy of src, like "rsync -r --delete" would.
+    Only the files that changed are copied and only the ones that vanished
+    are removed, everything else in dst is left untouched.
+    Files are considered unchanged if they have the same size and
+    modification time, or the same content when checksum is set. Property
+    lists having the same content once parsed are always unchanged.
+    Like copy(), both src and dst must be absolute path and must include the
+    filename of the file or folder.
+
+    e.g. sync('/path/to/src_folder', '/path/to/dst_folder')
+
+    Args:
+        src (str): Source file or folder
+        dst (str): Destination file or folder, created if needed
+        checksum (bool): Compare the content of the files instead of their
+                         size and modification time
+        trash (Trash): Where the replaced and removed files go
+        copier (Copier): Keeps the hardlinks across copies, only within this
+                         sync by default
+        before_change (callable): Called once before dst is changed, not at
+                                  all when it is left untouched
+
+    Returns:
+        (int): Number of files and folders copied or removed
+    """
+    assert isinstance(src, str) or isinstance(src, unicode)
+    assert os.path.exists(src)
+    assert isinstance(dst, str) or isinstance(dst, unicode)
+
+    # Create the path to the dst file if it does not exists
+    abs_path = os.path.dirname(os.path.abspath(dst))
+    if not os.path.isdir(abs_path):
+        os.makedirs(abs_path)
+
+    if copier is None:
+        copier = Copier()
+
+    # Find everything to do first, so nothing is changed when a large file
+    # the copier refuses is found
+    operations = []
+    changes = _sync_entry(src, os.stat(src), dst, checksum, operations)
+    if copier.refuse_large:
+        for operation in operations:
+            if operation[0] == SYNC_COPY and copier.is_large(operation[2]):
+                raise LargeFileError("Large file: {}".format(operation[1]))
+
+    if operations and before_change is not None:
+        before_change()
+
+    for operation in operations:
+        if operation[0] == SYNC_DELETE:
+            delete(operation[1], trash)
+        elif operation[0] == SYNC_MKDIR:
+            os.mkdir(operation[1], stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+        else:
+            _, src_path, src_path_stat, dst_path = operation
+            # Write a new file and rename it, dst is never half written
+            temp_path = os.path.join(os.path.dirname(dst_path),
+                                     '.' + os.path.basename(dst_path)
+                                     + '.dbas')
+            copier.copy_file(src_path, src_path_stat, temp_path, dst_path)
+            os.chmod(temp_path, stat.S_IRUSR | stat.S_IWUSR)
+            retry(os.rename, temp_path, dst_path)
+
+    return changes
+
+
+def _sync_entry(src, src_stat, dst, checksum, operations):
+    """
+    Find what to do to sync a single file or folder, recursively. See
+    sync().
+
+    Args:
+        src (str): Source file or folder
+        src_stat (posix.stat_result): Stat of src, links followed
+        dst (str): Destination file or folder
+        checksum (bool): Compare the content of the files of the same size
+        operations (list): Where the operations are added, in order:
+                           (SYNC_DELETE, path), (SYNC_MKDIR, path) or
+                           (SYNC_COPY, src, src_stat, dst)
+
+    Returns:
+        (int): Number of files and folders to copy or remove
+    """
+    changes = 0
+    dst_stat = get_stat(dst, follow_links=False)
+
+    if stat.S_ISDIR(src_stat.st_mode):
+        # Replace anything that is not a folder
+        if dst_stat is not None and not stat.S_ISDIR(dst_stat.st_mode):
+            operations.append((SYNC_DELETE, dst))
+            dst_stat = None
+            changes += 1
+        if dst_stat is None:
+            operations.append((SYNC_MKDIR, dst))
+            dst_names = []
+            changes += 1
+        else:
+            dst_names = os.listdir(dst)
+
+        src_names = os.listdir(src)
+
+        # Remove what vanished from src
+        for name in set(dst_names).difference(src_names):
+            operations.append((SYNC_DELETE, os.path.join(dst, name)))
+            changes += 1
+
+        for name in src_names:
+            src_path = os.path.join(src, name)
+            # Like copytree(), follow the links and ignore the broken ones
+            child_stat = get_stat(src_path)
+            if child_stat is not None:
+                changes += _sync_entry(src_path, child_stat,
+                                       os.path.join(dst, name), checksum,
+                                       operations)
+
+    elif stat.S_ISREG(src_stat.st_mode):
+        if dst_stat is not None and stat.S_ISDIR(dst_stat.st_mode):
+            operations.append((SYNC_DELETE, dst))
+            dst_stat = None
+
+        if (dst_stat is None
+                or not stat.S_ISREG(dst_stat.st_mode)
+                or (checksum and content_digest(src) != content_digest(dst))
+                or (not checksum
+                    and (dst_stat.st_size != src_stat.st_size
+                         or int(dst_stat.st_mtime) != int(src_stat.st_mtime))
+                    # cfprefsd rewrites plists without changing them
+                    and not (is_plist(src)
+                             and content_digest(src) == content_digest(dst)))):
+            operations.append((SYNC_COPY, src, src_stat, dst))
+            changes += 1
+
+    else:
+        raise ValueError("Unsupported file: {}".format(src))
+
+    return changes
+
+
+def get_size(path):
+    """
+    Get the disk usage of a file or folder, recursively
+
+    Args:
+        path (str): Path to the file or folder
+
+    Returns:
+        (int): Size in bytes
+    """
+    path_stat = get_stat(path, follow_links=False)
+    if path_stat is None:
+        return 0
+
+    size = path_stat.st_blocks * 512
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            entry_stat = get_stat(os.path.join(root, name), follow_links=False)
+            if entry_stat is not None:
+                size += entry_stat.st_blocks * 512
+
+    return size
+
+
+def file_digest(path):
+    """
+    Hash the content of a file
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        (str): Hexadecimal SHA-1 of the content
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def content_digest(path):
+    """
+    Hash what a file means rather than its bytes: property lists are parsed
+    and hashed in a canonical form, so a plist rewritten in another format or
+    order has the same digest. Other files get their file_digest().
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        (str): Digest of the content
+    """
+    if is_plist(path):
+        try:
+            canonical = json.dumps(canonicalize_plist(read_plist(path)),
+                                   sort_keys=True, separators=(',', ':'))
+            return 'plist:' + hashlib.sha1(canonical).hexdigest()
+        except PLIST_ERRORS:
+            # Not a valid property list after all
+            pass
+
+    return file_digest(path)
+
+
+def same_content(path1, path2):
+    """
+    Check if two files have the same content, see content_digest()
+
+    Args:
+        path1 (str): Path to a file
+        path2 (str): Path to another file
+
+    Returns:
+        (bool): True if both are files having the same content
+    """
+    stat1 = get_stat(path1)
+    stat2 = get_stat(path2)
+
+    if (stat1 is None or stat2 is None
+            or not stat.S_ISREG(stat1.st_mode)
+            or not stat.S_ISREG(stat2.st_mode)):
+        return False
+
+    if is_plist(path1):
+        return content_digest(path1) == content_digest(path2)
+
+    return (stat1.st_size == stat2.st_size
+            and file_digest(path1) == file_digest(path2))
+
+
+def is_plist(path):
+    """
+    Args:
+        path (str): Path to a file
+
+    Returns:
+        (bool): True if the file is named like a property list
+    """
+    return path.endswith('.plist')
+
+
+def read_plist(path):
+    """
+    Read a XML or binary property list
+
+    Args:
+        path (str): Path to the property list
+
+    Returns:
+        The root object, like plistlib returns it
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data.startswith(BINARY_PLIST_HEADER):
+        return read_binary_plist(data)
+
+    return plistlib.readPlistFromString(data)
+
+
+def read_binary_plist(data):
+    """
+    Parse a binary property list, which plistlib can't do.
+    UIDs are returned as {'CF$UID': uid} like in XML property lists.
+
+    Args:
+        data (str): Content of the property list
+
+    Returns:
+        The root object, like plistlib returns it
+    """
+    if not data.startswith(BINARY_PLIST_HEADER) or len(data) < 40:
+        raise ValueError("Not a binary property list")
+
+    (offset_size, ref_size, object_count, top_object,
+     table_offset) = struct.unpack('>6xBBQQQ', data[-32:])
+
+    def read_uint(offset, size):
+        if size == 0 or offset + size > len(data):
+            raise ValueError("Truncated binary property list")
+        return int(binascii.hexlify(data[offset:offset + size]), 16)
+
+    offsets = [read_uint(table_offset + index * offset_size, offset_size)
+               for index in xrange(object_count)]
+
+    def read_length(offset, info):
+        # Returns the length of an object and where its content starts
+        if info != 0xF:
+            return info, offset + 1
+        size = 1 << (ord(data[offset + 1]) & 0xF)
+        return read_uint(offset + 2, size), offset + 2 + size
+
+    def read_refs(offset, count):
+        return [read_uint(offset + index * ref_size, ref_size)
+                for index in xrange(count)]
+
+    def read_object(ref, depth):
+        if depth > 512:
+            raise ValueError("Binary property list too deep")
+        offset = offsets[ref]
+        marker = ord(data[offset])
+        kind, info = marker >> 4, marker & 0xF
+
+        if marker == 0x00:
+            return None
+        elif marker == 0x08:
+            return False
+        elif marker == 0x09:
+            return True
+        elif kind == 0x1:
+            size = 1 << info
+            value = read_uint(offset + 1, size)
+            # Only the 8 bytes integers are signed
+            if size == 8 and value >= 1 << 63:
+                value -= 1 << 64
+            return value
+        elif kind == 0x2:
+            size = 1 << info
+            return struct.unpack('>f' if size == 4 else '>d',
+                                 data[offset + 1:offset + 1 + size])[0]
+        elif marker == 0x33:
+            seconds = struct.unpack('>d', data[offset + 1:offset + 9])[0]
+            return BINARY_PLIST_EPOCH + datetime.timedelta(seconds=seconds)
+        elif kind == 0x4:
+            length, start = read_length(offset, info)
+            return plistlib.Data(data[start:start + length])
+        elif kind == 0x5:
+            length, start = read_length(offset, info)
+            return data[start:start + length].decode('ascii')
+        elif kind == 0x6:
+            length, start = read_length(offset, info)
+            return data[start:start + 2 * length].decode('utf-16be')
+        elif kind == 0x8:
+            return {'CF$UID': read_uint(offset + 1, info + 1)}
+        elif kind in (0xA, 0xC):
+            length, start = read_length(offset, info)
+            return [read_object(item, depth + 1)
+                    for item in read_refs(start, length)]
+        elif kind == 0xD:
+            length, start = read_length(offset, info)
+            keys = read_refs(start, length)
+            values = read_refs(start + length * ref_size, length)
+            return dict((read_object(key, depth + 1),
+                         read_object(value, depth + 1))
+                        for key, value in zip(keys, values))
+
+        raise ValueError("Unsupported binary property list object: {:#x}"
+                         .format(marker))
+
+    return read_object(top_object, 0)
+
+
+def canonicalize_plist(value):
+    """
+    Turn a property list object into plain JSON serializable data, the same
+    whatever the format of the property list was
+
+    Args:
+        value: A property list object
+
+    Returns:
+        The canonical form of value
+    """
+    if isinstance(value, dict):
+        return dict((unicode(key), canonicalize_plist(item))
+                    for key, item in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        return [canonicalize_plist(item) for item in value]
+    elif isinstance(value, plistlib.Data):
+        return {'$data': base64.b64encode(value.data)}
+    elif isinstance(value, datetime.datetime):
+        return {'$date': value.strftime('%Y-%m-%dT%H:%M:%S')}
+    elif isinstance(value, float):
+        return {'$real': repr(value)}
+    elif isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def find_conflicted_copies(folder):
+    """
+    Find the conflicted copies Dropbox left in a folder, recursively
+
+    Args:
+        folder (str): Folder to search
+
+    Returns:
+        (dict): Paths of the conflicted copies, by path of the file they are
+                a copy of, all relative to folder
+    """
+    copies = {}
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for name in filenames:
+            match = CONFLICTED_COPY_PATTERN.match(name)
+            if match:
+                relpath = os.path.relpath(dirpath, folder)
+                if relpath == os.curdir:
+                    relpath = ''
+                original = os.path.join(
+                    relpath, match.group('stem') +
+                    (match.group('extension') or ''))
+                copies.setdefault(original, []).append(
+                    os.path.join(relpath, name))
+
+    for names in copies.itervalues():
+        names.sort()
+
+    return copies
+
+
+def resolve_conflicted_copies(path, copies, policy=None, trash=None):
+    """
+    Resolve the conflicted copies of a file. Given any policy, the copies
+    identical to the file are dropped first. Then:
+    - CONFLICT_POLICY_IDENTICAL leaves the other ones alone
+    - CONFLICT_POLICY_NEWEST keeps the most recently modified version
+    - CONFLICT_POLICY_PLIST_MERGE merges property lists, the most recent
+      value of each key winning, and keeps the newest version of the others
+
+    Args:
+        path (str): Path to the file
+        copies (list): Paths to its conflicted copies
+        policy (str): One of CONFLICT_POLICIES, nothing is changed if None
+        trash (Trash): Where the losing versions go
+
+    Returns:
+        (str): What was done, ACTION_*
+    """
+    if policy is None:
+        return ACTION_UNRESOLVED
+
+    remaining = []
+    for copy_path in copies:
+        if same_content(path, copy_path):
+            delete(copy_path, trash)
+        else:
+            remaining.append(copy_path)
+
+    if not remaining:
+        return ACTION_DROPPED
+    if policy == CONFLICT_POLICY_IDENTICAL:
+        return ACTION_UNRESOLVED
+
+    # Oldest first, a missing file being the oldest of all
+    versions = sorted(
+        [copy_path for copy_path in [path] + remaining
+         if get_stat(copy_path) is not None],
+        key=lambda version: get_stat(version).st_mtime)
+
+    if policy == CONFLICT_POLICY_PLIST_MERGE and is_plist(path):
+        try:
+            contents = [read_plist(version) for version in versions]
+        except PLIST_ERRORS:
+            # Not valid property lists, keep the newest one
+            contents = []
+        if contents and all(isinstance(content, dict)
+                            for content in contents):
+            merged = {}
+            for content in contents:
+                merge_plists(merged, content)
+
+            # Write a new file and rename it, path is never half written
+            temp_path = os.path.join(os.path.dirname(path),
+                                     '.' + os.path.basename(path) + '.dbas')
+            plistlib.writePlist(merged, temp_path)
+            for version in versions:
+                delete(version, trash)
+            os.rename(temp_path, path)
+            return ACTION_MERGED
+
+    newest = versions[-1]
+    for version in versions[:-1]:
+        delete(version, trash)
+    if newest != path:
+        os.rename(newest, path)
+    return ACTION_KEPT_NEWEST
+
+
+def merge_plists(merged, content):
+    """
+    Merge a property list dictionary into another one, recursively
+
+    Args:
+        merged (dict): Updated with content
+        content (dict): Its values win over the ones of merged
+    """
+    for key, value in content.iteritems():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merge_plists(merged[key], value)
+        else:
+            merged[key] = value
+
+
+def link(target, link, throttle=UNLIMITED, cache=None):
+    """
+    Create a link to a target file or a folder.
+    For simplicity sake, both target and link must be absolute path and must
+    include the filename of the file or folder.
+    Also do not include any trailing slash.
+
+    e.g. link('/path/to/file', '/path/to/link')
+
+    But not: link('/path/to/file', 'path/to/')
+    or link('/path/to/folder/', '/path/to/link')
+
+    Args:
+        target (str): file or folder the link will point to
+        link (str): Link to create
+        throttle (Throttle): Limits of the changes
+        cache (dict): Attributes already known, see find_attributes()
+    """
+    assert isinstance(target, str) or isinstance(target, unicode)
+    assert os.path.exists(target)
+    assert isinstance(link, str) or isinstance(target, unicode)
+
+    # Create the path to the link if it does not exists
+    abs_path = os.path.dirname(os.path.abspath(link))
+    if not os.path.isdir(abs_path):
+        os.makedirs(abs_path)
+
+    # Make sure the file or folder recursively has the good mode
+    chmod(target, throttle, cache)
+
+    # Create the link to target
+    retry(os.symlink, target, link)
+
+
+def relink(target, link):
+    """
+    Point an existing link to another target, atomically: the new link is
+    created aside then renamed over the old one
+
+    Args:
+        target (str): file or folder the link will point to
+        link (str): Link to rewrite
+    """
+    temp_path = os.path.join(os.path.dirname(link),
+                             '.' + os.path.basename(link) + '.dbas')
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    os.symlink(target, temp_path)
+    os.rename(temp_path, link)
+
+
+def reflink(src, dst):
+    """
+    Clone a file, the copy sharing its blocks until either one is changed,
+    on the filesystems supporting it (APFS, Btrfs, XFS...)
+
+    Args:
+        src (str): Source file
+        dst (str): Destination file, must not exist
+
+    Returns:
+        (bool): True if cloned, dst is not created otherwise
+    """
+    if platform.system() == PLATFORM_DARWIN:
+        return (LIBC is not None and hasattr(LIBC, 'clonefile')
+                and LIBC.clonefile(src, dst, 0) == 0)
+
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                return True
+            except IOError:
+                pass
+    os.remove(dst)
+    return False
+
+
+def chmod(target, throttle=UNLIMITED, cache=None):
+    """
+    Recursively set the chmod for files to 0600 and 0700 for folders.
+    It's ok unless we need something more specific.
+
+    Args:
+        target (str): Root file or folder
+        throttle (Throttle): Limits of the changes
+        cache (dict): Attributes already known, see find_attributes()
+    """
+    assert isinstance(target, str) or isinstance(target, unicode)
+    assert os.path.exists(target)
+
+    file_mode = stat.S_IRUSR | stat.S_IWUSR
+    folder_mode = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+
+    # Remove the immutable attribute recursively if there is one
+    attributes = remove_immutable_attribute(target, cache)
+
+    if attributes is not None and not os.path.islink(target):
+        # The files were just walked, don't walk them again
+        for path, path_stat in attributes[2]:
+            if stat.S_ISDIR(path_stat.st_mode):
+                throttle.operate()
+                os.chmod(path, folder_mode)
+            elif stat.S_ISREG(path_stat.st_mode):
+                throttle.operate()
+                os.chmod(path, file_mode)
+
+    elif os.path.isfile(target):
+        throttle.operate()
+        os.chmod(target, file_mode)
+
+    elif os.path.isdir(target):
+        # chmod the root item
+        throttle.operate()
+        os.chmod(target, folder_mode)
+
+        # chmod recursively in the folder it it's one
+        for root, dirs, files in os.walk(target):
+            throttle.operate(len(dirs) + len(files))
+            for cur_dir in dirs:
+                os.chmod(os.path.join(root, cur_dir), folder_mode)
+            for cur_file in files:
+                os.chmod(os.path.join(root, cur_file), file_mode)
+
+    else:
+        raise ValueError("Unsupported file type: {}".format(target))
+
+
+def set_io_priority(idle):
+    """
+    Make the I/O of the current thread only happen when nothing else needs
+    the disk, so a background run never slows the user down, or put its
+    default priority back
+
+    Args:
+        idle (bool): Lower the priority, or put the default one back
+
+    Returns:
+        (bool): True if the priority was changed
+    """
+    if platform.system() == PLATFORM_DARWIN:
+        return (LIBC is not None
+                and LIBC.setiopolicy_np(
+                    IOPOL_TYPE_DISK, IOPOL_SCOPE_THREAD,
+                    IOPOL_THROTTLE if idle else IOPOL_DEFAULT) == 0)
+
+    if os.path.isfile('/usr/bin/ionice'):
+        # The I/O priority is by thread on GNU/Linux
+        try:
+            thread_id = os.readlink('/proc/thread-self').split('/')[-1]
+        except OSError:
+            thread_id = str(os.getpid())
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['/usr/bin/ionice',
+                                    '-c3' if idle else '-c0',
+                                    '-p', thread_id],
+                                   stdout=devnull, stderr=devnull) == 0
+
+    return False
+
+
+def setup_logging(level=logging.INFO, json_lines=False, with_home=False,
+                  stream=None):
+    """
+    Send the dbas logs to a stream, by batches of lines
+
+    Args:
+        level (int): Minimum level to log, SUMMARY_LEVEL to be quiet
+        json_lines (bool): Log JSON objects instead of plain text
+        with_home (bool): Prefix plain text lines with their home
+        stream (file): Where to log, stdout by default
+
+    Returns:
+        (BufferedStreamHandler): The installed handler
+    """
+    handler = BufferedStreamHandler(stream or sys.stdout)
+    if json_lines:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter(with_home))
+
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(level)
+
+    return handler
+
+
+def flush_logging():
+    """Write any buffered log line"""
+    for handler in LOGGER.handlers:
+        handler.flush()
+
+
+def retry(function, *args):
+    """
+    Call a function, again when it fails with a transient I/O error, waiting
+    longer each time. Only a single operation that can be done again from the
+    start is given, e.g. a copy, a link or a rename: running a whole
+    application again would find its files half moved.
+
+    Args:
+        function (callable): Operation to run
+        args: Given to the function
+
+    Returns:
+        What the function returns
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args)
+        except EnvironmentError as e:
+            if e.errno not in TRANSIENT_ERRNOS or attempt >= RETRY_COUNT:
+                raise
+            delay = RETRY_DELAY_SECONDS * 2 ** attempt
+            attempt += 1
+            LOGGER.warning("{}, trying again in {}s".format(e, delay),
+                           extra={'fields': {'attempt': attempt}})
+            time.sleep(delay)
+
+
+def get_stat(path, follow_links=True):
+    """
+    Stat the given path without raising if it does not exist
+
+    Args:
+        path (str): Path to the file or folder
+        follow_links (bool): Stat the target of a link instead of the link
+
+    Returns:
+        (posix.stat_result): The stat result or None if there is no such file
+    """
+    try:
+        if follow_links:
+            return os.stat(path)
+        return os.lstat(path)
+    except OSError:
+        return None
+
+
+def get_file_type(path):
+    """
+    Name the kind of file found at the given path
+
+    Args:
+        path (str): Path to an existing file, folder or link
+
+    Returns:
+        (str): 'file', 'folder' or 'link'
+    """
+    if os.path.isfile(path):
+        file_type = 'file'
+    elif os.path.isdir(path):
+        file_type = 'folder'
+    elif os.path.islink(path):
+        file_type = 'link'
+    else:
+        raise ValueError("Unsupported file: {}".format(path))
+
+    return file_type
+
+
+def error(message):
+    """
+    Throw an error with the given message and immediately quit.
+
+    Args:
+        message(str): The message to display.
+    """
+    sys.exit("Error: {}".format(message))
+
+
+def parse_cmdline_args():
+    """
+    Setup the engine that's gonna parse the command line arguments
 
     Returns:
         (argparse.Namespace)
@@ -911,27 +4984,475 @@ def parse_cmdline_args():
 
     # Add the required arg
     parser.add_argument("mode",
-                        choices=[BACKUP_MODE, RESTORE_MODE, UNINSTALL_MODE],
+                        choices=[BACKUP_MODE, RESTORE_MODE, UNINSTALL_MODE,
+                                 STATUS_MODE, ROLLBACK_MODE, CONFLICTS_MODE,
+                                 DRIFT_MODE, RELINK_MODE],
                         help=("Backup will sync your conf files to Dropbox,"
                               " use this the 1st time you use Dbas.\n"
                               "Restore will link the conf files already in"
                               " Dropbox on your system, use it on any new"
                               " system you use.\n"
                               "Uninstall will reset everything as it was"
-                              " before using Dbas."))
+                              " before using Dbas.\n"
+                              "Status will report the state of each"
+                              " application without changing anything.\n"
+                              "Rollback will put the files of an"
+                              " application back as they were before being"
+                              " replaced by Dbas.\n"
+                              "Conflicts will report the conflicted copies"
+                              " left by Dropbox, and resolve them with"
+                              " --conflict-policy.\n"
+                              "Drift will report the applications in a"
+                              " different state on some hosts.\n"
+                              "Relink will point the links to the Dbas"
+                              " folder again, after moving Dropbox."))
+
+    # The application to roll back
+    parser.add_argument("app",
+                        nargs='?',
+                        help="Application to roll back, with rollback")
+
+    # Run the mode for many homes at once
+    parser.add_argument("--homes",
+                        metavar="FILE",
+                        help=("Batch file listing the homes to run the mode"
+                              " for, one by line. The Dropbox folder of a"
+                              " home can follow it, after a tab. Nothing is"
+                              " asked: conflicting files are left alone."))
+    parser.add_argument("--checksum",
+                        action="store_true",
+                        help=("When replacing a backup, compare the content"
+                              " of the files instead of their modification"
+                              " time to find the ones to copy"))
+    parser.add_argument("--conflict-policy",
+                        choices=CONFLICT_POLICIES,
+                        help=("How conflicts resolves the conflicted copies:"
+                              " drop the identical ones, keep the newest"
+                              " version, or merge property lists. Identical"
+                              " copies are always dropped."))
+    parser.add_argument("--metrics-file",
+                        metavar="FILE",
+                        help=("Write the metrics of the run in this"
+                              " node_exporter textfile, e.g."
+                              " /var/lib/node_exporter/dbas.prom"))
+    parser.add_argument("--bwlimit",
+                        type=int,
+                        metavar="KBPS",
+                        help=("Limit the kilobytes copied by second, see"
+                              " [Throttling] in the config"))
+    parser.add_argument("--max-ops",
+                        type=int,
+                        metavar="OPS",
+                        help=("Limit the files created, deleted or changed by"
+                              " second"))
+    parser.add_argument("--idle-io",
+                        action="store_true",
+                        default=None,
+                        help=("Only read and write when nothing else needs"
+                              " the disk"))
+    parser.add_argument("--no-settle",
+                        action="store_true",
+                        help=("Restore right away, without waiting for"
+                              " Dropbox to be done syncing"))
+    parser.add_argument("--storage-dir",
+                        metavar="DIR",
+                        help=("Keep the backups in this folder, e.g. an NFS"
+                              " mount, instead of the Dropbox folder, see"
+                              " [Storage] in the config"))
+    parser.add_argument("--progress",
+                        choices=PROGRESS_FORMATS,
+                        help=("Report the files and bytes copied, the"
+                              " throughput and the time left on stderr, on a"
+                              " line or as JSON events"))
+    parser.add_argument("--no-wait",
+                        action="store_true",
+                        help=("Exit right away when the same mode is already"
+                              " running on the home, instead of waiting for"
+                              " its results"))
+    parser.add_argument("-q", "--quiet",
+                        action="store_true",
+                        help="Only log a summary by application")
+    parser.add_argument("-v", "--verbose",
+                        action="store_true",
+                        help="Log debugging details too")
+    parser.add_argument("--log-format",
+                        choices=['text', 'json'],
+                        default='text',
+                        help=("Log plain text or JSON objects, one by line"
+                              " (default: %(default)s)"))
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=("Number of homes handled in parallel with"
+                              " --homes, or of links rewritten at once by"
+                              " relink (default: %(default)s)"))
 
     # Parse the command line and return the parsed options
     return parser.parse_args()
 
 
-def get_dropbox_folder_location():
+def write_metrics(metrics, path, mode, start):
+    """
+    Write the metrics of a run, if asked to
+
+    Args:
+        metrics (Metrics)
+        path (str): Path to the node_exporter textfile, nothing is written
+                    if empty
+        mode (str): Mode of the run
+        start (float): When the run started
+    """
+    if not path:
+        return
+
+    end = time.time()
+    metrics.add('dbas_run_duration_seconds', end - start, mode=mode)
+    metrics.add('dbas_run_timestamp_seconds', end, mode=mode)
+    try:
+        metrics.write(os.path.expanduser(path))
+    except EnvironmentError as e:
+        LOGGER.warning("Unable to write the metrics: {}".format(e),
+                       extra={'fields': {'path': path}})
+
+
+def read_homes_file(path):
+    """
+    Read a batch file listing homes, one by line, each one optionally
+    followed by a tab and its Dropbox folder. Empty lines and lines starting
+    with # are ignored.
+
+    Args:
+        path (str): Path to the batch file
+
+    Returns:
+        (list): (home, dropbox_folder) tuples, dropbox_folder can be None
+    """
+    homes = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            dropbox_folder = fields[1].strip() if len(fields) > 1 else None
+            homes.append((fields[0].strip(), dropbox_folder or None))
+
+    return homes
+
+
+def decline(question):
+    """
+    Confirmation callback saying No to everything, used when nobody can
+    answer
+
+    Args:
+        question(str): What can happen
+
+    Returns:
+        (boolean): False
+    """
+    return False
+
+
+def drop_privileges(home):
+    """
+    Run as the owner of the given home from now on, when running as root, so
+    the files created in it are the user's. Only for a process of its own,
+    there's no way back.
+
+    Args:
+        home (str): Home folder
+    """
+    if os.geteuid() != 0:
+        return
+
+    home_stat = os.stat(home)
+    if home_stat.st_uid == 0:
+        return
+
+    try:
+        os.initgroups(pwd.getpwuid(home_stat.st_uid).pw_name,
+                      home_stat.st_gid)
+    except KeyError:
+        # No such user, only its own group then
+        os.setgroups([home_stat.st_gid])
+    os.setgid(home_stat.st_gid)
+    os.setuid(home_stat.st_uid)
+    os.environ['HOME'] = home
+
+
+def run_home(task):
+    """
+    Run a mode for a single home, in a pool worker, as the owner of the
+    home.
+
+    Args:
+        task (tuple): (mode, home, dropbox_folder, options), options being
+                      the keyword arguments given to Dbas
+
+    Returns:
+        (dict): Summary of the run, with the home, the mode, the error if any
+                and the number of files per action, or per status in
+                STATUS_MODE
+    """
+    mode, home, dropbox_folder, options = task
+    summary = {'home': home, 'mode': mode, 'error': None, 'counts': {},
+               'failed_apps': []}
+    counts = summary['counts']
+
+    try:
+        # The worker only runs this home, see run_homes()
+        drop_privileges(home)
+        dbas = Dbas(home=home, dropbox_folder=dropbox_folder,
+                    confirm_callback=decline, **options)
+        try:
+            if mode == STATUS_MODE:
+                for statuses in dbas.status().itervalues():
+                    for file_status in statuses.itervalues():
+                        counts[file_status] = counts.get(file_status, 0) + 1
+            else:
+                if mode == BACKUP_MODE:
+                    results = dbas.backup()
+                else:
+                    results = dbas.restore()
+                for result in results:
+                    if result.error:
+                        summary['failed_apps'].append(result.name)
+                    for action, count in result.counts().iteritems():
+                        counts[action] = counts.get(action, 0) + count
+        finally:
+            dbas.close()
+    except (DbasError, EnvironmentError) as e:
+        summary['error'] = str(e)
+    except Exception as e:
+        # Whatever went wrong, the other homes go on
+        summary['error'] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        # Pool workers exit without running the atexit handlers
+        flush_logging()
+
+    return summary
+
+
+def run_homes(mode, homes, jobs, options):
+    """
+    Run a mode for many homes, in a pool of processes.
+    Each home gets its own process so a home can't leak into another one.
+
+    Args:
+        mode (str): BACKUP_MODE, RESTORE_MODE or STATUS_MODE
+        homes (list): (home, dropbox_folder) tuples
+        jobs (int): Number of processes
+        options (dict): Keyword arguments given to Dbas
+
+    Returns:
+        (list): Summary of each home, see run_home()
+    """
+    pool = multiprocessing.Pool(processes=max(1, min(jobs, len(homes))),
+                                maxtasksperchild=1)
+    try:
+        summaries = pool.map(run_home,
+                             [(mode, home, dropbox_folder, options)
+                              for home, dropbox_folder in homes],
+                             chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return summaries
+
+
+def node_digest(node):
+    """
+    Hash the contents and names of an object store node, whatever the
+    modes and modification times
+
+    Args:
+        node (dict): Node of a file or folder, see ObjectStore
+
+    Returns:
+        (str): Digest of the node
+    """
+    def strip(node):
+        if 'entries' in node:
+            return dict((name, strip(entry))
+                        for name, entry in node['entries'].iteritems())
+        return node['digest']
+
+    return hashlib.sha1(json.dumps(strip(node), sort_keys=True)).hexdigest()
+
+
+def get_app_status(statuses):
+    """
+    Args:
+        statuses (dict): Status of each file of an application, by filename
+
+    Returns:
+        (str): The most urgent status of the application, None if it has no
+               file
+    """
+    if not statuses:
+        return None
+    return min(statuses.itervalues(), key=STATUS_PRIORITY.index)
+
+
+def list_files(path):
+    """
+    Args:
+        path (str): Path to a file or a folder
+
+    Returns:
+        (dict): Stat of each file, links followed, by path relative to
+                path: '' for path itself if it's a file
+    """
+    path_stat = get_stat(path)
+    if path_stat is None:
+        return {}
+    if not stat.S_ISDIR(path_stat.st_mode):
+        return {'': path_stat}
+
+    files = {}
+    for root, dirs, filenames in os.walk(path):
+        for name in filenames:
+            if name.endswith('.dbas') and name.startswith('.'):
+                # Being written
+                continue
+            file_path = os.path.join(root, name)
+            file_stat = get_stat(file_path)
+            if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+                files[os.path.relpath(file_path, path)] = file_stat
+
+    return files
+
+
+def stat_signature(path_stat):
+    """
+    Args:
+        path_stat (posix.stat_result): Stat of a file
+
+    Returns:
+        (list): Its size and modification time, they change with its content
+    """
+    return [path_stat.st_size, int(path_stat.st_mtime)]
+
+
+def get_tree_summary(path):
+    """
+    Args:
+        path (str): Path to a file or a folder
+
+    Returns:
+        (list): Number of files and number of bytes in it, recursively
+    """
+    path_stat = get_stat(path)
+    if path_stat is None:
+        return [0, 0]
+    if not stat.S_ISDIR(path_stat.st_mode):
+        return [1, path_stat.st_size]
+
+    files = 0
+    size = 0
+    for root, dirs, filenames in os.walk(path):
+        for name in filenames:
+            file_stat = get_stat(os.path.join(root, name))
+            if file_stat is not None:
+                files += 1
+                size += file_stat.st_size
+
+    return [files, size]
+
+
+def format_size(size):
+    """
+    Args:
+        size (int): Number of bytes
+
+    Returns:
+        (str): The size in a readable unit, e.g. 12.5 MB
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TB'
+    if unit == 'B':
+        return "{} B".format(int(size))
+    return "{:.1f} {}".format(size, unit)
+
+
+def format_progress(state):
+    """
+    Args:
+        state (dict): Progress of a run, see Progress.get_state()
+
+    Returns:
+        (str): A line reporting it
+    """
+    parts = []
+    if state['app'] is not None:
+        parts.append("{}: {}/{} files, {}/{}".format(
+            state['app'], state['app_files_done'], state['app_files_total'],
+            format_size(state['app_bytes_done']),
+            format_size(state['app_bytes_total'])))
+
+    percent = (100 * state['bytes_done'] // state['bytes_total']
+               if state['bytes_total'] else 100)
+    eta = state['eta_seconds']
+    parts.append("total {}/{} files, {}/{} ({}%), {}/s, ETA {}".format(
+        state['files_done'], state['files_total'],
+        format_size(state['bytes_done']), format_size(state['bytes_total']),
+        percent, format_size(state['bytes_per_second']),
+        "{}:{:02d}".format(eta // 60, eta % 60) if eta is not None else '-'))
+    return ' | '.join(parts)
+
+
+def read_manifest(path):
+    """
+    Args:
+        path (str): Path to the manifest of a Dbas folder
+
+    Returns:
+        (dict): Number of files and bytes of each entry, by filename, empty
+                if there is no manifest
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f).get('entries', {})
+    except (IOError, ValueError, AttributeError):
+        return {}
+
+
+def read_host_summary(path):
+    """
+    Read the summary a host published, see Dbas.publish_host_summary()
+
+    Args:
+        path (str): Path to the summary
+
+    Returns:
+        (dict): The summary, None if it can't be read
+    """
+    try:
+        with open(path, 'r') as f:
+            summary = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    return summary if isinstance(summary, dict) else None
+
+
+def get_dropbox_folder_location(home):
     """
     Try to locate the Dropbox folder
 
+    Args:
+        home (str): Home folder of the Dropbox user
+
     Returns:
         (str) Full path to the current Dropbox folder
     """
-    host_db_path = os.environ['HOME'] + '/.dropbox/host.db'
+    host_db_path = home + '/.dropbox/host.db'
     with open(host_db_path, 'r') as f:
         data = f.read().split()
     dropbox_home = base64.b64decode(data[1])
@@ -939,10 +5460,13 @@ def get_dropbox_folder_location():
     return dropbox_home
 
 
-def get_ignored_apps():
+def get_ignored_apps(dbas):
     """
     Get the list of applications ignored in the config file
 
+    Args:
+        dbas(Dbas) the instance that is running
+
     Returns:
         (set) List of application names to ignore, lowercase
     """
@@ -953,13 +5477,33 @@ def get_ignored_apps():
     ignored_apps = []
 
     # Is the config file there ?
-    if config.read(os.environ['HOME'] + '/.dbas.cfg'):
+    if config.read(dbas.config_path):
         # Is the "Ignored Applications" in the cfg file ?
         if config.has_section('Ignored Applications'):
             ignored_apps = config.options('Ignored Applications')
 
     return set(ignored_apps)
 
+def get_object_store_apps(dbas):
+    """
+    Get the list of applications to keep in the object store, from the
+    config file
+
+    Args:
+        dbas(Dbas) the instance that is running
+
+    Returns:
+        (set) List of application names, lowercase
+    """
+    config = configparser.SafeConfigParser(allow_no_value=True)
+
+    if (config.read(dbas.config_path)
+            and config.has_section('Object Store Applications')):
+        return set(config.options('Object Store Applications'))
+
+    return set()
+
+
 def get_config_path_and_append_to_backup(section, optionName, dbas):
     """
     Looks in the config for the specified option in the specified section.  If it is there,
@@ -978,23 +5522,54 @@ def get_config_path_and_append_to_backup(section, optionName, dbas):
     config = configparser.SafeConfigParser(allow_no_value=True)
 
     # Is the config file there (be sure to check the backup dir since it may not have been copied yet) ?
-    if config.read(os.environ['HOME'] + '/.dbas.cfg') or config.read(dbas.dbas_folder + '/.dbas.cfg'):
+    if config.read(dbas.config_path) or config.read(dbas.dbas_folder + '/.dbas.cfg'):
         # Is the section/option pair in the cfg file ?
         if config.has_option(section,optionName):
-            path = os.path.expanduser( config.get(section,optionName))
-            relPath = os.path.relpath(path, os.environ['HOME'])
+            path = config.get(section,optionName)
+            # Expand ~ to the home we are working on, not the one of $HOME
+            if path.startswith('~'):
+                path = dbas.home + path[1:]
+            relPath = os.path.relpath(path, dbas.home)
             # Is the specified path valid (either on the real system or in the backup) ?
             if os.path.exists(path): 
-                SUPPORTED_APPS['Dbas'].append(relPath)
+                dbas.apps['Dbas'].append(relPath)
                 return path;
             elif os.path.exists(dbas.dbas_folder + '/' + relPath):
-                SUPPORTED_APPS['Dbas'].append(relPath)
+                dbas.apps['Dbas'].append(relPath)
                 return dbas.dbas_folder + '/' + relPath
 
     return "";
 
 
 
+def get_config_value(dbas, section, option, default):
+    """
+    Read an option from the config file.
+
+    Args:
+        dbas(Dbas): the instance that is running
+        section(str): The section in the config file
+        option(str): The option name to look for
+        default: Returned if the option is not set, its type (bool, int,
+                 float or str) is the one of the returned value
+
+    Returns:
+        The value of the option, or default
+    """
+    config = configparser.SafeConfigParser(allow_no_value=True)
+
+    if config.read(dbas.config_path) and config.has_option(section, option):
+        if isinstance(default, bool):
+            return config.getboolean(section, option)
+        elif isinstance(default, int):
+            return config.getint(section, option)
+        elif isinstance(default, float):
+            return config.getfloat(section, option)
+        return config.get(section, option)
+
+    return default
+
+
 def get_custom_apps(dbas):
     """
     Get the list of custom applications referenced in the config file and
@@ -1014,10 +5589,13 @@ def get_custom_apps(dbas):
 
     return {}
 
-def get_allowed_apps():
+def get_allowed_apps(dbas):
     """
     Get the list of applications allowed in the config file
 
+    Args:
+        dbas(Dbas) the instance that is running
+
     Returns:
         (set) list of applciation names to backup
     """
@@ -1026,32 +5604,35 @@ def get_allowed_apps():
     config = configparser.SafeConfigParser(allow_no_value=True)
 
     # We allow all by default
-    allowed_apps = set(SUPPORTED_APPS)
+    allowed_apps = set(dbas.apps)
 
     # Is the config file there ?
-    if config.read(os.environ['HOME'] + '/.dbas.cfg'):
+    if config.read(dbas.config_path):
         # Is the "Allowed Applications" in the cfg file ?
         if config.has_section('Allowed Applications'):
             # Reset allowed apps to include only the user-defined
             allowed_apps = set()
-            for app_name in SUPPORTED_APPS:
+            for app_name in dbas.apps:
                 if app_name.lower() in config.options('Allowed Applications'):
                     allowed_apps.add(app_name)
 
     return allowed_apps
 
 
-def get_apps_to_backup():
+def get_apps_to_backup(dbas):
     """
     Get the list of application that should be backup by Dbas.
     It's the list of allowed apps minus the list of ignored apps.
 
+    Args:
+        dbas(Dbas) the instance that is running
+
     Returns:
         (set) List of application names to backup
     """
     apps_to_backup = set()
-    apps_to_ignore = get_ignored_apps()
-    apps_to_allow = get_allowed_apps()
+    apps_to_ignore = get_ignored_apps(dbas)
+    apps_to_allow = get_allowed_apps(dbas)
 
     for app_name in apps_to_allow:
         if app_name.lower() not in apps_to_ignore:
@@ -1060,6 +5641,42 @@ def get_apps_to_backup():
     return apps_to_backup
 
 
+def get_running_process_names():
+    """
+    Read the names of all the running processes at once: from /proc when
+    there is one, with a single ps otherwise.
+
+    Returns:
+        (set): Process names, and the name of their executable
+    """
+    names = set()
+
+    if os.path.isdir('/proc'):
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join('/proc', pid, 'comm'), 'r') as f:
+                    names.add(f.read().rstrip('\n'))
+                with open(os.path.join('/proc', pid, 'cmdline'), 'r') as f:
+                    executable = f.read().split('\0', 1)[0]
+            except IOError:
+                # Gone already
+                continue
+            if executable:
+                names.add(os.path.basename(executable))
+
+    elif os.path.isfile('/bin/ps'):
+        output = subprocess.Popen(['/bin/ps', '-axo', 'comm='],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        for line in output.splitlines():
+            if line.strip():
+                names.add(line.strip())
+                names.add(os.path.basename(line.strip()))
+
+    return names
+
+
 def is_process_running(process_name):
     """
     Check if a process with the given name is running
@@ -1070,56 +5687,304 @@ def is_process_running(process_name):
     Returns:
         (bool): True if the process is running
     """
-    is_running = False
+    return ProcessTable().is_running(process_name)
+
+
+def get_app_files(definition):
+    """
+    Args:
+        definition (list or dict): Definition of an application, see
+                                   SUPPORTED_APPS
+
+    Returns:
+        (list): Files of the application
+    """
+    if isinstance(definition, dict):
+        return definition.get('files', [])
+    return definition
+
+
+def get_app_storage(definition):
+    """
+    Args:
+        definition (list or dict): Definition of an application, see
+                                   SUPPORTED_APPS
+
+    Returns:
+        (str): How the files of the application are kept, STORAGE_LINKS or
+               STORAGE_OBJECTS
+    """
+    if isinstance(definition, dict):
+        return definition.get('storage', STORAGE_LINKS)
+    return STORAGE_LINKS
+
+
+def get_app_mode(definition):
+    """
+    Args:
+        definition (list or dict): Definition of an application, see
+                                   SUPPORTED_APPS
+
+    Returns:
+        (str): How the files of the application are kept in the home,
+               APP_MODE_LINK or APP_MODE_COPY
+    """
+    if isinstance(definition, dict):
+        return definition.get('mode', APP_MODE_LINK)
+    return APP_MODE_LINK
+
+
+def get_app_processes(definition):
+    """
+    Args:
+        definition (list or dict): Definition of an application, see
+                                   SUPPORTED_APPS
+
+    Returns:
+        (list): Names of the processes of the application
+    """
+    if isinstance(definition, dict):
+        return definition.get('processes', [])
+    return []
+
+
+def has_acl(path):
+    """
+    Check if a file has an ACL, without following links
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        (bool): True if it has one, None if it can't be told
+    """
+    if LIBC is None:
+        return None
+
+    if isinstance(path, unicode):
+        path = path.encode(sys.getfilesystemencoding())
+
+    if (platform.system() == PLATFORM_LINUX
+            and hasattr(LIBC, 'llistxattr')):
+        size = LIBC.llistxattr(path, None, 0)
+        if size > 0:
+            names = ctypes.create_string_buffer(size)
+            size = LIBC.llistxattr(path, names, size)
+        if size < 0:
+            # No extended attributes on this filesystem, no ACL either
+            if ctypes.get_errno() in (errno.ENOTSUP, errno.EOPNOTSUPP):
+                return False
+            return None
+        return (size > 0
+                and any(name.startswith('system.posix_acl_')
+                        for name in names.raw[:size].split('\0')))
+
+    elif (platform.system() == PLATFORM_DARWIN
+          and hasattr(LIBC, 'acl_get_link_np')):
+        LIBC.acl_get_link_np.restype = ctypes.c_void_p
+        acl = LIBC.acl_get_link_np(path, ACL_TYPE_EXTENDED)
+        if acl:
+            LIBC.acl_free(ctypes.c_void_p(acl))
+            return True
+        if ctypes.get_errno() == errno.ENOENT:
+            return False
+
+    return None
+
+
+def is_immutable(path, path_stat):
+    """
+    Check if a file has the immutable attribute, without following links
+
+    Args:
+        path (str): Path to the file
+        path_stat (posix.stat_result): lstat() of the file
+
+    Returns:
+        (bool): True if it is immutable, None if it can't be told
+    """
+    if platform.system() == PLATFORM_DARWIN:
+        return bool(path_stat.st_flags & stat.UF_IMMUTABLE)
+
+    elif platform.system() == PLATFORM_LINUX:
+        # Only files and folders have inode flags
+        if not (stat.S_ISREG(path_stat.st_mode)
+                or stat.S_ISDIR(path_stat.st_mode)):
+            return False
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_NOFOLLOW)
+        except OSError:
+            return None
+        try:
+            flags = array.array('l', [0])
+            fcntl.ioctl(fd, FS_IOC_GETFLAGS, flags, True)
+            return bool(flags[0] & FS_IMMUTABLE_FL)
+        except IOError as e:
+            # No inode flags on this filesystem
+            if e.errno in (errno.ENOTTY, errno.ENOTSUP, errno.EOPNOTSUPP,
+                           errno.ENOSYS, errno.EINVAL):
+                return False
+            return None
+        finally:
+            os.close(fd)
+
+    return None
+
+
+def find_attributes(path, cache=None):
+    """
+    Walk the given file or folder once to find the files having an ACL and
+    the immutable ones.
+    Given a cache, what's known about a file is kept by inode and ctime, so
+    looking again at a file that did not change is only a lstat().
+
+    Args:
+        path (str): Path to the file or folder
+        cache (dict): (has ACL, is immutable) of the files already looked
+                      at, by (st_dev, st_ino). Not by ctime, every chmod()
+                      changes it: the attributes Dbas removes are updated
+                      in there, see forget_attribute()
+
+    Returns:
+        (tuple): (paths having an ACL, immutable paths, (path, lstat) of
+                 every file walked), None if the attributes can't be read
+                 here
+    """
+    if cache is None:
+        cache = {}
+    acl_paths = []
+    immutable_paths = []
+    entries = []
+    paths = [path]
+
+    while paths:
+        entry_path = paths.pop()
+        entry_stat = get_stat(entry_path, follow_links=False)
+        if entry_stat is None:
+            continue
+        entries.append((entry_path, entry_stat))
+
+        key = (entry_stat.st_dev, entry_stat.st_ino)
+        attributes = cache.get(key)
+        if attributes is None:
+            attributes = (has_acl(entry_path),
+                          is_immutable(entry_path, entry_stat))
+            if None in attributes:
+                return None
+            cache[key] = attributes
+
+        if attributes[0]:
+            acl_paths.append(entry_path)
+        if attributes[1]:
+            immutable_paths.append(entry_path)
+
+        if stat.S_ISDIR(entry_stat.st_mode):
+            paths.extend(os.path.join(entry_path, name)
+                         for name in os.listdir(entry_path))
+
+    return acl_paths, immutable_paths, entries
+
+
+def forget_attribute(attributes, paths, index, cache):
+    """
+    Record in the cache that an attribute was removed from some files
 
-    # On systems with pgrep, check if the given process is running
-    if os.path.isfile('/usr/bin/pgrep'):
-        DEVNULL = open(os.devnull, 'wb')
-        returncode = subprocess.call(['/usr/bin/pgrep', process_name],
-                                     stdout=DEVNULL)
-        is_running = bool(returncode == 0)
+    Args:
+        attributes (tuple): What find_attributes() found
+        paths (list): Files the attribute was removed from
+        index (int): 0 for the ACL, 1 for the immutable attribute
+        cache (dict): Attributes already known, see find_attributes()
+    """
+    if cache is None or not paths:
+        return
+    removed = set(paths)
+    for path, path_stat in attributes[2]:
+        if path in removed:
+            key = (path_stat.st_dev, path_stat.st_ino)
+            known = list(cache[key])
+            known[index] = False
+            cache[key] = tuple(known)
+
+
+def call_for_paths(command, paths):
+    """
+    Run a command on many paths, with as few processes as possible
 
-    return is_running
+    Args:
+        command (list): Command and its options
+        paths (list): Paths to give to the command
+    """
+    for index in range(0, len(paths), PATHS_BY_CALL):
+        subprocess.call(command + paths[index:index + PATHS_BY_CALL])
 
 
-def remove_acl(path):
+def remove_acl(path, cache=None):
     """
     Remove the ACL of the file or folder located on the given path.
     Also remove the ACL of any file and folder below the given one,
     recursively.
+    Only the files having an ACL are touched, nothing is spawned if none has
+    one.
 
     Args:
         path (str): Path to the file or folder to remove the ACL for,
                     recursively.
+        cache (dict): Attributes already known, see find_attributes()
     """
     # Some files have ACLs, let's remove them recursively
     if platform.system() == PLATFORM_DARWIN and os.path.isfile('/bin/chmod'):
-        subprocess.call(['/bin/chmod', '-R', '-N', path])
+        command = ['/bin/chmod', '-N']
     elif ((platform.system() == PLATFORM_LINUX)
           and os.path.isfile('/bin/setfacl')):
-        subprocess.call(['/bin/setfacl', '-R', '-b', path])
+        command = ['/bin/setfacl', '-b']
+    else:
+        return
+
+    attributes = find_attributes(path, cache)
+    if attributes is None:
+        # Can't tell, do it the slow way
+        subprocess.call(command[:1] + ['-R'] + command[1:] + [path])
+    else:
+        call_for_paths(command, attributes[0])
+        forget_attribute(attributes, attributes[0], 0, cache)
 
 
-def remove_immutable_attribute(path):
+def remove_immutable_attribute(path, cache=None):
     """
     Remove the immutable attribute of the file or folder located on the given
     path. Also remove the immutable attribute of any file and folder below the
     given one, recursively.
+    Only the immutable files are touched, nothing is spawned if none is.
 
     Args:
         path (str): Path to the file or folder to remove the immutable
                     attribute for, recursively.
+        cache (dict): Attributes already known, see find_attributes()
+
+    Returns:
+        (tuple): What find_attributes() found, None if it was not used
     """
-    # Some files have ACLs, let's remove them recursively
+    # Some files are immutable, let's find them
     if ((platform.system() == PLATFORM_DARWIN)
         and os.path.isfile('/usr/bin/chflags')):
-        subprocess.call(['/usr/bin/chflags', '-R', 'nouchg', path])
+        command = ['/usr/bin/chflags', 'nouchg']
     elif (platform.system() == PLATFORM_LINUX
           and os.path.isfile('/usr/bin/chattr')):
-        subprocess.call(['/usr/bin/chattr', '-R', '-i', path])
+        command = ['/usr/bin/chattr', '-i']
+    else:
+        return None
+
+    attributes = find_attributes(path, cache)
+    if attributes is None:
+        # Can't tell, do it the slow way
+        subprocess.call(command[:1] + ['-R'] + command[1:] + [path])
+    else:
+        call_for_paths(command, attributes[1])
+        forget_attribute(attributes, attributes[1], 1, cache)
+    return attributes
 
 
-def can_file_be_synced_on_current_platform(path):
+def can_file_be_synced_on_current_platform(path, home):
     """
     Check if it makes sens to sync the file at the given path on the current
     platform.
@@ -1131,6 +5996,7 @@ def can_file_be_synced_on_current_platform(path):
                with the home folder.
                'abc' becomes '~/abc'
                '/def' stays '/def'
+        home (str): Home folder the relative paths are relative to
 
     Returns:
         (bool): True if given file can be synced
@@ -1138,12 +6004,12 @@ def can_file_be_synced_on_current_platform(path):
     can_be_synced = True
 
     # If the given path is relative, prepend home
-    fullpath = os.path.join(os.environ['HOME'], path)
+    fullpath = os.path.join(home, path)
 
     # Compute the ~/Library path on OS X
     # End it with a slash because we are looking for this specific folder and
     # not any file/folder named LibrarySomething
-    library_path = os.path.join(os.environ['HOME'], 'Library/')
+    library_path = os.path.join(home, 'Library/')
 
     if platform.system() == PLATFORM_LINUX:
         if fullpath.startswith(library_path):
@@ -1154,13 +6020,13 @@ def can_file_be_synced_on_current_platform(path):
 def update_supported_apps(dbas):
     """
     Get the list of custom apps that the user has specified 
-    (if any) and append it to the SUPPORTED_APPS list, replacing 
+    (if any) and append it to the applications of the instance, replacing 
     any that are duplicated.
 
     Args:
         dbas(Dbas) the instance that is running.
     """
-    SUPPORTED_APPS.update(get_custom_apps(dbas))
+    dbas.apps.update(get_custom_apps(dbas))
 
 
 ################
@@ -1171,67 +6037,181 @@ def update_supported_apps(dbas):
 def main():
     """Main function"""
 
-    dbas = Dbas()
-
-    update_supported_apps(dbas)
-
     # Get the command line arg
     args = parse_cmdline_args()
 
-    if args.mode == BACKUP_MODE:
-        # Check the env where the command is being run
-        dbas.check_for_usable_backup_env()
-
-        # Backup each application
-        for app_name in get_apps_to_backup():
-            app = ApplicationProfile(dbas, SUPPORTED_APPS[app_name])
-            app.backup()
-
-    elif args.mode == RESTORE_MODE:
-        # Check the env where the command is being run
-        dbas.check_for_usable_restore_env()
-
-        # Restore 'Dbas' first to get the configs in place
-        app = ApplicationProfile(dbas, SUPPORTED_APPS['Dbas'])
-        app.restore()
-
-        for app_name in SUPPORTED_APPS:
-            app = ApplicationProfile(dbas, SUPPORTED_APPS[app_name])
-            app.restore()
-
-    elif args.mode == UNINSTALL_MODE:
-        # Check the env where the command is being run
-        dbas.check_for_usable_restore_env()
-
-        if confirm("You are going to uninstall Dbas.\n"
-                   "Every configuration file, setting and dotfile managed"
-                   " by Dbas will be unlinked and moved back to their"
-                   " original place, in your home folder.\n"
-                   "Are you sure ?"):
-            for app_name in SUPPORTED_APPS:
-                app = ApplicationProfile(dbas, SUPPORTED_APPS[app_name])
-                app.uninstall()
-
-            # Delete the Dbas folder in Dropbox
-            # Don't delete this as there might be other Macs that aren't
-            # uninstalled yet
-            # delete(dbas.dbas_folder)
-
-            print ("\n"
-                   "All your files have been put back into place. You can now"
-                   " safely uninstall Dbas.\n"
-                   "If you installed it by hand, you should only have to"
-                   " launch this command:\n"
-                   "\n"
-                   "\tsudo rm {}\n"
-                   "\n"
-                   "Thanks for using Dbas !"
-                   .format(os.path.abspath(__file__)))
+    if args.quiet:
+        log_level = SUMMARY_LEVEL
+    elif args.verbose:
+        log_level = logging.DEBUG
     else:
-        raise ValueError("Unsupported mode: {}".format(args.mode))
+        log_level = logging.INFO
+    handler = setup_logging(log_level, args.log_format == 'json',
+                            bool(args.homes))
+
+    # Options given to Dbas
+    options = {'checksum': args.checksum,
+               'max_kbytes_per_second': args.bwlimit,
+               'max_operations_per_second': args.max_ops,
+               'idle_io': args.idle_io,
+               'wait_for_lock': not args.no_wait,
+               'settle': not args.no_settle}
+
+    start = time.time()
+    metrics = Metrics()
+    metrics.add('dbas_failures', 0, mode=args.mode)
+
+    if args.homes:
+        if args.mode not in (BACKUP_MODE, RESTORE_MODE, STATUS_MODE):
+            error("The {} mode can't be run for many homes".format(args.mode))
+        if args.progress:
+            error("The progress can't be reported for many homes")
+        if args.storage_dir:
+            error("Many homes can't be backed up in the same folder")
+
+        try:
+            homes = read_homes_file(args.homes)
+        except IOError as e:
+            error(e)
+
+        summaries = run_homes(args.mode, homes, args.jobs, options)
+        flush_logging()
+
+        # Aggregated report
+        failures = 0
+        for summary in summaries:
+            if summary['error']:
+                failures += 1
+                report = "Error: {}".format(summary['error'])
+            else:
+                report = ', '.join("{}: {}".format(action, count)
+                                   for action, count
+                                   in sorted(summary['counts'].iteritems()))
+                if summary['failed_apps']:
+                    failures += 1
+                    report = "Failed: {}; {}".format(
+                        ', '.join(summary['failed_apps']), report)
+            print "{:<30} {}".format(summary['home'],
+                                     report or 'nothing to do')
+        print "\n{} homes, {} failed".format(len(summaries), failures)
+
+        metrics.add('dbas_failures', failures, mode=args.mode)
+        write_metrics(metrics, args.metrics_file, args.mode, start)
+
+        sys.exit(1 if failures else 0)
+
+    metrics_file = args.metrics_file
+    # Results of the applications, for the modes running them
+    results = []
+    progress = None
+    if args.progress:
+        progress = Progress(json_events=args.progress == PROGRESS_JSON)
+        # Don't log at the end of the progress line
+        handler.before_write = progress.clear
+    try:
+        backend = None
+        if args.storage_dir:
+            backend = DirectoryBackend(os.path.abspath(args.storage_dir))
+        dbas = Dbas(progress=progress, backend=backend, **options)
+        metrics = dbas.metrics
+        metrics.add('dbas_failures', 0, mode=args.mode)
+        metrics_file = metrics_file or get_config_value(dbas, 'Metrics',
+                                                        'textfile', '')
+
+        if args.mode == BACKUP_MODE:
+            # Backup each application
+            results = dbas.backup()
+
+        elif args.mode == RESTORE_MODE:
+            results = dbas.restore()
+
+        elif args.mode == UNINSTALL_MODE:
+            # Check the env where the command is being run
+            dbas.check_for_usable_restore_env()
+
+            if confirm("You are going to uninstall Dbas.\n"
+                       "Every configuration file, setting and dotfile managed"
+                       " by Dbas will be unlinked and moved back to their"
+                       " original place, in your home folder.\n"
+                       "Are you sure ?"):
+                results = dbas.uninstall()
+
+                # Delete the Dbas folder in Dropbox
+                # Don't delete this as there might be other Macs that aren't
+                # uninstalled yet
+                # delete(dbas.dbas_folder)
+
+                flush_logging()
+                if any(result.error for result in results):
+                    print "\nSome applications could not be put back."
+                else:
+                    print ("\n"
+                           "All your files have been put back into place."
+                           " You can now safely uninstall Dbas.\n"
+                           "If you installed it by hand, you should only"
+                           " have to launch this command:\n"
+                           "\n"
+                           "\tsudo rm {}\n"
+                           "\n"
+                           "Thanks for using Dbas !"
+                           .format(os.path.abspath(__file__)))
+
+        elif args.mode == STATUS_MODE:
+            statuses = dbas.status()
+            for app_name in sorted(statuses, key=lambda name: name.lower()):
+                # Report the most urgent status of the application
+                app_status = get_app_status(statuses[app_name])
+                if app_status is not None:
+                    print "{:<30} {}".format(app_name, app_status)
+
+        elif args.mode == DRIFT_MODE:
+            drift = dbas.drift()
+            for app_name in sorted(drift, key=lambda name: name.lower()):
+                print app_name
+                for host, app_status in sorted(drift[app_name].iteritems()):
+                    print "    {:<26} {}".format(host, app_status)
+            if not drift:
+                print "Every host is in the same state"
+
+        elif args.mode == ROLLBACK_MODE:
+            if not args.app:
+                raise DbasError("Which application should be rolled back ?")
+            if args.app not in dbas.apps:
+                raise DbasError("Unknown application: {}".format(args.app))
+            for file_result in dbas.rollback(args.app).files:
+                dbas.log("Rolled back {}".format(file_result.filename),
+                         app=args.app, file=file_result.filename,
+                         mode=ROLLBACK_MODE)
+
+        elif args.mode == RELINK_MODE:
+            results = dbas.relink(args.jobs)
+
+        elif args.mode == CONFLICTS_MODE:
+            dbas.conflicts(args.conflict_policy)
+
+        else:
+            raise ValueError("Unsupported mode: {}".format(args.mode))
+
+    except DbasError as e:
+        flush_logging()
+        metrics.add('dbas_failures', 1, mode=args.mode)
+        write_metrics(metrics, metrics_file, args.mode, start)
+        error(e)
+
+    flush_logging()
+    if progress is not None and progress.start is not None:
+        progress.close()
+    write_metrics(metrics, metrics_file, args.mode, start)
 
     # Delete the tmp folder
-    dbas.clean_temp_folder()
+    dbas.close()
+
+    # The other applications went on, the run still failed
+    failed = [result for result in results if result.error]
+    if failed:
+        for result in failed:
+            print "{:<30} {}".format(result.name, result.error)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
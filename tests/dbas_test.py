@@ -0,0 +1,1133 @@
+import errno
+import json
+import logging
+import os
+import platform
+import plistlib
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+import dbas
+
+
+class TestDbas(unittest.TestCase):
+
+    def setUp(self):
+        # Fake a home with a Dropbox folder in it
+        self.home = tempfile.mkdtemp()
+        self.dropbox = os.path.join(self.home, 'Dropbox')
+        os.makedirs(os.path.join(self.dropbox, dbas.DBAS_DB_PATH))
+
+        self.dbas = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox)
+
+    def tearDown(self):
+        self.dbas.clean_temp_folder()
+        shutil.rmtree(self.home)
+
+    def create_file(self, path):
+        with open(path, 'w') as f:
+            f.write('data')
+
+    def test_status(self):
+        self.create_file(os.path.join(self.home, '.linked'))
+        dbas.ApplicationProfile(self.dbas, ['.linked']).backup()
+
+        self.create_file(os.path.join(self.home, '.local'))
+        self.create_file(os.path.join(self.home, '.both'))
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.both'))
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.backup'))
+        os.symlink(os.path.join(self.home, 'nowhere'),
+                   os.path.join(self.home, '.broken'))
+
+        app = dbas.ApplicationProfile(self.dbas, ['.linked', '.local',
+                                                  '.backup', '.both',
+                                                  '.broken', '.absent'])
+        self.assertEqual(app.status(),
+                         {'.linked': dbas.STATUS_LINKED,
+                          '.local': dbas.STATUS_UNMANAGED,
+                          '.backup': dbas.STATUS_BACKUP_ONLY,
+                          '.both': dbas.STATUS_CONFLICT,
+                          '.broken': dbas.STATUS_BROKEN})
+
+    def test_backup_results(self):
+        self.create_file(os.path.join(self.home, '.new'))
+        self.create_file(os.path.join(self.home, '.kept'))
+        with open(os.path.join(self.dbas.dbas_folder, '.kept'), 'w') as f:
+            f.write('other data')
+
+        conflicts = []
+
+        def conflict_callback(mode, filename, filepath):
+            conflicts.append((mode, filename))
+            return False
+
+        self.dbas.conflict_callback = conflict_callback
+        self.dbas.apps['Test'] = ['.new', '.kept', '.absent']
+        results = self.dbas.backup(apps=['Test'])
+
+        self.assertEqual(conflicts, [(dbas.BACKUP_MODE, '.kept')])
+        self.assertEqual([(f.filename, f.action) for f in results[0].files],
+                         [('.new', dbas.ACTION_BACKED_UP),
+                          ('.kept', dbas.ACTION_KEPT)])
+        self.assertTrue(os.path.islink(os.path.join(self.home, '.new')))
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.kept')))
+
+    def test_metrics(self):
+        self.create_file(os.path.join(self.home, '.new'))
+        self.dbas.apps['Test'] = ['.new']
+        self.dbas.backup(apps=['Test'])
+
+        path = os.path.join(self.home, 'dbas.prom')
+        dbas.write_metrics(self.dbas.metrics, path, dbas.BACKUP_MODE, 0)
+        with open(path) as f:
+            lines = f.read().decode('utf-8').splitlines()
+        labels = u'{app="Test",mode="backup"}'
+        self.assertTrue(u'dbas_files_copied' + labels + u' 1' in lines)
+        self.assertTrue(u'dbas_bytes_copied' + labels + u' 4' in lines)
+        self.assertTrue(u'dbas_links_created' + labels + u' 1' in lines)
+        self.assertTrue(u'dbas_conflicts' + labels + u' 0' in lines)
+        self.assertTrue(u'# TYPE dbas_run_duration_seconds gauge' in lines)
+
+    def test_drift(self):
+        self.create_file(os.path.join(self.home, '.rc'))
+        self.dbas.apps['Test'] = ['.rc']
+        self.dbas.backup(apps=['Test'])
+
+        hosts_folder = os.path.join(self.dbas.dbas_folder, dbas.HOSTS_PATH)
+        path = os.path.join(hosts_folder, platform.node() + '.json')
+        with open(os.path.join(hosts_folder, 'other.json'), 'w') as f:
+            json.dump({'host': 'other',
+                       'apps': {'Test': dbas.STATUS_UNMANAGED}}, f)
+
+        self.assertEqual(self.dbas.drift(),
+                         {'Test': {platform.node(): dbas.STATUS_LINKED,
+                                   'other': dbas.STATUS_UNMANAGED}})
+
+        # Nothing changed, nothing written
+        os.utime(path, (0, 0))
+        self.dbas.backup(apps=['Test'])
+        self.assertEqual(os.stat(path).st_mtime, 0)
+
+    def test_object_store(self):
+        for folder in ('.app2', '.app3'):
+            os.makedirs(os.path.join(self.home, folder, 'sub'))
+            self.create_file(os.path.join(self.home, folder, 'sub', 'file'))
+        self.dbas.apps['App 2'] = {'files': ['.app2'], 'storage': 'objects'}
+        self.dbas.apps['App 3'] = {'files': ['.app3'], 'storage': 'objects'}
+
+        results = self.dbas.backup(apps=['App 2', 'App 3'])
+        self.assertEqual([r.files[0].action for r in results],
+                         [dbas.ACTION_BACKED_UP, dbas.ACTION_BACKED_UP])
+        # Stored once for both applications, the home is left as is
+        objects = list(os.walk(self.dbas.objects.folder))[1:]
+        self.assertEqual([len(filenames) for _, _, filenames in objects], [1])
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.app2')))
+
+        # Changed since the last backup, replaced without asking
+        self.dbas.confirm = None
+        with open(os.path.join(self.home, '.app2', 'sub', 'file'), 'w') as f:
+            f.write('new data')
+        result = self.dbas.backup(apps=['App 2'])[0]
+        self.assertEqual(result.files[0].action, dbas.ACTION_REPLACED)
+
+        # The previous content is not referenced anymore
+        self.assertEqual(self.dbas.objects.gc(max_age_days=-1), 0)
+        shutil.rmtree(os.path.join(self.home, '.app3'))
+        del self.dbas.apps['App 3']
+        os.remove(os.path.join(self.dbas.objects.index_folder,
+                               'App 3.json'))
+        self.assertEqual(self.dbas.objects.gc(max_age_days=-1), 1)
+
+        shutil.rmtree(os.path.join(self.home, '.app2'))
+        self.dbas.restore(apps=['App 2'])
+        with open(os.path.join(self.home, '.app2', 'sub', 'file')) as f:
+            self.assertEqual(f.read(), 'new data')
+        self.assertEqual(self.dbas.status(apps=['App 2']),
+                         {'App 2': {'.app2': dbas.STATUS_LINKED}})
+
+    def test_object_store_keeps_new_objects(self):
+        filepath = os.path.join(self.home, '.old')
+        self.create_file(filepath)
+        month_ago = time.time() - 30 * 24 * 60 * 60
+        os.utime(filepath, (month_ago, month_ago))
+
+        # Stored, not indexed yet: within its grace period whatever the
+        # mtime of the file it was copied from
+        node = self.dbas.objects.scan(filepath, store=True)
+        self.assertEqual(self.dbas.objects.gc(), 0)
+        object_path = self.dbas.objects.object_path(node['digest'])
+        self.assertTrue(os.path.exists(object_path))
+
+        # Reused by a new file, the grace period starts again
+        os.utime(object_path, (month_ago, month_ago))
+        self.create_file(os.path.join(self.home, '.new'))
+        self.dbas.objects.scan(os.path.join(self.home, '.new'), store=True)
+        self.assertEqual(self.dbas.objects.gc(), 0)
+        self.assertTrue(os.path.exists(object_path))
+
+    def test_runs_of_two_engines_keep_the_state(self):
+        self.create_file(os.path.join(self.home, '.x'))
+        self.create_file(os.path.join(self.home, '.y'))
+        other = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox)
+        self.dbas.apps['X'] = ['.x']
+        other.apps['Y'] = ['.y']
+
+        # Both loaded the state before either run took the lock
+        self.dbas.backup(apps=['X'])
+        other.backup(apps=['Y'])
+        other.close()
+
+        state = dbas.StateCache(self.dbas.state.path)
+        self.assertEqual(sorted(state.links), ['.x', '.y'])
+
+    def test_concurrent_runs_coalesce(self):
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.rc'))
+        self.dbas.apps['Test'] = ['.rc']
+        lock = dbas.RunLock(os.path.join(self.home, dbas.DBAS_STATE_PATH))
+        self.assertTrue(lock.acquire(dbas.RESTORE_MODE))
+
+        self.dbas.wait_for_lock = False
+        self.assertRaises(dbas.DbasError, self.dbas.restore, apps=['Test'])
+
+        # The other run ends while this one waits
+        result = dbas.AppResult('Test')
+        result.add('.rc', dbas.ACTION_RESTORED)
+
+        def end_other_run():
+            time.sleep(0.1)
+            lock.set_last_run(dbas.RESTORE_MODE, ['Test'], [result])
+            lock.release()
+
+        other_run = threading.Thread(target=end_other_run)
+        other_run.start()
+        self.dbas.wait_for_lock = True
+        results = self.dbas.restore(apps=['Test'])
+        other_run.join()
+
+        self.assertEqual([(f.filename, f.action) for f in results[0].files],
+                         [('.rc', dbas.ACTION_RESTORED)])
+        # Nothing was done again
+        self.assertFalse(os.path.exists(os.path.join(self.home, '.rc')))
+
+    def test_relink_moved_dropbox(self):
+        self.create_file(os.path.join(self.home, '.rc'))
+        self.dbas.apps['Test'] = ['.rc']
+        self.dbas.backup(apps=['Test'])
+        # A link made by hand, unknown to the state cache
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.other'))
+        os.symlink(os.path.join(self.dbas.dbas_folder, '.other'),
+                   os.path.join(self.home, '.other'))
+
+        moved = os.path.join(self.home, 'Moved Dropbox')
+        os.rename(self.dropbox, moved)
+        moved_dbas = dbas.Dbas(home=self.home, dropbox_folder=moved)
+        moved_dbas.apps['Test'] = ['.rc']
+        moved_dbas.apps['Other'] = ['.other']
+        results = moved_dbas.relink(jobs=2)
+        moved_dbas.clean_temp_folder()
+
+        self.assertEqual([(r.name, [f.filename for f in r.files])
+                          for r in results],
+                         [('Other', ['.other']), ('Test', ['.rc'])])
+        for filename in ('.rc', '.other'):
+            self.assertEqual(os.readlink(os.path.join(self.home, filename)),
+                             os.path.join(moved, dbas.DBAS_DB_PATH,
+                                          filename))
+
+    def test_relink_failure_keeps_other_links(self):
+        for filename in ('.rc', '.other'):
+            self.create_file(os.path.join(self.home, filename))
+        self.dbas.apps['Test'] = ['.rc']
+        self.dbas.apps['Other'] = ['.other']
+        self.dbas.backup(apps=['Test', 'Other'])
+
+        moved = os.path.join(self.home, 'Moved Dropbox')
+        os.rename(self.dropbox, moved)
+        moved_dbas = dbas.Dbas(home=self.home, dropbox_folder=moved,
+                               wait_for_lock=False)
+        moved_dbas.apps['Test'] = ['.rc']
+        moved_dbas.apps['Other'] = ['.other']
+
+        # Restores create the same links, they don't run at once
+        lock = dbas.RunLock(os.path.join(self.home, dbas.DBAS_STATE_PATH))
+        lock.acquire(dbas.RELINK_MODE)
+        try:
+            self.assertRaises(dbas.DbasError, moved_dbas.relink)
+        finally:
+            lock.release()
+
+        original = dbas.relink
+
+        def relink(target, link):
+            if link.endswith('.other'):
+                raise OSError(errno.EACCES, 'Permission denied')
+            original(target, link)
+
+        dbas.relink = relink
+        try:
+            results = moved_dbas.relink()
+        finally:
+            dbas.relink = original
+        moved_dbas.clean_temp_folder()
+
+        self.assertEqual([(r.name, len(r.files), r.error) for r in results],
+                         [('Other', 0, 'OSError: [Errno 13] Permission'
+                                       ' denied'),
+                          ('Test', 1, None)])
+        # The links rewritten are recorded
+        state = dbas.StateCache(moved_dbas.state.path)
+        self.assertEqual(state.links['.rc']['target'],
+                         os.path.join(moved, dbas.DBAS_DB_PATH, '.rc'))
+
+    def test_wait_for_dropbox(self):
+        os.makedirs(os.path.join(self.home, '.app', 'sub'))
+        self.create_file(os.path.join(self.home, '.app', 'sub', 'file'))
+        self.dbas.apps['Test'] = ['.app']
+        self.dbas.backup(apps=['Test'])
+        self.assertTrue(self.dbas.is_manifest_complete())
+
+        # Not there yet, nor quiet long enough
+        os.remove(os.path.join(self.dbas.dbas_folder, '.app', 'sub', 'file'))
+        self.assertFalse(self.dbas.is_manifest_complete())
+        self.assertFalse(self.dbas.wait_for_dropbox(1, 0.05))
+        # Only the files about to be restored are waited for, not the ones
+        # already linked
+        self.assertEqual(self.dbas.get_files_to_restore(['Test']), [])
+        self.assertTrue(self.dbas.is_manifest_complete([]))
+        os.remove(os.path.join(self.home, '.app'))
+        self.assertEqual(self.dbas.get_files_to_restore(['Test']), ['.app'])
+        self.assertFalse(self.dbas.is_manifest_complete(['.app']))
+
+        # Synced while waiting
+        def sync():
+            time.sleep(0.1)
+            self.create_file(os.path.join(self.dbas.dbas_folder, '.app',
+                                          'sub', 'file'))
+
+        syncing = threading.Thread(target=sync)
+        syncing.start()
+        self.dbas.wait_for_dropbox(5, 10)
+        syncing.join()
+        self.assertTrue(self.dbas.is_manifest_complete())
+
+    def test_wait_for_dropbox_by_polling(self):
+        self.create_file(os.path.join(self.home, '.rc'))
+        self.dbas.apps['Test'] = ['.rc']
+        self.dbas.backup(apps=['Test'])
+        os.remove(os.path.join(self.dbas.dbas_folder, '.rc'))
+
+        # Without inotify, quiet for quiet_seconds whatever the poll delay
+        libc, dbas.LIBC = dbas.LIBC, None
+        poll, dbas.SETTLE_POLL_SECONDS = dbas.SETTLE_POLL_SECONDS, 0.1
+        try:
+            start = time.time()
+            self.assertTrue(self.dbas.wait_for_dropbox(0.5, 10))
+        finally:
+            dbas.LIBC = libc
+            dbas.SETTLE_POLL_SECONDS = poll
+        self.assertGreaterEqual(time.time() - start, 0.5)
+
+    def test_settle_config(self):
+        with open(os.path.join(self.home, '.dbas.cfg'), 'w') as f:
+            f.write('[Settle]\nquiet_seconds = 0.5\n')
+        settled = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox)
+        self.assertEqual(
+            dbas.get_config_value(settled, 'Settle', 'quiet_seconds',
+                                  dbas.SETTLE_QUIET_SECONDS), 0.5)
+        self.assertEqual(
+            dbas.get_config_value(settled, 'Settle', 'timeout_seconds',
+                                  dbas.SETTLE_TIMEOUT_SECONDS), 600)
+        settled.close()
+
+    @unittest.skipUnless(platform.system() == dbas.PLATFORM_LINUX,
+                         "Watches with inotify")
+    def test_watch_folder_moved_in(self):
+        folder = os.path.join(self.home, 'watched')
+        os.makedirs(folder)
+        moved = os.path.join(self.home, 'moved')
+        os.makedirs(os.path.join(moved, 'sub'))
+
+        watcher = dbas.FolderWatcher(folder)
+        try:
+            os.rename(moved, os.path.join(folder, 'moved'))
+            self.assertTrue(watcher.wait(1))
+            # The folder moved in and what it holds are watched too
+            self.assertIn(os.path.join(folder, 'moved', 'sub'),
+                          watcher.watches.values())
+            self.create_file(os.path.join(folder, 'moved', 'sub', 'file'))
+            self.assertTrue(watcher.wait(1))
+        finally:
+            watcher.close()
+
+    def test_copy_mode(self):
+        os.makedirs(os.path.join(self.home, '.app'))
+        self.create_file(os.path.join(self.home, '.app', 'prefs'))
+        self.create_file(os.path.join(self.home, '.app', 'gone'))
+        self.dbas.apps['Test'] = {'files': ['.app'], 'mode': 'copy'}
+
+        result = self.dbas.backup(apps=['Test'])[0]
+        self.assertEqual(sorted((f.filename, f.action) for f in result.files),
+                         [('.app/gone', dbas.ACTION_COPIED_TO_BACKUP),
+                          ('.app/prefs', dbas.ACTION_COPIED_TO_BACKUP)])
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.app')))
+        self.assertEqual(self.dbas.status(apps=['Test']),
+                         {'Test': {'.app': dbas.STATUS_LINKED}})
+
+        # Replaced by the application on this side, changed on the other
+        prefs = os.path.join(self.home, '.app', 'prefs')
+        os.remove(prefs)
+        with open(prefs, 'w') as f:
+            f.write('new prefs')
+        os.utime(prefs, (time.time() + 10, time.time() + 10))
+        os.remove(os.path.join(self.dbas.dbas_folder, '.app', 'gone'))
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.app', 'new'))
+
+        # Only what changed is copied, both ways
+        result = self.dbas.restore(apps=['Test'])[0]
+        self.assertEqual(sorted((f.filename, f.action) for f in result.files),
+                         [('.app/gone', dbas.ACTION_DELETED),
+                          ('.app/new', dbas.ACTION_COPIED_TO_HOME),
+                          ('.app/prefs', dbas.ACTION_COPIED_TO_BACKUP)])
+        with open(os.path.join(self.dbas.dbas_folder, '.app', 'prefs')) as f:
+            self.assertEqual(f.read(), 'new prefs')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.home, '.app'))),
+                         ['new', 'prefs'])
+        self.assertEqual(self.dbas.backup(apps=['Test'])[0].files, [])
+
+    def test_copy_mode_keeps_changes_deleted_elsewhere(self):
+        prefs = os.path.join(self.home, '.prefs')
+        self.create_file(prefs)
+        self.dbas.apps['Test'] = {'files': ['.prefs'], 'mode': 'copy'}
+        self.dbas.backup(apps=['Test'])
+
+        # Edited on this host, deleted on another one
+        with open(prefs, 'w') as f:
+            f.write('edited')
+        os.utime(prefs, (time.time() + 10, time.time() + 10))
+        os.remove(os.path.join(self.dbas.dbas_folder, '.prefs'))
+
+        result = self.dbas.backup(apps=['Test'])[0]
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.prefs', dbas.ACTION_COPIED_TO_BACKUP)])
+        self.assertEqual(self.dbas.conflict_count, 1)
+        with open(os.path.join(self.dbas.dbas_folder, '.prefs')) as f:
+            self.assertEqual(f.read(), 'edited')
+
+    def test_missing_dropbox(self):
+        self.assertRaises(dbas.DbasError, dbas.Dbas, home=self.home)
+
+    def test_quiet_json_logging(self):
+        stream = StringIO()
+        handler = dbas.setup_logging(dbas.SUMMARY_LEVEL, json_lines=True,
+                                     stream=stream)
+        try:
+            self.create_file(os.path.join(self.home, '.new'))
+            self.dbas.apps['Test'] = ['.new']
+            self.dbas.backup(apps=['Test'])
+            # Nothing is written until flushed
+            self.assertEqual(stream.getvalue(), '')
+            dbas.flush_logging()
+        finally:
+            dbas.LOGGER.removeHandler(handler)
+            dbas.LOGGER.setLevel(logging.NOTSET)
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['level'], 'SUMMARY')
+        self.assertEqual(lines[0]['counts'], {dbas.ACTION_BACKED_UP: 1})
+
+    def test_log_writes_fit_in_pipe_buf(self):
+        writes = []
+        stream = StringIO()
+        stream.write = writes.append
+        handler = dbas.BufferedStreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        for index in range(100):
+            handler.emit(logging.LogRecord('dbas', logging.INFO, __file__,
+                                           0, 'line {} {}'.format(index,
+                                                                  'x' * 100),
+                                           None, None))
+        handler.flush()
+
+        # Whole lines, written by pieces small enough to be atomic
+        self.assertGreater(len(writes), 1)
+        self.assertTrue(all(len(data) <= dbas.LOG_ATOMIC_WRITE_SIZE
+                            and data.endswith('\n') for data in writes))
+        self.assertEqual(''.join(writes).splitlines(),
+                         ['line {} {}'.format(index, 'x' * 100)
+                          for index in range(100)])
+
+    def test_sync_only_copies_changes(self):
+        src = os.path.join(self.home, 'src')
+        dst = os.path.join(self.home, 'dst')
+        os.makedirs(os.path.join(src, 'sub'))
+        self.create_file(os.path.join(src, 'same'))
+        self.create_file(os.path.join(src, 'sub', 'changed'))
+        dbas.copy(src, dst)
+        self.create_file(os.path.join(dst, 'vanished'))
+
+        same_inode = os.stat(os.path.join(dst, 'same')).st_ino
+        with open(os.path.join(src, 'sub', 'changed'), 'w') as f:
+            f.write('new data')
+
+        # The changed file and the vanished one
+        self.assertEqual(dbas.sync(src, dst), 2)
+        self.assertEqual(sorted(os.listdir(dst)), ['same', 'sub'])
+        self.assertEqual(os.stat(os.path.join(dst, 'same')).st_ino,
+                         same_inode)
+        with open(os.path.join(dst, 'sub', 'changed')) as f:
+            self.assertEqual(f.read(), 'new data')
+        self.assertEqual(dbas.sync(src, dst, checksum=True), 0)
+
+    def test_copy_keeps_hardlinks(self):
+        src = os.path.join(self.home, 'src')
+        os.makedirs(os.path.join(src, 'sub'))
+        self.create_file(os.path.join(src, 'file'))
+        os.link(os.path.join(src, 'file'), os.path.join(src, 'sub', 'link'))
+        os.link(os.path.join(src, 'file'), os.path.join(self.home, 'other'))
+
+        dst = os.path.join(self.home, 'dst')
+        dbas.copy(src, dst, self.dbas.copier)
+        inode = os.stat(os.path.join(dst, 'file')).st_ino
+        self.assertEqual(os.stat(os.path.join(dst, 'sub', 'link')).st_ino,
+                         inode)
+
+        # Not copied again later in the run
+        dbas.copy(os.path.join(self.home, 'other'),
+                  os.path.join(self.home, 'other copy'), self.dbas.copier)
+        self.assertEqual(os.stat(os.path.join(self.home, 'other copy'))
+                         .st_ino, inode)
+
+        # Objects are never shared with the files out of the store
+        node = self.dbas.objects.scan(os.path.join(self.home, 'other'),
+                                      store=True)
+        self.assertNotEqual(os.stat(self.dbas.objects.object_path(
+            node['digest'])).st_ino, inode)
+
+        # Nor are the copies made for another tree
+        self.dbas.copier.reset()
+        dbas.copy(os.path.join(self.home, 'other'),
+                  os.path.join(self.home, 'another copy'), self.dbas.copier)
+        self.assertNotEqual(os.stat(os.path.join(self.home, 'another copy'))
+                            .st_ino, inode)
+
+    def test_defer_large_files(self):
+        with open(os.path.join(self.home, '.large'), 'w') as f:
+            f.write('x' * 10)
+        self.create_file(os.path.join(self.home, '.small'))
+        self.dbas.apps['Large'] = ['.large']
+        self.dbas.apps['Small'] = ['.small']
+        self.dbas.large_file_policy = dbas.LARGE_FILE_POLICY_DEFER
+        progress = []
+        self.dbas.copier = dbas.Copier(
+            10, 4, lambda path, copied, total: progress.append(copied))
+
+        backed_up = []
+        original_copy = dbas.copy
+
+        def copy(src, dst, copier=None):
+            backed_up.append(os.path.basename(src))
+            original_copy(src, dst, copier)
+
+        dbas.copy = copy
+        try:
+            results = self.dbas.backup(apps=['Large', 'Small'])
+        finally:
+            dbas.copy = original_copy
+
+        self.assertEqual(backed_up, ['.small', '.large'])
+        self.assertEqual(results[0].files[0].action, dbas.ACTION_BACKED_UP)
+        # The small file, then each chunk of the large one
+        self.assertEqual(progress, [4, 4, 8, 10])
+        with open(os.path.join(self.dbas.dbas_folder, '.large')) as f:
+            self.assertEqual(f.read(), 'x' * 10)
+
+    def test_skip_folder_holding_large_file(self):
+        os.makedirs(os.path.join(self.home, '.app', 'sub'))
+        self.create_file(os.path.join(self.home, '.app', 'a'))
+        with open(os.path.join(self.home, '.app', 'sub', 'large'), 'w') as f:
+            f.write('x' * 10)
+        self.dbas.apps['Test'] = ['.app']
+        self.dbas.large_file_policy = dbas.LARGE_FILE_POLICY_SKIP
+        self.dbas.copier = dbas.Copier(10)
+
+        # Found while copying, the folder is not walked before
+        original_walk = os.walk
+        os.walk = None
+        try:
+            result = self.dbas.backup(apps=['Test'])[0]
+        finally:
+            os.walk = original_walk
+
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.app', dbas.ACTION_SKIPPED_LARGE)])
+        self.assertFalse(self.dbas.copier.refuse_large)
+        # No partial copy is left behind
+        self.assertFalse(os.path.exists(os.path.join(self.dbas.dbas_folder,
+                                                     '.app')))
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.app')))
+
+    def test_large_file_leaves_backup_untouched(self):
+        for folder in (self.home, self.dbas.dbas_folder):
+            os.makedirs(os.path.join(folder, '.app'))
+            with open(os.path.join(folder, '.app', 'a'), 'w') as f:
+                f.write(folder)
+        with open(os.path.join(self.home, '.app', 'large'), 'w') as f:
+            f.write('x' * 10)
+        self.dbas.apps['Test'] = ['.app']
+        conflicts = []
+        self.dbas.conflict_callback = \
+            lambda mode, filename, filepath: conflicts.append(filename) or True
+        self.dbas.copier = dbas.Copier(10)
+
+        # Skipped, the backup is not half synced
+        self.dbas.large_file_policy = dbas.LARGE_FILE_POLICY_SKIP
+        result = self.dbas.backup(apps=['Test'])[0]
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.app', dbas.ACTION_SKIPPED_LARGE)])
+        self.assertEqual(sorted(os.listdir(os.path.join(
+            self.dbas.dbas_folder, '.app'))), ['a'])
+        with open(os.path.join(self.dbas.dbas_folder, '.app', 'a')) as f:
+            self.assertEqual(f.read(), self.dbas.dbas_folder)
+        self.assertEqual(self.dbas.snapshots.get_snapshots('Test'), [])
+
+        # Deferred, the replacement is asked once
+        conflicts[:] = []
+        self.dbas.conflict_count = 0
+        self.dbas.large_file_policy = dbas.LARGE_FILE_POLICY_DEFER
+        result = self.dbas.backup(apps=['Test'])[0]
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.app', dbas.ACTION_REPLACED)])
+        self.assertEqual(conflicts, ['.app'])
+        self.assertEqual(self.dbas.conflict_count, 1)
+        self.assertEqual(len(self.dbas.snapshots.get_snapshots('Test')), 1)
+        with open(os.path.join(self.dbas.dbas_folder, '.app', 'a')) as f:
+            self.assertEqual(f.read(), self.home)
+        self.assertTrue(os.path.islink(os.path.join(self.home, '.app')))
+
+    def test_failed_large_copy_is_removed(self):
+        src = os.path.join(self.home, 'large')
+        with open(src, 'w') as f:
+            f.write('x' * 10)
+        dst = os.path.join(self.home, 'copy')
+
+        def progress(path, copied, total):
+            raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+        copier = dbas.Copier(10, 4, progress)
+        self.assertRaises(IOError, copier.copy_file, src, os.stat(src), dst)
+        self.assertEqual(sorted(os.listdir(self.home)),
+                         ['Dropbox', 'large'])
+
+    def test_progress(self):
+        self.create_file(os.path.join(self.home, '.a'))
+        with open(os.path.join(self.home, '.b'), 'w') as f:
+            f.write('x' * 10)
+        self.dbas.apps['A'] = ['.a']
+        self.dbas.apps['B'] = ['.b']
+        stream = StringIO()
+        self.dbas.progress = dbas.Progress(stream, json_events=True,
+                                           interval=0)
+
+        self.dbas.backup(apps=['A', 'B'])
+        self.dbas.progress.close()
+
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        last = events[-1]
+        self.assertEqual(last['event'], 'done')
+        self.assertEqual((last['files_done'], last['files_total']), (2, 2))
+        self.assertEqual((last['bytes_done'], last['bytes_total']), (14, 14))
+        # Each application is measured against its own totals
+        self.assertIn({'app': 'B', 'app_files_done': 1, 'app_files_total': 1,
+                       'app_bytes_done': 10, 'app_bytes_total': 10},
+                      [dict((key, event.get(key)) for key in
+                            ('app', 'app_files_done', 'app_files_total',
+                             'app_bytes_done', 'app_bytes_total'))
+                       for event in events])
+
+        # Already in sync, nothing is left to copy
+        stream.truncate(0)
+        self.dbas.progress = dbas.Progress(stream, interval=0)
+        self.dbas.backup(apps=['A', 'B'])
+        self.dbas.progress.close()
+        self.assertIn('total 0/0 files, 0 B/0 B (100%)',
+                      stream.getvalue().splitlines()[-1])
+        # Not a terminal, one plain line by report
+        self.assertNotIn('\r', stream.getvalue())
+
+    def test_progress_on_terminal(self):
+        stream = StringIO()
+        stream.isatty = lambda: True
+        progress = dbas.Progress(stream, interval=0)
+        handler = dbas.BufferedStreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.before_write = progress.clear
+
+        progress.start_app('A')
+        line = stream.getvalue()
+        self.assertTrue(line.startswith('\rA: 0/0 files'))
+        # The line is blanked before logging anything
+        handler.emit(logging.LogRecord('dbas', logging.WARNING, __file__, 0,
+                                       'warning', None, None))
+        self.assertEqual(stream.getvalue(),
+                         line + '\r' + ' ' * (len(line) - 1) + '\rwarning\n')
+
+    def test_directory_backend(self):
+        folder = os.path.join(self.home, 'mnt')
+        os.mkdir(folder)
+        self.create_file(os.path.join(self.home, '.rc'))
+        directory = dbas.Dbas(home=self.home,
+                              backend=dbas.DirectoryBackend(folder),
+                              settle=True)
+        directory.confirm = lambda question: True
+        directory.apps['Test'] = ['.rc']
+
+        directory.backup(apps=['Test'])
+
+        # The backups are kept right in the folder
+        self.assertEqual(directory.dbas_folder, folder)
+        self.assertEqual(os.readlink(os.path.join(self.home, '.rc')),
+                         os.path.join(folder, '.rc'))
+        self.assertTrue(os.path.isfile(os.path.join(folder,
+                                                    dbas.MANIFEST_FILE)))
+        capabilities = directory.backend.capabilities
+        self.assertTrue(capabilities['hardlink'])
+        self.assertFalse([name for name in os.listdir(folder)
+                          if name.startswith('.dbas-probe-')])
+
+        # Nothing syncs the folder, restoring doesn't wait for it
+        directory.wait_for_dropbox = None
+        directory.restore(apps=['Test'])
+        directory.close()
+
+        # Nothing is tried in a Dropbox folder, every host would get it
+        original_mkdtemp = dbas.tempfile.mkdtemp
+        dbas.tempfile.mkdtemp = None
+        try:
+            self.assertTrue(self.dbas.backend.capabilities['hardlink'])
+        finally:
+            dbas.tempfile.mkdtemp = original_mkdtemp
+
+    def test_token_bucket(self):
+        waits = []
+        original_sleep = dbas.time.sleep
+        dbas.time.sleep = waits.append
+        try:
+            bucket = dbas.TokenBucket(100)
+            # A second worth is available at once
+            bucket.consume(100)
+            bucket.consume(50)
+        finally:
+            dbas.time.sleep = original_sleep
+
+        self.assertEqual(len(waits), 1)
+        self.assertAlmostEqual(waits[0], 0.5, places=1)
+
+    def test_throttle_by_instance(self):
+        limited = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox,
+                            max_kbytes_per_second=1)
+        # Another engine in the same process doesn't lift the limits
+        unlimited = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox,
+                              max_kbytes_per_second=0)
+        self.assertIsNotNone(limited.throttle.bytes)
+        self.assertIs(limited.copier.throttle, limited.throttle)
+        self.assertIs(limited.trash.throttle, limited.throttle)
+        self.assertIsNone(unlimited.throttle.bytes)
+        limited.close()
+        unlimited.close()
+
+    def test_remove_immutable_attribute(self):
+        folder = os.path.join(self.home, 'folder')
+        os.makedirs(os.path.join(folder, 'sub'))
+        for name in ('locked1', 'locked2', os.path.join('sub', 'locked3'),
+                     'free'):
+            self.create_file(os.path.join(folder, name))
+            os.chmod(os.path.join(folder, name), 0o644)
+
+        calls = []
+        looked = []
+
+        def is_immutable(path, path_stat=None):
+            looked.append(path)
+            return os.path.basename(path).startswith('locked')
+
+        originals = (dbas.subprocess.call, dbas.has_acl, dbas.is_immutable,
+                     dbas.PATHS_BY_CALL, os.walk)
+        dbas.subprocess.call = lambda command: calls.append(command)
+        dbas.has_acl = lambda path: False
+        dbas.is_immutable = is_immutable
+        dbas.PATHS_BY_CALL = 2
+        try:
+            cache = {}
+            attributes = dbas.remove_immutable_attribute(folder, cache)
+            if attributes is None:
+                self.skipTest("No command to remove the immutable attribute")
+            # Only the immutable files, in as few calls as possible
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(
+                sorted(path for command in calls for path in command[2:]),
+                sorted(os.path.join(folder, name) for name in (
+                    'locked1', 'locked2', os.path.join('sub', 'locked3'))))
+
+            # Files that did not change are not looked at again
+            del looked[:]
+            dbas.remove_immutable_attribute(folder, cache)
+            self.assertEqual(looked, [])
+
+            # chmod() reuses the walk looking for the attributes
+            os.walk = None
+            dbas.chmod(folder, cache=cache)
+        finally:
+            (dbas.subprocess.call, dbas.has_acl, dbas.is_immutable,
+             dbas.PATHS_BY_CALL, os.walk) = originals
+        self.assertEqual(os.stat(os.path.join(folder, 'free')).st_mode
+                         & 0o777, 0o600)
+        self.assertEqual(os.stat(os.path.join(folder, 'sub')).st_mode
+                         & 0o777, 0o700)
+
+    def test_attributes_cache_by_run(self):
+        other = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox)
+        self.assertIs(self.dbas.copier.attributes, self.dbas.attributes)
+        self.assertIsNot(other.attributes, self.dbas.attributes)
+        other.close()
+
+        self.dbas.attributes[(0, 0, 0)] = (True, True)
+        self.dbas.backup(apps=[])
+        self.assertEqual(self.dbas.attributes, {})
+
+    def test_rollback_and_conflicts_take_the_lock(self):
+        self.dbas.wait_for_lock = False
+        self.dbas.apps['Test'] = ['.rc']
+        lock = dbas.RunLock(os.path.join(self.home, dbas.DBAS_STATE_PATH))
+        for mode, run in (
+                (dbas.ROLLBACK_MODE, lambda: self.dbas.rollback('Test')),
+                (dbas.CONFLICTS_MODE, lambda: self.dbas.conflicts(
+                    dbas.CONFLICT_POLICY_NEWEST, apps=['Test']))):
+            lock.acquire(mode)
+            try:
+                self.assertRaisesRegexp(dbas.DbasError, 'already running',
+                                        run)
+            finally:
+                lock.release()
+
+        # Only reporting the conflicts doesn't need it
+        lock.acquire(dbas.CONFLICTS_MODE)
+        try:
+            self.assertEqual(self.dbas.conflicts(apps=['Test']), [])
+        finally:
+            lock.release()
+
+    def test_rollback_restore_replacement(self):
+        filepath = os.path.join(self.home, '.rc')
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.rc'))
+        with open(filepath, 'w') as f:
+            f.write('local')
+        self.dbas.confirm = lambda question: True
+        self.dbas.apps['Test'] = ['.rc']
+
+        inode = os.stat(filepath).st_ino
+        self.dbas.restore(apps=['Test'])
+        self.assertTrue(os.path.islink(filepath))
+        # The snapshot is the replaced file itself, not a copy
+        snapshot = self.dbas.snapshots.get_snapshots('Test')[-1]
+        self.assertEqual(os.stat(os.path.join(snapshot, 'files', '.rc'))
+                         .st_ino, inode)
+
+        result = self.dbas.rollback('Test')
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.rc', dbas.ACTION_ROLLED_BACK)])
+        self.assertFalse(os.path.islink(filepath))
+        with open(filepath) as f:
+            self.assertEqual(f.read(), 'local')
+
+    def test_snapshot_unnamed_app(self):
+        filepath = os.path.join(self.home, '.rc')
+        self.create_file(os.path.join(self.dbas.dbas_folder, '.rc'))
+        with open(filepath, 'w') as f:
+            f.write('local')
+        self.dbas.confirm = lambda question: True
+
+        dbas.ApplicationProfile(self.dbas, ['.rc']).restore()
+        self.assertTrue(os.path.islink(filepath))
+        self.assertEqual(
+            len(self.dbas.snapshots.get_snapshots(dbas.SNAPSHOTS_UNNAMED_APP)),
+            1)
+
+    def test_evict_snapshots_without_trash(self):
+        filepath = os.path.join(self.home, '.rc')
+        self.create_file(filepath)
+        snapshots = dbas.SnapshotStore(os.path.join(self.home, 'snapshots'),
+                                       max_count=1)
+        for run in ('1', '2'):
+            snapshots.run = run
+            snapshots.take('Test', '.rc', filepath)
+        snapshots.evict('Test')
+        self.assertEqual([os.path.basename(snapshot) for snapshot
+                          in snapshots.get_snapshots('Test')], ['2'])
+
+    def test_delete_to_trash(self):
+        filepath = os.path.join(self.home, '.rc')
+        self.create_file(filepath)
+        inode = os.stat(filepath).st_ino
+
+        dbas.delete(filepath, self.dbas.trash)
+        self.assertFalse(os.path.exists(filepath))
+        trashed = os.path.join(self.dbas.trash.run_folder, '1-.rc')
+        self.assertEqual(os.stat(trashed).st_ino, inode)
+
+        # The next run purges it when over the size limit
+        trash = dbas.Trash(self.dbas.trash.folder, max_size_mb=0)
+        trash.run = 'next'
+        trash.purge_in_background()
+        trash.wait()
+        self.assertFalse(os.path.exists(self.dbas.trash.run_folder))
+
+    def test_same_plist_in_another_format(self):
+        xml_path = os.path.join(self.home, 'xml.plist')
+        binary_path = os.path.join(self.home, 'binary.plist')
+        plistlib.writePlist({'b': 'x', 'a': 1}, xml_path)
+        # {'a': 1, 'b': 'x'} as a binary property list
+        with open(binary_path, 'wb') as f:
+            f.write('bplist00'
+                    '\xd2\x01\x02\x03\x04'
+                    'Qa' 'Qb' '\x10\x01' 'Qx'
+                    '\x08\x0d\x0f\x11\x13'
+                    + struct.pack('>6xBBQQQ', 1, 1, 5, 0, 21))
+
+        self.assertEqual(dbas.read_binary_plist(open(binary_path).read()),
+                         {'a': 1, 'b': 'x'})
+        self.assertTrue(dbas.same_content(xml_path, binary_path))
+
+        # Restoring it does not need to ask anything
+        os.rename(binary_path,
+                  os.path.join(self.dbas.dbas_folder, 'xml.plist'))
+        self.dbas.confirm = None
+        self.dbas.apps['Test'] = ['xml.plist']
+        result = self.dbas.restore(apps=['Test'])[0]
+        self.assertEqual(result.files[0].action, dbas.ACTION_LINKED)
+        self.assertTrue(os.path.islink(xml_path))
+
+    def test_malformed_plist(self):
+        truncated = os.path.join(self.home, 'truncated.plist')
+        empty = os.path.join(self.home, 'empty.plist')
+        with open(truncated, 'w') as f:
+            f.write('<?xml version="1.0"?><plist><dict><key>a')
+        open(empty, 'w').close()
+
+        # Compared by their bytes instead
+        self.assertEqual(dbas.content_digest(truncated),
+                         dbas.file_digest(truncated))
+        self.assertFalse(dbas.same_content(truncated, empty))
+        self.assertTrue(dbas.same_content(empty, empty))
+
+    def test_running_app_is_skipped(self):
+        self.create_file(os.path.join(self.home, '.rc'))
+        self.dbas.apps['Test'] = {'files': ['.rc'], 'processes': ['editor']}
+        self.dbas.apps['Other'] = ['.other']
+
+        snapshots = []
+
+        def get_running_process_names():
+            snapshots.append(None)
+            return set(['editor'])
+
+        original = dbas.get_running_process_names
+        dbas.get_running_process_names = get_running_process_names
+        try:
+            results = self.dbas.backup(apps=['Test', 'Other'])
+        finally:
+            dbas.get_running_process_names = original
+
+        # Deferred to the end of the run, then checked once more
+        self.assertEqual([(r.name, r.skipped) for r in results],
+                         [('Other', None), ('Test', 'running')])
+        self.assertEqual(len(snapshots), 2)
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.rc')))
+
+        # Another run of the same engine looks at the processes again
+        dbas.get_running_process_names = get_running_process_names
+        try:
+            results = self.dbas.backup(apps=['Test'])
+        finally:
+            dbas.get_running_process_names = original
+        self.assertEqual(len(snapshots), 4)
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.rc')))
+
+    def test_read_homes_file(self):
+        path = os.path.join(self.home, 'homes.txt')
+        with open(path, 'w') as f:
+            f.write('# Homes to back up\n'
+                    '/home/alice\n'
+                    '\n'
+                    '/home/bob\t/data/bob/Dropbox\n'
+                    '  /home/carol  \t  \n')
+
+        self.assertEqual(dbas.read_homes_file(path),
+                         [('/home/alice', None),
+                          ('/home/bob', '/data/bob/Dropbox'),
+                          ('/home/carol', None)])
+
+    def test_run_homes(self):
+        self.create_file(os.path.join(self.home, '.gitconfig'))
+        missing = os.path.join(self.home, 'missing')
+        os.mkdir(missing)
+
+        summaries = dbas.run_homes(
+            dbas.BACKUP_MODE, [(missing, os.path.join(missing, 'Dropbox')),
+                               (self.home, self.dropbox)], 2, {})
+
+        # Each home has its own summary, in order, a failure only stops its
+        # own home
+        self.assertEqual([summary['home'] for summary in summaries],
+                         [missing, self.home])
+        self.assertIn('Dropbox', summaries[0]['error'])
+        self.assertIsNone(summaries[1]['error'])
+        self.assertEqual(summaries[1]['counts'], {dbas.ACTION_BACKED_UP: 1})
+        self.assertTrue(os.path.islink(os.path.join(self.home, '.gitconfig')))
+
+    @unittest.skipUnless(os.getuid() == 0, "Gives the home to another user")
+    def test_homes_run_as_their_owner(self):
+        calls = []
+        originals = (os.geteuid, os.initgroups, os.setgroups, os.setgid,
+                     os.setuid, os.environ.get('HOME'))
+        os.geteuid = lambda: 0
+        os.initgroups = lambda user, gid: calls.append(('initgroups', gid))
+        os.setgroups = lambda gids: calls.append(('setgroups', gids[0]))
+        os.setgid = lambda gid: calls.append(('setgid', gid))
+        os.setuid = lambda uid: calls.append(('setuid', uid))
+        os.chown(self.home, 12345, 23456)
+        try:
+            summary = dbas.run_home((dbas.STATUS_MODE, self.home,
+                                     self.dropbox, {}))
+            home = os.environ['HOME']
+        finally:
+            (os.geteuid, os.initgroups, os.setgroups, os.setgid,
+             os.setuid, previous_home) = originals
+            os.environ['HOME'] = previous_home
+            os.chown(self.home, os.getuid(), os.getgid())
+
+        # Dropped before anything is created in the home
+        self.assertIsNone(summary['error'])
+        self.assertEqual([call[0] for call in calls],
+                         ['setgroups', 'setgid', 'setuid'])
+        self.assertEqual(calls[1:], [('setgid', 23456), ('setuid', 12345)])
+        self.assertEqual(home, self.home)
+
+    def test_failing_home_is_isolated(self):
+        broken = os.path.join(self.home, 'broken')
+        os.makedirs(os.path.join(broken, 'Dropbox', dbas.DBAS_DB_PATH))
+        with open(os.path.join(broken, 'apps.json'), 'w') as f:
+            f.write('{')
+        with open(os.path.join(broken, '.dbas.cfg'), 'w') as f:
+            f.write('[Custom Applications]\ndictionaryFile = ~/apps.json\n')
+
+        summaries = dbas.run_homes(
+            dbas.STATUS_MODE, [(broken, os.path.join(broken, 'Dropbox')),
+                               (self.home, self.dropbox)], 2, {})
+
+        # A malformed custom applications file only fails its own home
+        self.assertTrue(summaries[0]['error'].startswith('ValueError: '))
+        self.assertIsNone(summaries[1]['error'])
+
+    def test_merge_malformed_conflicted_plist(self):
+        path = os.path.join(self.dbas.dbas_folder, 'prefs.plist')
+        plistlib.writePlist({'a': 1}, path)
+        copy_path = os.path.join(self.dbas.dbas_folder,
+                                 "prefs (laptop's conflicted copy"
+                                 " 2013-10-01).plist")
+        with open(copy_path, 'w') as f:
+            f.write('<?xml version="1.0"?><plist><dict>')
+        os.utime(copy_path, (time.time() + 10, time.time() + 10))
+
+        # Not merged, the newest version is kept
+        self.assertEqual(dbas.resolve_conflicted_copies(
+            path, [copy_path], dbas.CONFLICT_POLICY_PLIST_MERGE),
+            dbas.ACTION_KEPT_NEWEST)
+        self.assertFalse(os.path.exists(copy_path))
+        with open(path) as f:
+            self.assertEqual(f.read(), '<?xml version="1.0"?><plist><dict>')
+
+    def test_failing_app_is_isolated(self):
+        for filename in ('.busy', '.broken', '.fine'):
+            self.create_file(os.path.join(self.home, filename))
+        self.dbas.apps['Busy'] = ['.busy']
+        self.dbas.apps['Broken'] = ['.broken']
+        self.dbas.apps['Fine'] = ['.fine']
+
+        links = []
+        original_symlink = os.symlink
+        original_backup = dbas.ApplicationProfile.backup
+
+        def symlink(target, link):
+            links.append(os.path.basename(link))
+            # Busy once, after the file was copied and moved to the trash
+            if links == ['.busy']:
+                raise OSError(errno.EBUSY, 'Device or resource busy')
+            original_symlink(target, link)
+
+        def backup(profile, filenames=None):
+            if profile.name == 'Broken':
+                raise ValueError('corrupt')
+            return original_backup(profile, filenames)
+
+        os.symlink = symlink
+        dbas.ApplicationProfile.backup = backup
+        delay, dbas.RETRY_DELAY_SECONDS = dbas.RETRY_DELAY_SECONDS, 0
+        try:
+            results = self.dbas.backup(apps=['Busy', 'Broken', 'Fine'])
+        finally:
+            os.symlink = original_symlink
+            dbas.ApplicationProfile.backup = original_backup
+            dbas.RETRY_DELAY_SECONDS = delay
+
+        # Only the link is made again, the other errors don't stop the run
+        errors = dict((result.name, result.error) for result in results)
+        self.assertEqual(errors, {'Busy': None,
+                                  'Broken': 'ValueError: corrupt',
+                                  'Fine': None})
+        self.assertEqual(links.count('.busy'), 2)
+        self.assertEqual([(f.filename, f.action) for f in results[0].files],
+                         [('.busy', dbas.ACTION_BACKED_UP)])
+        self.assertTrue(os.path.islink(os.path.join(self.home, '.busy')))
+        self.assertTrue(os.path.islink(os.path.join(self.home, '.fine')))
+        self.assertFalse(os.path.islink(os.path.join(self.home, '.broken')))
+
+    def test_resolve_conflicted_copies(self):
+        folder = os.path.join(self.dbas.dbas_folder, '.app')
+        os.mkdir(folder)
+        self.create_file(os.path.join(folder, 'same'))
+        self.create_file(os.path.join(
+            folder, "same (laptop's conflicted copy 2013-10-01)"))
+        with open(os.path.join(folder, 'rc.old'), 'w') as f:
+            f.write('old')
+        newest = os.path.join(
+            folder, "rc (laptop's conflicted copy 2013-10-01 (1)).old")
+        with open(newest, 'w') as f:
+            f.write('new')
+        os.utime(newest, (time.time() + 10, time.time() + 10))
+        plistlib.writePlist({'a': 1, 'b': {'c': 1}},
+                            os.path.join(folder, 'prefs.plist'))
+        plistlib.writePlist({'b': {'d': 2}}, os.path.join(
+            folder, "prefs (laptop's conflicted copy 2013-10-01).plist"))
+        self.dbas.apps['Test'] = ['.app']
+
+        self.assertEqual(sorted(dbas.find_conflicted_copies(
+            self.dbas.dbas_folder)), ['.app/prefs.plist', '.app/rc.old',
+                                      '.app/same'])
+        result = self.dbas.conflicts(dbas.CONFLICT_POLICY_PLIST_MERGE,
+                                     apps=['Test'])[0]
+        self.assertEqual([(f.filename, f.action) for f in result.files],
+                         [('.app/prefs.plist', dbas.ACTION_MERGED),
+                          ('.app/rc.old', dbas.ACTION_KEPT_NEWEST),
+                          ('.app/same', dbas.ACTION_DROPPED)])
+        self.assertEqual(sorted(os.listdir(folder)),
+                         ['prefs.plist', 'rc.old', 'same'])
+        with open(os.path.join(folder, 'rc.old')) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(dbas.read_plist(os.path.join(folder, 'prefs.plist')),
+                         {'a': 1, 'b': {'c': 1, 'd': 2}})
@@ -0,0 +1,154 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import dbas
+
+
+# Functions of the os module doing a filesystem syscall
+OS_SYSCALLS = ['stat', 'lstat', 'listdir', 'open', 'rename', 'remove',
+               'unlink', 'rmdir', 'mkdir', 'symlink', 'link', 'readlink',
+               'chmod', 'utime']
+
+# Budgets by managed file
+SUBPROCESSES_BY_FILE = 0
+SYSCALLS_BY_FILE = {'backup': 40, 'restore': 18, 'uninstall': 26}
+SYSCALLS_BY_FILE_IN_FOLDER = {'backup': 22, 'restore': 6, 'uninstall': 17}
+SYSCALLS_BY_UNCHANGED_FILE = {'backup': 12}
+# Attributes read again for a file already looked at during the run
+ATTRIBUTE_READS_BY_FILE_SEEN = 0
+
+# Number of files managed in each test
+FILE_COUNT = 50
+
+
+class CallCounter(object):
+    """Count the calls to some functions of a module, in a with block"""
+
+    def __init__(self, module, names):
+        self.module = module
+        self.names = names
+        self.counts = dict((name, 0) for name in names)
+        self.originals = {}
+
+    def _counting(self, name, function):
+        def counting(*args, **kwargs):
+            self.counts[name] += 1
+            return function(*args, **kwargs)
+        return counting
+
+    def __enter__(self):
+        for name in self.names:
+            self.originals[name] = getattr(self.module, name)
+            setattr(self.module, name,
+                    self._counting(name, self.originals[name]))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, function in self.originals.items():
+            setattr(self.module, name, function)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+class TestPerformance(unittest.TestCase):
+
+    def setUp(self):
+        # Fake a home with a Dropbox folder in it
+        self.home = tempfile.mkdtemp()
+        self.dropbox = os.path.join(self.home, 'Dropbox')
+        os.makedirs(os.path.join(self.dropbox, dbas.DBAS_DB_PATH))
+
+        self.dbas = dbas.Dbas(home=self.home, dropbox_folder=self.dropbox)
+        self.dbas.confirm = lambda question: True
+
+    def tearDown(self):
+        self.dbas.close()
+        shutil.rmtree(self.home)
+
+    def create_files(self, folder, count):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for index in range(count):
+            with open(os.path.join(folder, 'file{}'.format(index)), 'w') as f:
+                f.write('data {}'.format(index))
+
+    def measure(self, mode, app):
+        """Run a mode of the app, returns (subprocesses, os syscalls)"""
+        with CallCounter(subprocess, ['call']) as subprocesses:
+            with CallCounter(os, OS_SYSCALLS) as syscalls:
+                getattr(app, mode)()
+        return subprocesses.total, syscalls.total
+
+    def assert_budget(self, mode, app, file_count, syscalls_by_file):
+        subprocesses, syscalls = self.measure(mode, app)
+        self.assertTrue(subprocesses <= SUBPROCESSES_BY_FILE * file_count,
+                        "{} spawned {} processes for {} files"
+                        .format(mode, subprocesses, file_count))
+        self.assertTrue(syscalls <= syscalls_by_file[mode] * file_count,
+                        "{} made {} syscalls for {} files"
+                        .format(mode, syscalls, file_count))
+
+    def test_files(self):
+        # Many applications, a dotfile each
+        files = ['.file{}'.format(index) for index in range(FILE_COUNT)]
+        for filename in files:
+            with open(os.path.join(self.home, filename), 'w') as f:
+                f.write('data')
+        app = dbas.ApplicationProfile(self.dbas, files, 'Test')
+
+        self.assert_budget('backup', app, FILE_COUNT, SYSCALLS_BY_FILE)
+
+        # Restore on a fresh home
+        for filename in files:
+            os.remove(os.path.join(self.home, filename))
+        self.assert_budget('restore', app, FILE_COUNT, SYSCALLS_BY_FILE)
+
+        self.assert_budget('uninstall', app, FILE_COUNT, SYSCALLS_BY_FILE)
+
+    def test_folder(self):
+        # An application with a big folder, extra walks would show
+        self.create_files(os.path.join(self.home, '.app', 'sub'), FILE_COUNT)
+        self.create_files(os.path.join(self.home, '.app'), FILE_COUNT)
+        app = dbas.ApplicationProfile(self.dbas, ['.app'], 'Test')
+
+        self.assert_budget('backup', app, 2 * FILE_COUNT,
+                           SYSCALLS_BY_FILE_IN_FOLDER)
+
+        os.remove(os.path.join(self.home, '.app'))
+        self.assert_budget('restore', app, 2 * FILE_COUNT,
+                           SYSCALLS_BY_FILE_IN_FOLDER)
+
+        self.assert_budget('uninstall', app, 2 * FILE_COUNT,
+                           SYSCALLS_BY_FILE_IN_FOLDER)
+
+    def test_replace_folder(self):
+        # Replacing a backup only touches what changed
+        self.create_files(os.path.join(self.home, '.app'), FILE_COUNT)
+        app = dbas.ApplicationProfile(self.dbas, ['.app'], 'Test')
+        app.backup()
+        os.remove(os.path.join(self.home, '.app'))
+        dbas.clone(os.path.join(self.dbas.dbas_folder, '.app'),
+                   os.path.join(self.home, '.app'), hardlink=False)
+
+        self.assert_budget('backup', app, FILE_COUNT,
+                           SYSCALLS_BY_UNCHANGED_FILE)
+
+    def test_attributes_read_once(self):
+        # Copied then linked, the link doesn't read the attributes again
+        src = os.path.join(self.home, '.app')
+        self.create_files(src, FILE_COUNT * 2)
+        dst = os.path.join(self.dbas.dbas_folder, '.app')
+        dbas.copy(src, dst, self.dbas.copier)
+        shutil.rmtree(src)
+
+        with CallCounter(dbas, ['has_acl', 'is_immutable']) as reads:
+            dbas.link(dst, src, self.dbas.throttle, self.dbas.attributes)
+        self.assertTrue(reads.total <= ATTRIBUTE_READS_BY_FILE_SEEN
+                        * (FILE_COUNT * 2 + 1),
+                        "link read the attributes {} times"
+                        .format(reads.total))